@@ -0,0 +1,95 @@
+"""
+Benchmark of the DataFrames built for a job from a wide sheet: the previous reader, which loads every column as
+Python str objects with empty cells turned into 'nan', against the lean reader, which loads only the columns the job
+needs with a compact string dtype and keeps empty cells as missing values.
+
+Usage:
+    python benchmarks/bench_data_reader.py --rows 50000 --extra-columns 60 --languages 15
+"""
+
+import argparse
+from io import BytesIO
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from modules.data_reader import STRING_DTYPE, DataReader
+
+LANGUAGES = ['zh_CN', 'it', 'fr', 'de', 'ja', 'ko', 'pt_BR', 'es_419', 'tr', 'es', 'nl', 'ru', 'pl', 'sv', 'fi']
+SHEET = 'Skills'
+COLUMN = 'description (to translate)'
+
+
+def make_workbook(rows: int, extra_columns: int, languages: list) -> bytes:
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'id': range(rows), COLUMN: [f'Description of skill {i % 5000}, with a few more words.' if i % 10 else None
+                                                    for i in range(rows)]})
+    for position in range(extra_columns):
+        # a mix of numeric, categorical and sparse columns that the job never translates
+        if position % 3 == 0:
+            df[f'metric {position}'] = rng.random(rows)
+        elif position % 3 == 1:
+            df[f'category {position}'] = rng.choice(['Skill', 'Knowledge', 'Competency'], rows)
+        else:
+            df[f'note {position}'] = [f'note {i}' if i % 7 == 0 else None for i in range(rows)]
+    for lang_code in languages:
+        df[f'{lang_code} description'] = None
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer) as writer:
+        df.to_excel(writer, sheet_name=SHEET, index=False)
+    return buffer.getvalue()
+
+
+def previous_reader(worksheet, usecols: list) -> pd.DataFrame:
+    rows = worksheet.iter_rows(values_only=True)
+    header = next(rows)
+    df = pd.DataFrame(list(rows), columns=list(header))
+    df = df.where(df.notna(), np.nan)
+    for col in df.columns:
+        df[col] = df[col].astype(str)
+    return df
+
+
+def lean_reader(worksheet, usecols: list) -> pd.DataFrame:
+    return DataReader().read_worksheet(worksheet, usecols)
+
+
+def measure(run, worksheet, usecols: list):
+    tracemalloc.start()
+    start = time.perf_counter()
+    df = run(worksheet, usecols)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    to_translate = int((df[COLUMN].notna() & (df[COLUMN] != 'nan')).sum())
+    return df, elapsed, peak, to_translate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--extra-columns', type=int, default=60)
+    parser.add_argument('--languages', type=int, default=15)
+    args = parser.parse_args()
+
+    languages = LANGUAGES[:args.languages]
+    content = make_workbook(args.rows, args.extra_columns, languages)
+    worksheet = openpyxl.load_workbook(BytesIO(content))[SHEET]
+    usecols = [COLUMN] + [f'{lang_code} {pattern}' for pattern in ('name', 'description') for lang_code in languages]
+    print(f'sheet: {args.rows} rows, {worksheet.max_column} columns, string dtype: {STRING_DTYPE}')
+    for name, run in [('previous', previous_reader), ('lean', lean_reader)]:
+        df, elapsed, peak, to_translate = measure(run, worksheet, usecols)
+        print(f'{name:>10}: {elapsed:.2f}s, {len(df.columns)} columns, '
+              f'DataFrame {df.memory_usage(deep=True).sum() / 1e6:.1f} MB, peak {peak / 1e6:.1f} MB, '
+              f'{to_translate} cells to translate')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark of the assembly of the translations of a sheet column into its target columns: the previous path, which
+grows a list per column, scans the columns for every language and updates the full sheet DataFrame, against ResultSink,
+which fills preallocated arrays aligned to the sheet rows. The results arrive shuffled, like from concurrent requests.
+
+Usage:
+    python benchmarks/bench_result_assembly.py --rows 100000 --languages 15
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import pandas as pd
+
+from modules.result_sink import ResultSink
+
+LANGUAGES = ['zh_CN', 'it', 'fr', 'de', 'ja', 'ko', 'pt_BR', 'es_419', 'tr', 'es', 'nl', 'ru', 'pl', 'sv', 'fi']
+COLUMN = 'description (to translate)'
+
+
+def make_sheet(rows: int, languages: list) -> pd.DataFrame:
+    df = pd.DataFrame({'id': range(rows), COLUMN: [f'Description of skill {i}' for i in range(rows)]})
+    for lang_code in languages:
+        df[f'{lang_code} description'] = None
+    return df.astype('string')
+
+
+def make_results(df: pd.DataFrame, languages: list) -> list:
+    results = [(index, [f'{text} [{lang_code}]' for lang_code in languages]) for index, text in df[COLUMN].items()]
+    random.Random(0).shuffle(results)
+    return results
+
+
+def previous_assembly(df: pd.DataFrame, results: list, languages: list) -> pd.DataFrame:
+    columns = []
+    for language_code in languages:
+        for col in df.columns:
+            if col == f'{language_code} description':
+                columns.append(col)
+    update_data = {'index': []}
+    for col in columns:
+        update_data[col] = []
+    for index, translations in results:
+        update_data['index'].append(index)
+        for lang_index, translation in enumerate(translations):
+            update_data[columns[lang_index]].append(translation)
+    updated_df = pd.DataFrame(update_data).set_index('index')
+    df = df.copy()
+    df.update(updated_df)
+    return df
+
+
+def sink_assembly(df: pd.DataFrame, results: list, languages: list) -> pd.DataFrame:
+    sink = ResultSink(df, languages, 'description')
+    sink.add(results)
+    return sink.to_df()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--languages', type=int, default=15)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    languages = LANGUAGES[:args.languages]
+    df = make_sheet(args.rows, languages)
+    results = make_results(df, languages)
+    print(f'sheet: {args.rows} rows, {len(languages)} languages')
+    outputs = {}
+    for name, run in [('previous', previous_assembly), ('sink', sink_assembly)]:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            outputs[name] = run(df, results, languages)
+            timings.append(time.perf_counter() - start)
+        print(f'{name:>10}: {min(timings):.3f}s')
+    columns = list(outputs['sink'].columns)
+    assert outputs['previous'][columns].astype(object).equals(outputs['sink'].astype(object)), 'outputs differ'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Benchmark of the cold start of the API: import time of its modules, measured with python -X importtime, and the time
+from the launch of src/bootstrapper.py until /health and /ready answer, as the Streamlit app waits for them.
+
+The API is started with the simulated model, in a temporary directory with a copy of params.yaml, so no api key is needed.
+
+Usage:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --repeat 5 --top 15 --mode async process --json startup.json
+"""
+
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+import yaml
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SRC = os.path.join(ROOT, 'src')
+IMPORT_TIME = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| *(\S+)')
+
+
+def import_times(module: str) -> dict:
+    """
+    Self and cumulative import time in seconds of every module imported by a fresh interpreter importing module
+    """
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=SRC,
+                               capture_output=True, text=True, check=True)
+    times = {}
+    for line in completed.stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        if match:
+            self_us, cumulative_us, name = match.groups()
+            times[name] = {'self': int(self_us) / 1e6, 'cumulative': int(cumulative_us) / 1e6}
+    return times
+
+
+def top_level_packages(times: dict) -> dict:
+    """
+    Import time per top-level package, the sum of the self times of its modules
+    """
+    packages = {}
+    for name, time_ in times.items():
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + time_['self']
+    return packages
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url: str, deadline: float) -> bool:
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.02)
+    return False
+
+
+def time_to_ready(params: dict, timeout: float) -> dict:
+    """
+    Launch the API like the Streamlit app does and time its /health and /ready probes
+    """
+    with tempfile.TemporaryDirectory(prefix='bench_startup_') as workdir:
+        with open(os.path.join(workdir, 'params.yaml'), 'w') as f:
+            yaml.safe_dump(params, f)
+        port = free_port()
+        start = time.monotonic()
+        process = subprocess.Popen([sys.executable, os.path.join(SRC, 'bootstrapper.py'), '127.0.0.1', str(port)], cwd=workdir,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = start + timeout
+            health = time.monotonic() - start if wait_for(f'http://127.0.0.1:{port}/health', deadline) else None
+            ready = time.monotonic() - start if wait_for(f'http://127.0.0.1:{port}/ready', deadline) else None
+        finally:
+            process.kill()
+            process.wait()
+    return {'health_seconds': health, 'ready_seconds': ready}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='api.api_wrapper', help='module whose import time is measured')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each measure, the median is reported')
+    parser.add_argument('--top', type=int, default=10, help='packages with the longest import time to report')
+    parser.add_argument('--mode', nargs='+', default=['async', 'process'], choices=['async', 'process'])
+    parser.add_argument('--timeout', type=float, default=120.0, help='seconds to wait for the API to be ready')
+    parser.add_argument('--params', default=os.path.join(ROOT, 'params.yaml'))
+    parser.add_argument('--json', help='write the results to this file, to compare runs')
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.repeat)]
+    total = statistics.median(run[args.module]['cumulative'] for run in runs)
+    packages = {}
+    for run in runs:
+        for package, seconds in top_level_packages(run).items():
+            packages.setdefault(package, []).append(seconds)
+    packages = sorted(((package, statistics.median(seconds)) for package, seconds in packages.items()), key=lambda item: -item[1])
+
+    print(f'\nimport {args.module}: {total:.3f}s (median of {args.repeat})')
+    for package, seconds in packages[:args.top]:
+        print(f'  {package:<32} {seconds:>7.3f}s')
+
+    with open(args.params) as f:
+        params = yaml.safe_load(f)
+    params['model']['provider'] = 'fake'
+    params['translation_memory'] = {'enabled': False}
+    results = {'import_seconds': total, 'packages': dict(packages[:args.top]), 'startup': []}
+    print(f"\n{'mode':>8} {'/health s':>10} {'/ready s':>10}")
+    for mode in args.mode:
+        params['parallel_processing']['mode'] = mode
+        timings = [time_to_ready(params, args.timeout) for _ in range(args.repeat)]
+        result = {'mode': mode}
+        for probe in ('health_seconds', 'ready_seconds'):
+            values = [timing[probe] for timing in timings if timing[probe] is not None]
+            result[probe] = statistics.median(values) if len(values) == len(timings) else None
+        results['startup'].append(result)
+        print(f"{mode:>8} " + ' '.join(f'{result[probe]:>10.2f}' if result[probe] is not None else f"{'timeout':>10}"
+                                       for probe in ('health_seconds', 'ready_seconds')))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""
+Offline end-to-end benchmark of translation jobs, with the simulated chat model instead of OpenAI.
+Every job reads a synthetic workbook, translates it with the engine of params.yaml and writes the output, like a job
+of the API. The latency distribution, the error and 429 rates and the output length of the model are configurable.
+
+Reports per job: rows/sec, translated items/sec, latency percentiles of the model calls, peak memory (RSS of the API
+process and its workers) and CPU time.
+
+Usage:
+    python benchmarks/bench_translation_service.py --rows 100 1000 5000 --languages 5 --mode async process
+    python benchmarks/bench_translation_service.py --rows 2000 --rate-limit-rate 0.05 --tokens-per-minute 2000000 --json results.json
+"""
+
+import argparse
+import hashlib
+from io import BytesIO
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import numpy as np
+import pandas as pd
+import psutil
+import yaml
+
+from api.api_wrapper import FastAPI_Wrapper
+from modules.fake_model import FakeModelConfig
+from modules.job_manager import Job
+from modules.model_config import ModelConfig
+
+LANGUAGES = ['zh_CN', 'it', 'fr', 'de', 'ja', 'ko', 'pt_BR', 'es_419', 'tr', 'es', 'nl', 'ru', 'pl', 'sv', 'fi']
+SHEET = 'Skills'
+NAME = 'name (to translate)'
+DESCRIPTION = 'description (to translate)'
+WORDS = ('manage', 'team', 'project', 'customer', 'data', 'analysis', 'design', 'quality', 'safety', 'planning',
+         'communication', 'budget', 'software', 'process', 'training', 'risk', 'strategy', 'report', 'service', 'research')
+
+
+def make_workbook(rows: int, languages: list, unique_ratio: float, seed: int = 0) -> bytes:
+    """
+    A sheet of skill names and descriptions, unique_ratio of the rows having a distinct text
+    """
+    rng = np.random.default_rng(seed)
+    distinct = max(1, int(rows * unique_ratio))
+    names = [' '.join(rng.choice(WORDS, 2)).capitalize() + f' {i}' for i in range(distinct)]
+    descriptions = [' '.join(rng.choice(WORDS, rng.integers(15, 60))).capitalize() + f' {i}.' for i in range(distinct)]
+    picks = rng.integers(0, distinct, rows)
+    df = pd.DataFrame({'id': range(rows), NAME: [names[i] for i in picks], DESCRIPTION: [descriptions[i] for i in picks]})
+    for lang_code in languages:
+        df[f'{lang_code} name'] = None
+        df[f'{lang_code} description'] = None
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer) as writer:
+        df.to_excel(writer, sheet_name=SHEET, index=False)
+    return buffer.getvalue()
+
+
+class ResourceSampler:
+    """
+    Samples the memory and CPU time of this process and of its children (the worker pool) in a background thread
+    """
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.peak_rss = 0
+        self._cpu = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._process = psutil.Process()
+        self._start_cpu = self._process_cpu()
+
+    def _process_cpu(self) -> float:
+        times = self._process.cpu_times()
+        return times.user + times.system
+
+    def _sample(self):
+        rss = 0
+        for process in [self._process] + self._process.children(recursive=True):
+            try:
+                rss += process.memory_info().rss
+                times = process.cpu_times()
+                self._cpu[process.pid] = times.user + times.system
+            except psutil.NoSuchProcess:
+                continue
+        self.peak_rss = max(self.peak_rss, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        # the workers of a pool started before the job already used some CPU, only the CPU of the job is counted
+        self._sample()
+        self._baseline = {pid: cpu for pid, cpu in self._cpu.items() if pid != self._process.pid}
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    @property
+    def cpu_seconds(self) -> float:
+        children = sum(cpu - self._baseline.get(pid, 0) for pid, cpu in self._cpu.items() if pid != self._process.pid)
+        return self._process_cpu() - self._start_cpu + children
+
+
+def store_upload(app: FastAPI_Wrapper, params: dict, content: bytes) -> str:
+    """
+    Put the workbook in the upload store of the app under its sha256, like an upload of /translate, and return the hash.
+    The upload is pinned like an upload of /translate, until the job releases it.
+    """
+    file_hash = hashlib.sha256(content).hexdigest()
+    uploads = app.get_upload_store(params)
+    with open(os.path.join(uploads.config.dir, file_hash), 'wb') as f:
+        f.write(content)
+    uploads.acquire(file_hash)
+    return file_hash
+
+
+def run_job(app: FastAPI_Wrapper, params: dict, model_config: ModelConfig, content: bytes, languages: list, output_dir: str) -> dict:
+    job = Job(f'bench_{time.time_ns()}')
+    file_hash = store_upload(app, params, content)
+    pairs = [{'sheet': SHEET, 'columns': [NAME, DESCRIPTION]}]
+    output_path = os.path.join(output_dir, f'{job.job_id}.xlsx')
+    with ResourceSampler() as sampler:
+        start = time.perf_counter()
+        app.run_job(job, params, model_config, file_hash, pairs, languages, output_path)
+        elapsed = time.perf_counter() - start
+    status = job.to_status()
+    if status.status != 'completed':
+        raise RuntimeError(f'Job failed: {status.errors}')
+    items = sum(status.languages.values())
+    return {'seconds': elapsed, 'texts': status.rows_total, 'items': items, 'items_failed': status.items_failed,
+            'items_per_sec': items / elapsed, 'peak_rss_mb': sampler.peak_rss / 1e6, 'cpu_seconds': sampler.cpu_seconds}
+
+
+def read_latencies(path: str) -> dict:
+    if not os.path.exists(path):
+        return {'requests': 0}
+    with open(path) as f:
+        latencies = np.array([float(line) for line in f if line.strip()])
+    os.remove(path)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (0, 0, 0)
+    return {'requests': len(latencies), 'p50': p50, 'p95': p95, 'p99': p99}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--languages', type=int, default=5)
+    parser.add_argument('--unique-ratio', type=float, default=0.5, help='share of the rows with a distinct text')
+    parser.add_argument('--mode', nargs='+', default=['async', 'process'], choices=['async', 'process'])
+    parser.add_argument('--num-processes', type=int, help='defaults to params.yaml')
+    parser.add_argument('--max-concurrency', type=int, help='defaults to params.yaml')
+    parser.add_argument('--no-rate-limit', action='store_true', help='disable the rate limiter, to measure the engine alone')
+    parser.add_argument('--tokens-per-minute', type=int, help='budget of the rate limiter, defaults to params.yaml')
+    parser.add_argument('--requests-per-minute', type=int, help='budget of the rate limiter, defaults to params.yaml')
+    parser.add_argument('--params', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'params.yaml'))
+    parser.add_argument('--latency-median', type=float, default=0.5)
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--latency-per-output-token', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--output-ratio', type=float, default=1.0)
+    parser.add_argument('--output-dir', default=tempfile.mkdtemp(prefix='bench_translation_service_'))
+    parser.add_argument('--json', help='write the results to this file, to compare runs')
+    args = parser.parse_args()
+
+    with open(args.params) as f:
+        params = yaml.safe_load(f)
+    # every run starts cold and leaves nothing behind
+    params['translation_memory'] = {'enabled': False}
+    params['journal'] = {'enabled': False}
+    params['uploads'] = {'dir': os.path.join(args.output_dir, 'uploads'), 'cache_parsed': False}
+    if args.num_processes:
+        params['parallel_processing']['num_processes'] = args.num_processes
+    if args.max_concurrency:
+        params['parallel_processing']['max_concurrency'] = args.max_concurrency
+    rate_limit = params.setdefault('rate_limit', {})
+    if args.no_rate_limit:
+        rate_limit['enabled'] = False
+    if args.tokens_per_minute:
+        rate_limit['tokens_per_minute'] = args.tokens_per_minute
+    if args.requests_per_minute:
+        rate_limit['requests_per_minute'] = args.requests_per_minute
+
+    latency_log = os.path.join(args.output_dir, 'latencies.log')
+    fake_model = FakeModelConfig(latency_median=args.latency_median, latency_sigma=args.latency_sigma,
+                                 latency_per_output_token=args.latency_per_output_token, rate_limit_rate=args.rate_limit_rate,
+                                 error_rate=args.error_rate, output_ratio=args.output_ratio, latency_log=latency_log)
+    model_config = ModelConfig(openai_api_key='', llm_provider='fake', fake_model=fake_model,
+                               max_retries=0 if rate_limit.get('enabled', False) else 2)
+    languages = LANGUAGES[:args.languages]
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    results = []
+    for mode in args.mode:
+        params['parallel_processing']['mode'] = mode
+        app = FastAPI_Wrapper()
+        try:
+            for rows in args.rows:
+                content = make_workbook(rows, languages, args.unique_ratio)
+                result = {'mode': mode, 'rows': rows, 'languages': len(languages)}
+                result.update(run_job(app, params, model_config, content, languages, args.output_dir))
+                result['rows_per_sec'] = rows / result['seconds']
+                result.update(read_latencies(latency_log))
+                results.append(result)
+        finally:
+            if app.pool is not None:
+                app.pool.close()
+                app.pool.join()
+
+    print(f"\n{'mode':>8} {'rows':>7} {'seconds':>8} {'rows/s':>8} {'items/s':>8} {'failed':>6} {'requests':>8} "
+          f"{'p50':>6} {'p95':>6} {'p99':>6} {'peak MB':>8} {'CPU s':>6}")
+    for result in results:
+        print(f"{result['mode']:>8} {result['rows']:>7} {result['seconds']:>8.2f} {result['rows_per_sec']:>8.1f} "
+              f"{result['items_per_sec']:>8.1f} {result['items_failed']:>6} {result['requests']:>8} "
+              f"{result.get('p50', 0):>6.2f} {result.get('p95', 0):>6.2f} {result.get('p99', 0):>6.2f} "
+              f"{result['peak_rss_mb']:>8.0f} {result['cpu_seconds']:>6.1f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
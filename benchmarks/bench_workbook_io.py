@@ -0,0 +1,86 @@
+"""
+Benchmark of the workbook I/O of a job: the previous path, which parses every selected sheet again before
+regenerating it with pandas, against Workbook, which parses the sheets once and patches the translated cells.
+
+Usage:
+    python benchmarks/bench_workbook_io.py --rows 100000 --languages 15
+"""
+
+import argparse
+from io import BytesIO
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import pandas as pd
+
+from modules.data_reader import DataReader
+from modules.result_sink import ResultSink
+from modules.workbook import Workbook
+
+LANGUAGES = ['zh_CN', 'it', 'fr', 'de', 'ja', 'ko', 'pt_BR', 'es_419', 'tr', 'es', 'nl', 'ru', 'pl', 'sv', 'fi']
+SHEET = 'Skills'
+COLUMN = 'description (to translate)'
+
+
+def make_workbook(rows: int, languages: list) -> bytes:
+    df = pd.DataFrame({'id': range(rows), 'type': 'Skill', COLUMN: [f'Description of skill {i}, with a few more words.' for i in range(rows)]})
+    for lang_code in languages:
+        df[f'{lang_code} description'] = None
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer) as writer:
+        df.to_excel(writer, sheet_name=SHEET, index=False)
+        df.head(100).to_excel(writer, sheet_name='Notes', index=False)
+    return buffer.getvalue()
+
+
+def fake_results(df: pd.DataFrame, languages: list) -> list:
+    return [(index, [f'{text} [{lang_code}]' for lang_code in languages]) for index, text in df[COLUMN].items()]
+
+
+def translated_df(df: pd.DataFrame, languages: list) -> pd.DataFrame:
+    sink = ResultSink(df, languages, 'description')
+    sink.add(fake_results(df, languages))
+    return sink.to_df()
+
+
+def previous_io(content: bytes, languages: list, output_path: str):
+    file_stream = BytesIO(content)
+    df = DataReader().read_excel(file_stream, sheet_name=SHEET)
+    updated_df = translated_df(df, languages)
+    with pd.ExcelWriter(output_path) as writer:
+        file_stream.seek(0)
+        original_df = DataReader().read_excel(file_stream, sheet_name=SHEET)
+        original_df.update(updated_df)
+        original_df.to_excel(writer, index=False, sheet_name=SHEET)
+
+
+def workbook_io(content: bytes, languages: list, output_path: str):
+    workbook = Workbook(BytesIO(content), {SHEET: None})
+    df = workbook.sheets[SHEET]
+    workbook.update(SHEET, translated_df(df, languages))
+    workbook.save(output_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--languages', type=int, default=15)
+    parser.add_argument('--output-dir', default=tempfile.mkdtemp(prefix='bench_workbook_io_'))
+    args = parser.parse_args()
+
+    languages = LANGUAGES[:args.languages]
+    os.makedirs(args.output_dir, exist_ok=True)
+    content = make_workbook(args.rows, languages)
+    print(f'workbook: {args.rows} rows, {len(languages)} languages, {len(content) / 1e6:.1f} MB')
+    for name, run in [('previous', previous_io), ('workbook', workbook_io)]:
+        start = time.perf_counter()
+        run(content, languages, os.path.join(args.output_dir, f'{name}.xlsx'))
+        print(f'{name:>10}: {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
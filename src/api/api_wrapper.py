@@ -3,35 +3,49 @@
 Contains the main `FastAPI_Wrapper` class, which wraps `FastAPI`.
 """
 
-from collections import defaultdict
-from io import BytesIO
+import asyncio
+import cProfile
+import importlib
 import json
-from multiprocessing import Pool
+from multiprocessing import Pool, Queue
 import os
 import psutil
 import time
 import threading
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
 from fastapi import FastAPI
 from fastapi import File, UploadFile, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-import pandas as pd
-import yaml
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 
+from modules.job_setup import OUTPUT_DIR, assemble, load_config, make_router, open_translation_memory, read_plan
+from modules.metrics import RATE_LIMIT_CONCURRENCY, REGISTRY, WORK_QUEUE_UNITS, drain
 from modules.model_config import ModelConfig
-from modules.data_reader import DataReader
-from services import TranslationService
-from utils.utils import convert_to_df
+from modules.job_journal import JobJournal, job_id
+from modules.job_manager import Job, JobManager, JobRetentionConfig, JobStatus
+from modules.packing import PackingConfig
+from modules.rate_limiter import RateLimitConfig, RateLimiter, SharedRateLimiter
+from modules.scheduling import JobEstimate, SchedulingConfig
+from modules.source_hashes import DeltaConfig
+from modules.translation_memory import TranslationMemory
+from modules.upload_store import UploadConfig, UploadStore
+from modules.work_queue import WorkQueue, WorkQueueConfig
 
-from utils.logger import setup_logger
+if TYPE_CHECKING:
+    from modules.stream_pipeline import Translator
 
-global completed
-completed = False
+from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
 CORS_ALLOW_ORIGINS=['http://localhost', 'http://localhost:5000', 'http://localhost:8765', 'http://127.0.0.1:5000']
-
+# seconds between two progress events of a job, and between two keep-alive events when nothing changes
+EVENTS_MIN_INTERVAL = 0.5
+EVENTS_KEEP_ALIVE = 15
+# langchain, openai, pandas and openpyxl take most of the startup time: they are imported after the API is up, see warm_up
+ENGINE_MODULES = ('services', 'modules.translation_prompt', 'modules.translation_plan', 'modules.workbook',
+                  'modules.result_sink', 'modules.stream_pipeline')
 class FastAPI_Wrapper(FastAPI):
 
     def __init__(self):
@@ -42,6 +56,23 @@ class FastAPI_Wrapper(FastAPI):
         
         super().__init__()
 
+        # worker pool and rate limiter shared by all the jobs, created once with a chain per worker
+        self.pool = None
+        self.rate_limiter = None
+        self._pool_lock = threading.Lock()
+        # metrics sent by the workers of the pool
+        self._metrics_queue = None
+        # queue of the work units translated by the workers of src/worker.py, in 'queue' mode
+        self.work_queue = None
+        # uploaded files, by the hash of their content
+        self.uploads = None
+        self.jobs = JobManager()
+        # config loaded once at startup, and readiness of the translation engine
+        self.params = None
+        self.model_config = None
+        self.startup_error = None
+        self._ready = threading.Event()
+
         origins = CORS_ALLOW_ORIGINS
 
         self.add_middleware(
@@ -52,14 +83,44 @@ class FastAPI_Wrapper(FastAPI):
             allow_headers=["*"],
         )
 
+        @self.on_event("startup")
+        def startup():
+            try:
+                self.params, self.model_config = load_config()
+            except Exception as e:
+                self.startup_error = f'Invalid config: {e}'
+                logger.error(f'{self.startup_error}. Jobs are refused until the API is restarted.')
+                return
+            self.jobs.config = JobRetentionConfig(**self.params.get('jobs', {}))
+            # the API answers /health right away, and /ready once the engine is loaded
+            threading.Thread(target=self.warm_up, name='warm_up', daemon=True).start()
+
+        @self.on_event("shutdown")
+        def stop_pool():
+            with self._pool_lock:
+                if self.pool is not None:
+                    logger.info('Shutting down the worker pool...')
+                    self.pool.close()
+                    self.pool.join()
+                    self.pool = None
+                    self._metrics_queue.put(None)
+                if self.work_queue is not None:
+                    self.work_queue.close()
+                    self.work_queue = None
+                if isinstance(self.rate_limiter, SharedRateLimiter):
+                    self.rate_limiter.close()
+                    self.rate_limiter = None
+
         # Add shutdown event (would only be of any use in a multi-process, not multi-thread situation)
         @self.get("/shutdown")
         async def shutdown():
 
             def suicide():
                 time.sleep(1)
-                pool.terminate()
-                pool.join()
+                with self._pool_lock:
+                    if self.pool is not None:
+                        self.pool.terminate()
+                        self.pool.join()
                 myself = psutil.Process(os.getpid())
                 myself.kill()
 
@@ -67,80 +128,484 @@ class FastAPI_Wrapper(FastAPI):
             logger.info(f'>>> Successfully killed API <<<')
             return {"success": True}  
 
+        @self.get("/health")
+        def health():
+            """
+            Liveness probe: the API process is up
+            """
+            return {"status": "ok"}
+
+        @self.get("/ready")
+        def ready():
+            """
+            Readiness probe: the config is valid and the translation engine is loaded. 503 until then.
+            """
+            if self._ready.is_set():
+                return {"ready": True}
+            return JSONResponse(status_code=503, content={"ready": False, "detail": self.startup_error or "starting"})
+
         @self.post("/translate")
-        async def translate(file: UploadFile = File(...), data: str = Form(...)):
+        async def translate(file: Optional[UploadFile] = File(None), data: str = Form(...)):
+            """
+            Translate the selected sheet columns of the file. A file uploaded before can be given by its "file_hash"
+            in data instead, see /uploads/{file_hash}.
+            """
             try:
-                file_content = await file.read()
-                with open('params.yaml', 'r') as f:
-                    params = yaml.safe_load(f)
-                num_processes = params['parallel_processing']['num_processes']
-
-                with open('llm_config.yaml', 'r') as f:
-                    llm_config = yaml.safe_load(f)
-                api_key = llm_config['openai']['api_key']
-                model_config = ModelConfig(openai_api_key=api_key, 
-                                        llm_model_name=params["model"]["model_name"],
-                                        temperature=params["model"]["temperature"])
-
-                file_stream = BytesIO(file_content)
+                params, model_config = self.get_config()
+
                 data_dict = json.loads(data)
                 sheet_column_pairs = data_dict["sheet_column_pairs"]
                 selected_languages = data_dict["selected_languages"]
 
                 if sheet_column_pairs is None:
                     raise HTTPException(status_code=400, detail="sheet_column_pairs not provided")
+                file_hash = await self.receive_upload(params, file, data_dict)
+
+                try:
+                    # the same file with the same selection resumes the journal of an interrupted job
+                    try:
+                        job = self.jobs.create(job_id(bytes.fromhex(file_hash), sheet_column_pairs, selected_languages))
+                    except ValueError as e:
+                        raise HTTPException(status_code=409, detail=str(e))
+
+                    os.makedirs(OUTPUT_DIR, exist_ok=True)
+                    final_output_path = os.path.join(OUTPUT_DIR, f'translated_combined_{job.job_id}.xlsx')
+
+                    threading.Thread(target=self.run_profiled, daemon=True,
+                                     args=(self.run_job, job, params, model_config, file_hash, sheet_column_pairs, selected_languages, final_output_path)).start()
+                except BaseException:
+                    # the job releases its upload once started
+                    self.get_upload_store(params).release(file_hash)
+                    raise
+
+                return {"status": "success", "file_path": final_output_path, "job_id": job.job_id, "file_hash": file_hash}
+            except HTTPException:
+                raise
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=str(e))
+
+        @self.post("/translate_stream")
+        async def translate_stream(file: UploadFile = File(...), data: str = Form(...)):
+            """
+            Translate the columns of a CSV or JSON lines file chunk by chunk, for files too large for /translate.
+            The output has the same format as the input, with the translations in the '{language_code} name'
+            or '{language_code} description' columns.
+            """
+            from modules.stream_pipeline import stream_format
+            file_format = stream_format(file.filename)
+            if file_format is None:
+                raise HTTPException(status_code=400, detail="Only .csv, .jsonl and .ndjson files can be streamed")
+            try:
+                params, model_config = self.get_config()
+                data_dict = json.loads(data)
+                columns = data_dict.get("columns")
+                selected_languages = data_dict["selected_languages"]
+                if not columns:
+                    raise HTTPException(status_code=400, detail="columns not provided")
+
+                # the upload is spooled to disk, the file is never held in memory
+                file_hash = await self.get_upload_store(params).save(file)
 
-                df_sheet = defaultdict(list)
-                output_dir = "translated_files"
-                os.makedirs(output_dir, exist_ok=True)
-
-                global pool
-                pool = Pool(num_processes)
-
-                final_output_path = os.path.join(output_dir, f'translated_combined.xlsx')
-                def translate_runner():
-                    for pair in sheet_column_pairs:
-                        sheet = pair.get("sheet")
-                        columns = pair.get("columns")
-                        df = DataReader().read_excel(file_stream, sheet_name=sheet)
-                        for column in columns:
-                            text_index_pairs = list(zip(df.index.tolist(), df[column].tolist()))
-
-                            logger.info(f'translating sheet {sheet} column {column}...')
-                            sheet_results = TranslationService(num_processes, model_config, text_index_pairs, selected_languages).translate_apply_sync(pool)
-
-                            updated_df = convert_to_df(df, sheet_results, selected_languages, ('name' if 'name' in column else 'description'))
-
-                            logger.info(f'translated sheet {sheet} column {column}')
-                            df_sheet[sheet].append(updated_df)
-                    
-                    pool.close()
-                    pool.join()
-                    # Combine all the translated DataFrames and save to a single Excel file
-                    
-                    with pd.ExcelWriter(final_output_path) as writer:
-                        for sheet_name, dfs in df_sheet.items():
-                            logger.info(f"Processing sheet: {sheet_name}")
-                            # Read the original DataFrame from the file stream once
-                            file_stream.seek(0)  # Reset the file stream pointer to the beginning
-                            original_df = DataReader().read_excel(file_stream, sheet_name=sheet_name)
-                            for updated_df in dfs:
-                                original_df.update(updated_df)            
-                            original_df.to_excel(writer, index=False, sheet_name=sheet_name)
-
-                    global completed
-                    completed = True
-
-                threading.Thread(target=translate_runner, daemon=True).start()
-
-                return {"status": "success", "file_path": final_output_path}
+                try:
+                    try:
+                        job = self.jobs.create(job_id(bytes.fromhex(file_hash), columns, selected_languages))
+                    except ValueError as e:
+                        raise HTTPException(status_code=409, detail=str(e))
+
+                    os.makedirs(OUTPUT_DIR, exist_ok=True)
+                    output_path = os.path.join(OUTPUT_DIR, f'translated_stream_{job.job_id}.{file_format}')
+                    threading.Thread(target=self.run_profiled, daemon=True,
+                                     args=(self.run_stream_job, job, params, model_config, file_hash, file_format, columns, selected_languages, output_path)).start()
+                except BaseException:
+                    # the job releases its upload once started
+                    self.get_upload_store(params).release(file_hash)
+                    raise
+
+                return {"status": "success", "file_path": output_path, "job_id": job.job_id, "file_hash": file_hash}
+            except HTTPException:
+                raise
             except Exception as e:
                 raise HTTPException(status_code=500, detail=str(e))
-            
+
+        @self.post("/estimate", response_model=JobEstimate)
+        async def estimate(file: Optional[UploadFile] = File(None), data: str = Form(...)):
+            """
+            Estimated requests, tokens, cost and duration of the translation of the file, without translating it.
+            The sheets read for the estimate are kept, so translating the same file next doesn't read it again.
+            """
+            try:
+                params, model_config = self.get_config()
+                data_dict = json.loads(data)
+                if data_dict.get("sheet_column_pairs") is None:
+                    raise HTTPException(status_code=400, detail="sheet_column_pairs not provided")
+                file_hash = await self.receive_upload(params, file, data_dict)
+                try:
+                    return await asyncio.to_thread(self.estimate_job, params, model_config, file_hash,
+                                                   data_dict["sheet_column_pairs"], data_dict["selected_languages"])
+                finally:
+                    self.get_upload_store(params).release(file_hash)
+            except HTTPException:
+                raise
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=str(e))
+
+        @self.get("/uploads/{file_hash}")
+        def get_upload(file_hash: str):
+            """
+            Whether the API has the file with the sha256 hash, so that a client can submit it by its hash instead of uploading it again
+            """
+            params, _ = self.get_config()
+            path = self.get_upload_store(params).path(file_hash)
+            if path is None:
+                raise HTTPException(status_code=404, detail=f"Upload {file_hash} not found")
+            return {"file_hash": file_hash, "size": os.path.getsize(path)}
+
+        @self.get("/jobs", response_model=List[JobStatus])
+        def list_jobs():
+            return [job.to_status() for job in self.jobs.list()]
+
+        @self.get("/jobs/{job_id}", response_model=JobStatus)
+        def get_job(job_id: str):
+            job = self.jobs.get(job_id)
+            if job is None:
+                raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+            return job.to_status()
+
+        @self.get("/jobs/{job_id}/events")
+        async def job_events(job_id: str):
+            """
+            Server-sent events stream of the progress of a job. A 'progress' event is pushed when the job changes,
+            and a final 'done' event when it completes or fails.
+            """
+            job = self.jobs.get(job_id)
+            if job is None:
+                raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+            async def stream():
+                version = -1
+                while True:
+                    version = await asyncio.to_thread(job.progress.wait_for_change, version, EVENTS_KEEP_ALIVE)
+                    active = job.active
+                    yield f"event: {'progress' if active else 'done'}\ndata: {job.to_status().model_dump_json()}\n\n"
+                    if not active:
+                        break
+                    # coalesce the updates of fast jobs
+                    await asyncio.sleep(EVENTS_MIN_INTERVAL)
+
+            return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+        @self.get("/metrics", response_class=PlainTextResponse)
+        def metrics():
+            """
+            Metrics of the model calls and of the jobs, in the Prometheus text format
+            """
+            if self.rate_limiter is not None:
+                RATE_LIMIT_CONCURRENCY.set(self.rate_limiter.concurrency)
+            if self.work_queue is not None:
+                units = self.work_queue.stats()
+                for state in ('queued', 'leased', 'done', 'failed'):
+                    WORK_QUEUE_UNITS.set(units.get(state, 0), state=state)
+            return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
         @self.get("/completed")
-        def completed():
-            global completed
-            # Check if the translation process is completed using a global variable that you can get from the main thread
-            return {"completed": completed}
+        def completed(job_id: Optional[str] = None):
+            # Without a job id, tells whether every submitted job is done
+            if job_id is not None:
+                job = self.jobs.get(job_id)
+                if job is None:
+                    raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+                return {"completed": not job.active}
+            return {"completed": bool(self.jobs.list()) and self.jobs.active_count() == 0}
+
+    def get_config(self) -> Tuple[dict, ModelConfig]:
+        """
+        The params and model config loaded at startup
+        """
+        if self.params is None:
+            raise HTTPException(status_code=503, detail=self.startup_error or "The API is starting")
+        return self.params, self.model_config
+
+    async def receive_upload(self, params: dict, file: Optional[UploadFile], data_dict: dict) -> str:
+        """
+        Store the uploaded file and return its hash, or check the "file_hash" of data_dict when no file is uploaded.
+        The upload is pinned in the store: the caller releases it once the job using it ends.
+        """
+        uploads = self.get_upload_store(params)
+        if file is not None:
+            return await uploads.save(file)
+        file_hash = data_dict.get("file_hash")
+        if not file_hash:
+            raise HTTPException(status_code=400, detail="Neither a file nor a file_hash provided")
+        if not uploads.acquire(file_hash):
+            raise HTTPException(status_code=404, detail=f"Upload {file_hash} not found, upload the file again")
+        return file_hash
+
+    def warm_up(self):
+        """
+        Import the translation engine and start the worker pool of the process mode, then mark the API ready
+        """
+        start = time.perf_counter()
+        try:
+            for module in ENGINE_MODULES:
+                importlib.import_module(module)
+            rate_limiter = self.get_rate_limiter(self.params)
+            mode = self.params['parallel_processing'].get('mode', 'process')
+            if mode == 'process':
+                self.get_pool(self.params['parallel_processing']['num_processes'], self.model_config, rate_limiter,
+                              make_router(self.params, self.model_config).model_configs())
+            elif mode == 'queue':
+                self.get_work_queue(self.params)
+        except Exception as e:
+            self.startup_error = f'Could not load the translation engine: {e}'
+            logger.error(self.startup_error)
+            return
+        self._ready.set()
+        logger.info(f'API ready, engine loaded in {time.perf_counter() - start:.1f}s')
+
+    def run_profiled(self, run, job: Job, params: dict, *args):
+        """
+        Run a job with run(job, params, *args), under cProfile if profiling is enabled in params.
+        The stats are dumped to {dir}/{job_id}.prof, e.g. for snakeviz. The workers of the pool are not profiled.
+        """
+        profiling = params.get('profiling', {})
+        if not profiling.get('enabled', False):
+            return run(job, params, *args)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return run(job, params, *args)
+        finally:
+            profiler.disable()
+            os.makedirs(profiling.get('dir', 'profiles'), exist_ok=True)
+            profile_path = os.path.join(profiling.get('dir', 'profiles'), f'{job.job_id}.prof')
+            profiler.dump_stats(profile_path)
+            logger.info(f'Job {job.job_id}: profile written to {profile_path}')
+
+    def run_job(self, job: Job, params: dict, model_config: ModelConfig, file_hash: str,
+                sheet_column_pairs: List[dict], selected_languages: List[str], final_output_path: str):
+        """
+        Translate the selected sheet columns of the uploaded file and write them to final_output_path.
+        Releases the upload, pinned when the job was submitted.
+        """
+        translation_memory = None
+        journal = None
+        file_stream = None
+        try:
+            uploads = self.get_upload_store(params)
+            file_stream = uploads.open(file_hash)
+            translation_memory = open_translation_memory(params, model_config)
+            journal_params = params.get('journal', {})
+            if journal_params.get('enabled', False):
+                journal = JobJournal(os.path.join(journal_params.get('dir', 'jobs'), f'{job.job_id}.jsonl'))
+
+            job.set_stage('reading')
+            workbook, plan = read_plan(file_stream, sheet_column_pairs, selected_languages,
+                                       DeltaConfig(**params.get('delta', {})).enabled, uploads.artifacts(file_hash))
+            job.progress.skipped(plan.items_skipped)
+            # with the sheets read from the artifacts, the workbook is parsed while the texts are translated
+            workbook.preload()
+
+            job.set_stage('translating')
+            translate = self.make_translator(job, params, model_config, selected_languages, translation_memory, journal)
+            unit_results, failed_items = translate(plan.text_index_pairs(), plan.unit_kinds(), plan.unit_languages())
+
+            job.set_stage('assembling')
+            assemble(workbook, plan, selected_languages, unit_results)
+
+            # Patch the translated cells into the original workbook
+            job.set_stage('writing')
+            workbook.save(final_output_path)
+
+            failed_path = None
+            failed_cells = plan.failed_cells(failed_items)
+            if failed_cells:
+                failed_path = os.path.join(OUTPUT_DIR, f'translated_combined_failed_{job.job_id}.json')
+                with open(failed_path, 'w', encoding='utf-8') as f:
+                    json.dump(failed_cells, f, ensure_ascii=False, indent=2)
+                logger.warning(f'{len(failed_cells)} cells failed to translate and were left unchanged, see {failed_path}. '
+                               f'Submit the same job again to retry them.')
+            if journal is not None:
+                # keep the journal when items failed, so that a new run only retries them
+                if failed_cells:
+                    journal.close()
+                else:
+                    journal.remove()
+                journal = None
+            job.finish(final_output_path, failed_path)
+        except Exception as e:
+            job.fail(e)
+        finally:
+            if translation_memory is not None:
+                translation_memory.close()
+            if journal is not None:
+                journal.close()
+            if file_stream is not None:
+                file_stream.close()
+            self.get_upload_store(params).release(file_hash)
+
+    def estimate_job(self, params: dict, model_config: ModelConfig, file_hash: str, sheet_column_pairs: List[dict],
+                     selected_languages: List[str]) -> JobEstimate:
+        """
+        Estimate the requests, tokens, cost and duration of a job without translating it. Texts found in the translation memory are free.
+        """
+        from services import TranslationService
+
+        uploads = self.get_upload_store(params)
+        with uploads.open(file_hash) as file_stream:
+            _, plan = read_plan(file_stream, sheet_column_pairs, selected_languages, DeltaConfig(**params.get('delta', {})).enabled,
+                                uploads.artifacts(file_hash))
+        translation_memory = open_translation_memory(params, model_config)
+        try:
+            service = TranslationService(params['parallel_processing']['num_processes'], model_config, plan.text_index_pairs(),
+                                         selected_languages,
+                                         translation_memory=translation_memory,
+                                         packing=PackingConfig(**params.get('packing', {})),
+                                         rate_limiter=self.get_rate_limiter(params),
+                                         scheduling=SchedulingConfig(**params.get('scheduling', {})),
+                                         router=make_router(params, model_config),
+                                         kinds=plan.unit_kinds(),
+                                         unit_languages=plan.unit_languages())
+            return service.estimate(self.concurrency(params))
+        finally:
+            if translation_memory is not None:
+                translation_memory.close()
+
+    def concurrency(self, params: dict) -> int:
+        """
+        Requests in flight at a time for the engine of params
+        """
+        mode = params['parallel_processing'].get('mode', 'process')
+        if mode == 'async':
+            return params['parallel_processing'].get('max_concurrency', 64)
+        if mode == 'queue':
+            # the number of workers is not known in advance, the estimate assumes a single one
+            return WorkQueueConfig(**params.get('work_queue', {})).worker_concurrency
+        return params['parallel_processing']['num_processes']
+
+    def run_stream_job(self, job: Job, params: dict, model_config: ModelConfig, file_hash: str, file_format: str,
+                       columns: List[str], selected_languages: List[str], output_path: str):
+        """
+        Translate the columns of an uploaded CSV or JSON lines file chunk by chunk to output_path.
+        Releases the upload, pinned when the job was submitted.
+        """
+        from modules.stream_pipeline import StreamingTranslationPipeline
+
+        translation_memory = None
+        try:
+            translation_memory = open_translation_memory(params, model_config)
+            # the journal keeps all the translations of a job in memory, so streamed jobs are not journaled
+            translate = self.make_translator(job, params, model_config, selected_languages, translation_memory)
+            failed_path = os.path.join(OUTPUT_DIR, f'translated_stream_failed_{job.job_id}.jsonl')
+            pipeline = StreamingTranslationPipeline(translate, columns, selected_languages,
+                                                    chunksize=params.get('streaming', {}).get('chunksize', 1000),
+                                                    failed_path=failed_path,
+                                                    prefetch_chunks=params.get('streaming', {}).get('prefetch_chunks', 1))
+            job.set_stage('translating')
+            input_path = self.get_upload_store(params).path(file_hash)
+            if input_path is None:
+                raise FileNotFoundError(f'No upload {file_hash}')
+            rows = pipeline.run(input_path, output_path, file_format)
+            logger.info(f'Job {job.job_id}: translated {rows} rows to {output_path}')
+            if pipeline.cells_failed:
+                logger.warning(f'{pipeline.cells_failed} cells failed to translate and were left unchanged, see {failed_path}')
+            job.finish(output_path, failed_path if pipeline.cells_failed else None)
+        except Exception as e:
+            job.fail(e)
+        finally:
+            if translation_memory is not None:
+                translation_memory.close()
+            self.get_upload_store(params).release(file_hash)
+
+    def make_translator(self, job: Job, params: dict, model_config: ModelConfig, selected_languages: List[str],
+                        translation_memory: Optional[TranslationMemory] = None, journal: Optional[JobJournal] = None) -> 'Translator':
+        """
+        Return a function translating (index, text) pairs to the selected languages with the engine of params,
+        which returns the results and the failed (index, language) items
+        """
+        from services import TranslationService
+
+        num_processes = params['parallel_processing']['num_processes']
+        mode = params['parallel_processing'].get('mode', 'process')
+        max_concurrency = params['parallel_processing'].get('max_concurrency', 64)
+        packing = PackingConfig(**params.get('packing', {}))
+        scheduling = SchedulingConfig(**params.get('scheduling', {}))
+        router = make_router(params, model_config)
+
+        # the pool and the rate limiter are shared by all the jobs
+        rate_limiter = self.get_rate_limiter(params)
+        pool = self.get_pool(num_processes, model_config, rate_limiter, router.model_configs()) if mode == 'process' else None
+        work_queue = self.get_work_queue(params) if mode == 'queue' else None
+        # a single service translates all the calls, e.g. all the chunks of a streamed job
+        service = TranslationService(num_processes, model_config, [], selected_languages,
+                                     translation_memory=translation_memory,
+                                     packing=packing,
+                                     rate_limiter=rate_limiter,
+                                     journal=journal,
+                                     progress=job.progress,
+                                     scheduling=scheduling,
+                                     router=router)
+
+        def translate(text_index_pairs: List[Tuple[int, str]], kinds: Optional[Dict[int, str]] = None,
+                      unit_languages: Optional[Dict[int, List[str]]] = None):
+            service.set_texts(text_index_pairs, kinds, unit_languages)
+            if mode == 'async':
+                results = asyncio.run(service.translate_async(max_concurrency))
+            elif mode == 'queue':
+                results = service.translate_queue(work_queue, job.job_id, self.concurrency(params))
+            else:
+                results = service.translate_apply_sync(pool)
+            return results, service.failed_items
+
+        return translate
+
+    def get_rate_limiter(self, params: dict) -> Optional[RateLimiter]:
+        """
+        Return the rate limiter of the app if enabled, creating it on first use.
+        In 'queue' mode the model is only called by the workers, which share the rate limiter of the queue file:
+        the app opens it too, only to estimate the jobs and report its state on /metrics.
+        """
+        with self._pool_lock:
+            if self.rate_limiter is None:
+                rate_limit_config = RateLimitConfig(**params.get('rate_limit', {}))
+                if rate_limit_config.enabled:
+                    if params['parallel_processing'].get('mode', 'process') == 'queue':
+                        config = WorkQueueConfig(**params.get('work_queue', {}))
+                        self.rate_limiter = SharedRateLimiter(rate_limit_config, config.path, config.lease_seconds)
+                    else:
+                        self.rate_limiter = RateLimiter(rate_limit_config)
+            return self.rate_limiter
+
+    def get_upload_store(self, params: dict) -> UploadStore:
+        """
+        Return the upload store of the app, creating it on first use
+        """
+        with self._pool_lock:
+            if self.uploads is None:
+                self.uploads = UploadStore(UploadConfig(**params.get('uploads', {})))
+            return self.uploads
+
+    def get_work_queue(self, params: dict) -> WorkQueue:
+        """
+        Return the work queue of the app, opening it on first use
+        """
+        with self._pool_lock:
+            if self.work_queue is None:
+                self.work_queue = WorkQueue(WorkQueueConfig(**params.get('work_queue', {})))
+                logger.info(f'Translating with the workers of the queue {self.work_queue.config.path}')
+            return self.work_queue
+
+    def get_pool(self, num_processes: int, model_config: ModelConfig, rate_limiter: Optional[RateLimiter] = None,
+                 profiles: Optional[Dict[str, ModelConfig]] = None) -> Pool:
+        """
+        Return the worker pool of the app, creating it on first use. Every worker builds the chains of every routing
+        profile once in init_worker, so the profiles of params.yaml are fixed for the life of the pool.
+        """
+        from services import init_worker
 
+        with self._pool_lock:
+            if self.pool is None:
+                logger.info(f'Starting a pool of {num_processes} workers...')
+                self._metrics_queue = Queue()
+                threading.Thread(target=drain, args=(self._metrics_queue,), daemon=True).start()
+                self.pool = Pool(num_processes, initializer=init_worker, initargs=(model_config, rate_limiter, self._metrics_queue, profiles))
+            return self.pool
@@ -4,12 +4,14 @@ This is the main Streamlit app that allows users to upload an Excel file, select
  the download link for the translated file.
 """
 
+import hashlib
 import json
 import time
 from typing import List
 import sys
 from urllib.parse import quote
 
+import openpyxl
 import pandas as pd
 import requests
 import streamlit as st
@@ -18,21 +20,80 @@ import streamlit as st
 API_HOST='127.0.0.1'
 API_PORT=5000
 API_BASE_URL=f'http://{API_HOST}:{API_PORT}'
+# seconds to wait for the API server to be ready after starting it
+API_READY_TIMEOUT=120
+# hidden sheet of the delta translation with the hashes of the sources, see src/modules/source_hashes.py
+SOURCE_HASH_SHEET='_source_hashes'
+# uploaded workbooks whose metadata is kept in the cache of the app, and rows of the preview of a sheet
+WORKBOOK_CACHE_ENTRIES=8
+PREVIEW_ROWS=20
+# connections to the progress events of a job retried in a row before giving up, and seconds between two of them
+EVENTS_MAX_RECONNECTS=5
+EVENTS_RECONNECT_DELAY=2
 
 
 # Add the src directory to the system path to access utility functions
-def get_column_names_for_translation(df, pattern="(to translate)"):
+def get_column_names_for_translation(columns: List[str], pattern="(to translate)"):
     """
-    Gets the column names that contain the pattern in the DataFrame.
+    Gets the column names that contain the pattern.
     """
-    return [col for col in df.columns if pattern in col]
+    return [col for col in columns if pattern in col]
 
 
-def get_languages_from_df_column_names(df: pd.DataFrame) -> List[str]:
+def get_languages_from_column_names(columns: List[str]) -> List[str]:
     """
     # Assumes that the column name is in the format: {language_code} description
     """
-    return [col.replace(' description', '') for col in df.columns if ' description' in col]
+    return [col.replace(' description', '') for col in columns if ' description' in col]
+
+
+def get_file_hash(uploaded_file) -> str:
+    """
+    The sha256 of the uploaded file, computed once per upload as Streamlit reruns the script on every widget change
+    """
+    file_hashes = st.session_state.setdefault("file_hashes", {})
+    if uploaded_file.file_id not in file_hashes:
+        file_hashes[uploaded_file.file_id] = hashlib.sha256(uploaded_file.getbuffer()).hexdigest()
+    return file_hashes[uploaded_file.file_id]
+
+
+@st.cache_data(max_entries=WORKBOOK_CACHE_ENTRIES, show_spinner="Reading the sheets of the workbook...")
+def inspect_workbook(file_hash: str, _uploaded_file) -> dict:
+    """
+    Columns, row count and languages of every sheet, read from the header row only, in the order of the workbook.
+    Cached per file hash, so the workbook is not parsed again on every rerun.
+    """
+    _uploaded_file.seek(0)
+    workbook = openpyxl.load_workbook(_uploaded_file, read_only=True)
+    try:
+        sheets = {}
+        for worksheet in workbook.worksheets:
+            header = next(worksheet.iter_rows(max_row=1, values_only=True), ())
+            columns = [str(name) for name in header if name is not None]
+            # the row count comes from the dimension stored in the file, files written without it have none
+            rows = worksheet.max_row - 1 if worksheet.max_row else None
+            sheets[worksheet.title] = {"columns": columns, "rows": rows, "languages": get_languages_from_column_names(columns)}
+        return sheets
+    finally:
+        workbook.close()
+
+
+@st.cache_data(max_entries=WORKBOOK_CACHE_ENTRIES, show_spinner=False)
+def preview_sheet(file_hash: str, sheet_name: str, _uploaded_file, rows: int = PREVIEW_ROWS) -> pd.DataFrame:
+    """
+    The first rows of a sheet, reading no further into the file
+    """
+    _uploaded_file.seek(0)
+    workbook = openpyxl.load_workbook(_uploaded_file, read_only=True)
+    try:
+        values = list(workbook[sheet_name].iter_rows(max_row=rows + 1, values_only=True))
+    finally:
+        workbook.close()
+    if not values:
+        return pd.DataFrame()
+    header = [str(name) if name is not None else f"Unnamed: {position}" for position, name in enumerate(values[0])]
+    data = [list(row[:len(header)]) + [None] * (len(header) - len(row)) for row in values[1:]]
+    return pd.DataFrame(data, columns=header)
 
 
 def create_session_state():
@@ -54,9 +115,12 @@ def create_session_state():
     if "API_STARTED" not in st.session_state:
         st.session_state.API_STARTED = False
 
+    if "JOB_ID" not in st.session_state:
+        st.session_state.JOB_ID = None
+
 
-def column_selector(df, sheet_name, i):
-    possible_column_names = get_column_names_for_translation(df)
+def column_selector(columns, sheet_name, i):
+    possible_column_names = get_column_names_for_translation(columns)
     selected_columns = st.session_state.sheet_column_pairs[i]["columns"]
     for col in possible_column_names:
         if st.checkbox(col, key=f"{sheet_name}_column_{col}_{i}", value=col in selected_columns):
@@ -67,7 +131,7 @@ def column_selector(df, sheet_name, i):
                 selected_columns.remove(col)
 
 
-def select_sheet_column_pairs_and_get_languages(excel_file, uploaded_file):
+def select_sheet_column_pairs_and_get_languages(sheets, uploaded_file, file_hash):
     all_languages = []
 
     def add_pair():
@@ -77,7 +141,7 @@ def select_sheet_column_pairs_and_get_languages(excel_file, uploaded_file):
             st.warning("All sheets have been selected. Cannot add more. You can change the selected sheets/columns.")
 
     # Display the sheet-column pairs
-    possible_sheets = excel_file.sheet_names
+    possible_sheets = [sheet for sheet in sheets if sheet != SOURCE_HASH_SHEET]
     for i, pair in enumerate(st.session_state.sheet_column_pairs):
         with st.expander(f"Selected sheet {i+1}", expanded=True):
             sheet_name = st.selectbox(
@@ -87,12 +151,17 @@ def select_sheet_column_pairs_and_get_languages(excel_file, uploaded_file):
             )
             if sheet_name:
                 st.session_state.sheet_column_pairs[i]["sheet"] = sheet_name
-                df = pd.read_excel(uploaded_file, sheet_name=sheet_name)
+                sheet = sheets[sheet_name]
+                rows = f"{sheet['rows']} rows" if sheet["rows"] is not None else "unknown number of rows"
+                st.caption(f"{rows}, {len(sheet['columns'])} columns")
+
+                column_selector(sheet["columns"], sheet_name, i)
 
-                column_selector(df, sheet_name, i)
+                if st.checkbox("Preview the first rows", key=f"preview_{i}"):
+                    st.dataframe(preview_sheet(file_hash, sheet_name, uploaded_file))
 
                 if not all_languages:
-                    all_languages = get_languages_from_df_column_names(df)
+                    all_languages = sheet["languages"]
         possible_sheets = [sh for sh in possible_sheets if sh != sheet_name]
 
     st.button("Add a sheet name for translation", on_click=add_pair)
@@ -131,16 +200,54 @@ def select_languages(all_languages):
                         st.session_state.selected_languages.remove(lang)
 
 
-def run_translation(uploaded_file):
-    with st.spinner('Translating...'):
+def wait_for_api(timeout: float = API_READY_TIMEOUT) -> bool:
+    """
+    Poll the readiness probe of the API until it is ready to translate, and return False if it isn't after timeout seconds
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
         try:
-            uploaded_file.seek(0)
+            response = requests.get(f"{API_BASE_URL}/ready", timeout=2)
+            if response.status_code == 200:
+                return True
+            detail = response.json().get("detail")
+            if detail and detail != "starting":
+                # an invalid config won't fix itself
+                st.error(f"The API server could not start: {detail}")
+                return False
+        except requests.exceptions.RequestException:
+            # the server is not listening yet
+            pass
+        time.sleep(0.2)
+    st.error(f"The API server was not ready after {timeout}s.")
+    return False
+
+
+def is_uploaded(file_hash: str) -> bool:
+    """
+    Whether the API already has the file, e.g. from a previous translation of the same workbook
+    """
+    try:
+        return requests.get(f"{API_BASE_URL}/uploads/{file_hash}", timeout=5).status_code == 200
+    except requests.exceptions.RequestException:
+        return False
 
-            files = {"file": uploaded_file}
+
+def run_translation(uploaded_file, file_hash: str):
+    with st.spinner('Translating...'):
+        try:
             data = {
                 "sheet_column_pairs": st.session_state.sheet_column_pairs,
                 "selected_languages": st.session_state.selected_languages
             }
+            # a file the API has is submitted by its hash, instead of being uploaded again
+            files = None
+            if is_uploaded(file_hash):
+                data["file_hash"] = file_hash
+            else:
+                uploaded_file.seek(0)
+                files = {"file": uploaded_file}
+
             headers = {
                 "accept": "application/json",
             }
@@ -152,10 +259,68 @@ def run_translation(uploaded_file):
 
             if not response.status_code == 200:
                 st.error(f'Error in translation: {response.text}')
+                return None
+            return response.json().get("job_id")
         except Exception as e:
             st.error(f"Error in translation: {str(e)}")
 
 
+def show_job_progress(job: dict, progress_bar, details):
+    if job["rows_total"]:
+        progress_bar.progress(job["rows_done"] / job["rows_total"],
+                              text=f"{job['rows_done']}/{job['rows_total']} texts translated ({job['stage'] or job['status']})")
+    eta = f", about {int(job['eta_seconds'])}s left" if job["eta_seconds"] is not None else ""
+    skipped = f" Up to date: {job['items_skipped']}." if job.get("items_skipped") else ""
+    details.caption(f"{job['throughput']} translations/s{eta}. Per language: {job['languages']}. Failed: {job['items_failed']}.{skipped}")
+
+
+def get_job(job_id: str):
+    """
+    Current status of the job, None if the API doesn't answer or doesn't know the job
+    """
+    try:
+        response = requests.get(f"{API_BASE_URL}/jobs/{job_id}", timeout=5)
+    except requests.exceptions.RequestException:
+        return None
+    return response.json() if response.status_code == 200 else None
+
+
+def follow_job_progress(job_id: str):
+    """
+    Render the progress of the job from the server-sent events of the API, and return the last status of the job.
+    A lost event stream is opened again, after checking with the status of the job that it is still running.
+    """
+    progress_bar = st.progress(0.0, text="Waiting for the translation to start...")
+    details = st.empty()
+    job = None
+    failures = 0
+    while failures < EVENTS_MAX_RECONNECTS:
+        try:
+            with requests.get(f"{API_BASE_URL}/jobs/{job_id}/events", stream=True, timeout=(5, 60)) as response:
+                if response.status_code != 200:
+                    return job
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    job = json.loads(line[len("data:"):])
+                    failures = 0
+                    show_job_progress(job, progress_bar, details)
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.exceptions.Timeout) as e:
+            print(f"Lost the progress events of job {job_id}: {e}")
+        if job is not None and job["status"] in ("completed", "failed"):
+            return job
+        failures += 1
+        time.sleep(EVENTS_RECONNECT_DELAY)
+        # the job may have ended while the stream was down
+        status = get_job(job_id)
+        if status is not None:
+            job = status
+            show_job_progress(job, progress_bar, details)
+            if job["status"] in ("completed", "failed"):
+                return job
+    return job
+
+
 def main():
     st.title("Translator App")
 
@@ -167,12 +332,13 @@ def main():
 
     if uploaded_file is not None:
         st.success("File uploaded successfully")
-        excel_file = pd.ExcelFile(uploaded_file)
+        file_hash = get_file_hash(uploaded_file)
+        sheets = inspect_workbook(file_hash, uploaded_file)
 
         st.markdown("<h4>Select Sheet[s] to Translate:</h4>", unsafe_allow_html=True)
         st.write("The app will display the sheets in the uploaded Excel file. You can select the sheets and columns to translate and the languages to translate to. Only the columns with '(to translate)' in their names will be displayed.")
 
-        all_languages = select_sheet_column_pairs_and_get_languages(excel_file, uploaded_file)
+        all_languages = select_sheet_column_pairs_and_get_languages(sheets, uploaded_file, file_hash)
 
         display_selected_sheet_column_pairs()
 
@@ -201,8 +367,10 @@ def main():
                 thread = threading.Thread(name="fastapi_translation_bootstrapper", target=start_api, args=(job,), daemon=True)
                 thread.start()
 
-                time.sleep(2)
-                run_translation(uploaded_file)
+                with st.spinner('Waiting for the API server...'):
+                    if not wait_for_api():
+                        return
+                st.session_state.JOB_ID = run_translation(uploaded_file, file_hash)
 
                 st.session_state.API_STARTED = True
 
@@ -219,16 +387,21 @@ def main():
                     st.session_state.API_STARTED = False
                     st.rerun()
 
-        # check if the API server is running or completed
-        while st.session_state.API_STARTED:
-            time.sleep(10)
-            response = requests.get(f"{API_BASE_URL}/completed")
-            if response.status_code == 200:
-                if response.json().get("completed"):
-                    st.success("Translation completed.")
-                    st.balloons()
-                    print("Translation completed.")
-                    break
+        # follow the progress events of the job until it completes or fails
+        if st.session_state.API_STARTED and st.session_state.JOB_ID:
+            job = follow_job_progress(st.session_state.JOB_ID)
+            if job is None or job["status"] not in ("completed", "failed"):
+                st.error("Lost the connection to the API server.")
+            elif job["status"] == "completed":
+                st.success(f"Translation completed: {job['file_path']}")
+                if job.get("items_skipped"):
+                    st.info(f"{job['items_skipped']} translations were up to date and kept as they are.")
+                if job["failed_path"]:
+                    st.warning(f"{job['items_failed']} translations failed, see {job['failed_path']}. Translate the same file again to retry them.")
+                st.balloons()
+                print("Translation completed.")
+            else:
+                st.error(f"Translation failed: {job['errors']}")
 
 def sidebar():
     st.sidebar.header('About')
@@ -0,0 +1,156 @@
+"""
+Offline bulk translation through batch request files, for large jobs that can wait: the deduplicated texts of a
+workbook are compiled into a request file in the format of the OpenAI Batch API, submitted, and the results are
+ingested back into the workbook like the results of a live job. Run from the directory of params.yaml:
+
+    python src/batch.py compile skills.xlsx --sheet Skills --columns "name (to translate)" "description (to translate)" --languages fr de
+    python src/batch.py submit JOB_ID      # or: python src/batch.py process JOB_ID, to answer it locally with the model of params.yaml
+    python src/batch.py status [JOB_ID]    # polls the submitted batches
+    python src/batch.py ingest JOB_ID
+"""
+
+import argparse
+from io import BytesIO
+import json
+import os
+from typing import List, Optional
+
+from modules.batch_jobs import BatchConfig, BatchJob, BatchState
+from modules.job_setup import OUTPUT_DIR, assemble, load_config, make_router, open_translation_memory, read_plan
+from modules.job_journal import job_id
+from modules.model_config import ModelConfig
+from modules.packing import PackingConfig
+from modules.scheduling import SchedulingConfig
+from modules.source_hashes import DeltaConfig
+from modules.translation_memory import TranslationMemory
+from modules.translation_plan import TranslationPlan
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def make_service(params: dict, model_config: ModelConfig, plan: TranslationPlan, selected_languages: List[str],
+                 translation_memory: Optional[TranslationMemory]):
+    """
+    The service of the job, planned the same way when the batch is compiled and when it is ingested
+    """
+    from services import TranslationService
+
+    return TranslationService(1, model_config, plan.text_index_pairs(), selected_languages,
+                              translation_memory=translation_memory,
+                              packing=PackingConfig(**params.get('packing', {})),
+                              scheduling=SchedulingConfig(**params.get('scheduling', {})),
+                              router=make_router(params, model_config),
+                              kinds=plan.unit_kinds(),
+                              unit_languages=plan.unit_languages())
+
+
+def compile_job(config: BatchConfig, params: dict, model_config: ModelConfig, input_path: str, sheet_column_pairs: List[dict],
+                selected_languages: List[str]) -> BatchJob:
+    """
+    Write the request file of the texts of the workbook missing from the translation memory. A job compiled again,
+    e.g. to retry its failed requests, starts a new batch.
+    """
+    with open(input_path, 'rb') as f:
+        file_content = f.read()
+    state = BatchState(job_id=job_id(file_content, sheet_column_pairs, selected_languages), source_name=os.path.basename(input_path),
+                       sheet_column_pairs=sheet_column_pairs, selected_languages=selected_languages)
+    previous = BatchJob.find(config, state.job_id)
+    if previous is not None and previous.state.status == 'submitted':
+        raise ValueError(f'The batch of job {state.job_id} is still being processed, ingest it before compiling the job again')
+    batch_job = BatchJob.create(config, state, file_content)
+    _, plan = read_plan(BytesIO(file_content), sheet_column_pairs, selected_languages, DeltaConfig(**params.get('delta', {})).enabled)
+    translation_memory = open_translation_memory(params, model_config)
+    try:
+        service = make_service(params, model_config, plan, selected_languages, translation_memory)
+        calls = service.batch_calls()
+        estimate = service.estimate(1)
+    finally:
+        if translation_memory is not None:
+            translation_memory.close()
+    batch_job.write_requests(calls, make_router(params, model_config).model_configs())
+    logger.info(f'Batch job {state.job_id}: {len(calls)} requests for {plan.num_cells} cells written to {batch_job.requests_path}, '
+                f'about {estimate.total_tokens} tokens and ${estimate.cost:.2f} at the live prices')
+    return batch_job
+
+
+def ingest_job(params: dict, model_config: ModelConfig, batch_job: BatchJob) -> str:
+    """
+    Assemble the results of the batch and the translations from memory into the workbook, like a live job
+    """
+    state = batch_job.state
+    with open(batch_job.source_path, 'rb') as f:
+        workbook, plan = read_plan(BytesIO(f.read()), state.sheet_column_pairs, state.selected_languages,
+                                   DeltaConfig(**params.get('delta', {})).enabled)
+    tasks, outputs = batch_job.read_results()
+    translation_memory = open_translation_memory(params, model_config)
+    try:
+        service = make_service(params, model_config, plan, state.selected_languages, translation_memory)
+        unit_results = service.ingest_batch(tasks, outputs)
+    finally:
+        if translation_memory is not None:
+            translation_memory.close()
+    assemble(workbook, plan, state.selected_languages, unit_results)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    output_path = os.path.join(OUTPUT_DIR, f'translated_batch_{state.job_id}.xlsx')
+    workbook.save(output_path)
+
+    failed_cells = plan.failed_cells(service.failed_items)
+    if failed_cells:
+        with open(batch_job.failed_path, 'w', encoding='utf-8') as f:
+            json.dump(failed_cells, f, ensure_ascii=False, indent=2)
+        logger.warning(f'{len(failed_cells)} cells failed to translate and were left unchanged, see {batch_job.failed_path}. '
+                       f'Compile the job again to retry them, the translated texts are taken from the translation memory.')
+    state.output_path = output_path
+    state.items_failed = len(service.failed_items)
+    batch_job.set_status('ingested')
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    compile_parser = commands.add_parser('compile', help='write the request file of a workbook')
+    compile_parser.add_argument('input', help='workbook to translate')
+    compile_parser.add_argument('--sheet', action='append', required=True, help='sheet to translate, repeated with --columns for several sheets')
+    compile_parser.add_argument('--columns', action='append', nargs='+', required=True, help='columns of the sheet to translate')
+    compile_parser.add_argument('--languages', nargs='+', required=True, help='language codes to translate to')
+    for command, help in (('submit', 'submit the request file to the provider'),
+                          ('process', 'answer the request file locally with the model of params.yaml, instead of the provider'),
+                          ('ingest', 'write the results into the workbook')):
+        commands.add_parser(command, help=help).add_argument('job_id')
+    commands.add_parser('status', help='poll the submitted batches and show the batch jobs').add_argument('job_id', nargs='?')
+    args = parser.parse_args()
+
+    params, model_config = load_config()
+    config = BatchConfig(**params.get('batch', {}))
+    if args.command == 'compile':
+        if len(args.sheet) != len(args.columns):
+            parser.error('every --sheet needs its --columns')
+        sheet_column_pairs = [{'sheet': sheet, 'columns': columns} for sheet, columns in zip(args.sheet, args.columns)]
+        batch_job = compile_job(config, params, model_config, args.input, sheet_column_pairs, args.languages)
+        print(batch_job.state.job_id)
+    elif args.command == 'status':
+        batch_jobs = [BatchJob.load(config, args.job_id)] if args.job_id else BatchJob.list_jobs(config)
+        for batch_job in batch_jobs:
+            if batch_job.state.status == 'submitted':
+                batch_job.refresh(model_config.openai_api_key)
+            state = batch_job.state
+            print(f'{state.job_id}  {state.status:<10} {state.provider_status or "-":<12} {state.requests:>7} requests  '
+                  f'{state.source_name}  {state.output_path or ""}')
+    else:
+        batch_job = BatchJob.load(config, args.job_id)
+        if args.command == 'submit':
+            batch_job.submit(model_config.openai_api_key)
+            print(batch_job.state.batch_id)
+        elif args.command == 'process':
+            batch_job.process_locally(model_config)
+        else:
+            # an ingested batch can be ingested again, e.g. after a change of the workbook template
+            if batch_job.state.status not in ('processed', 'ingested'):
+                parser.error(f'batch job {args.job_id} is {batch_job.state.status}, its results are not available')
+            print(ingest_job(params, model_config, batch_job))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+"""
+A module to translate jobs offline through batch request files: the requests of a job are compiled to a JSONL file in
+the format of the OpenAI Batch API, submitted, and the results file is ingested back into the workbook once processed.
+Batches are cheaper and not bound by the rate limits of the live calls, at the price of a latency of up to a day.
+"""
+
+import json
+import os
+import time
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+from modules.model_config import ModelConfig
+from utils.logger import setup_logger
+
+if TYPE_CHECKING:
+    from langchain_core.prompts import ChatPromptTemplate
+
+logger = setup_logger(__name__)
+
+# roles of the messages of the prompts in the chat completions API
+ROLES = {'system': 'system', 'human': 'user', 'ai': 'assistant'}
+# batch statuses of the provider after which nothing changes anymore
+PROVIDER_FINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+class BatchConfig(BaseModel):
+    dir: str = Field(default='batch_jobs', description='directory with a subdirectory per batch job')
+    endpoint: str = Field(default='/v1/chat/completions', description='endpoint of the requests of the batch')
+    completion_window: str = Field(default='24h', description='time the provider has to process a batch')
+    local_concurrency: int = Field(default=16, description='requests in flight at a time when a batch is processed locally')
+
+
+class BatchState(BaseModel):
+    job_id: str
+    status: str = Field(default='compiled', description="'compiled', 'submitted', 'processed', 'ingested' or 'failed'")
+    source_name: str = Field(description='name of the uploaded workbook')
+    sheet_column_pairs: List[dict]
+    selected_languages: List[str]
+    requests: int = Field(default=0, description='requests of the batch')
+    batch_id: Optional[str] = Field(default=None, description='id of the batch at the provider')
+    provider_status: Optional[str] = Field(default=None, description='last status of the batch at the provider')
+    output_path: Optional[str] = Field(default=None, description='translated workbook, once ingested')
+    items_failed: int = Field(default=0, description='(text, language) items without a translation after the ingestion')
+    created_at: float = Field(default_factory=time.time)
+    updated_at: float = Field(default_factory=time.time)
+
+
+def chat_request(custom_id: str, prompt: 'ChatPromptTemplate', inputs: dict, model_config: ModelConfig, endpoint: str) -> dict:
+    """
+    A line of a batch request file: the chat completion request of the prompt formatted with inputs
+    """
+    messages = [{'role': ROLES[message.type], 'content': message.content} for message in prompt.format_messages(**inputs)]
+    return {'custom_id': custom_id, 'method': 'POST', 'url': endpoint,
+            'body': {'model': model_config.llm_model_name, 'temperature': model_config.temperature, 'messages': messages}}
+
+
+def result_output(line: dict) -> Optional[str]:
+    """
+    The answer of the model in a line of a batch results file, None if the request failed
+    """
+    response = line.get('response') or {}
+    if line.get('error') or response.get('status_code') != 200:
+        return None
+    choices = (response.get('body') or {}).get('choices') or []
+    return choices[0]['message']['content'] if choices else None
+
+
+def _read_jsonl(path: str) -> Iterator[dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class BatchJob:
+    """
+    The files of a batch job in {dir}/{job_id}: state.json, the uploaded workbook, requests.jsonl to submit,
+    tasks.jsonl with the translation task of every request, and results.jsonl once the batch is processed
+    """
+    def __init__(self, config: BatchConfig, state: BatchState):
+        self.config = config
+        self.state = state
+        self.dir = os.path.join(config.dir, state.job_id)
+        self.source_path = os.path.join(self.dir, state.source_name)
+        self.requests_path = os.path.join(self.dir, 'requests.jsonl')
+        self.tasks_path = os.path.join(self.dir, 'tasks.jsonl')
+        self.results_path = os.path.join(self.dir, 'results.jsonl')
+        self.failed_path = os.path.join(self.dir, 'failed.json')
+
+    @classmethod
+    def create(cls, config: BatchConfig, state: BatchState, file_content: bytes) -> 'BatchJob':
+        batch_job = cls(config, state)
+        os.makedirs(batch_job.dir, exist_ok=True)
+        with open(batch_job.source_path, 'wb') as f:
+            f.write(file_content)
+        batch_job.save()
+        return batch_job
+
+    @classmethod
+    def find(cls, config: BatchConfig, job_id: str) -> Optional['BatchJob']:
+        state_path = os.path.join(config.dir, job_id, 'state.json')
+        if not os.path.exists(state_path):
+            return None
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return cls(config, BatchState.model_validate_json(f.read()))
+
+    @classmethod
+    def load(cls, config: BatchConfig, job_id: str) -> 'BatchJob':
+        batch_job = cls.find(config, job_id)
+        if batch_job is None:
+            raise ValueError(f'No batch job {job_id} in {config.dir}')
+        return batch_job
+
+    @classmethod
+    def list_jobs(cls, config: BatchConfig) -> List['BatchJob']:
+        if not os.path.isdir(config.dir):
+            return []
+        job_ids = [name for name in sorted(os.listdir(config.dir)) if os.path.exists(os.path.join(config.dir, name, 'state.json'))]
+        return [cls.load(config, job_id) for job_id in job_ids]
+
+    def save(self):
+        self.state.updated_at = time.time()
+        # written then renamed, so that an interrupted write never leaves a corrupt state
+        tmp_path = os.path.join(self.dir, 'state.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.state.model_dump_json(indent=2))
+        os.replace(tmp_path, os.path.join(self.dir, 'state.json'))
+
+    def set_status(self, status: str):
+        logger.info(f'Batch job {self.state.job_id}: {self.state.status} -> {status}')
+        self.state.status = status
+        self.save()
+
+    def write_requests(self, calls: List[Tuple[tuple, 'ChatPromptTemplate', dict]], model_configs: Dict[str, ModelConfig]):
+        """
+        Write the request file and the tasks of the (task, prompt, prompt inputs) calls, the task profiles selecting the model
+        """
+        with open(self.requests_path, 'w', encoding='utf-8') as requests_file, open(self.tasks_path, 'w', encoding='utf-8') as tasks_file:
+            for position, (task, prompt, inputs) in enumerate(calls):
+                custom_id = f'{self.state.job_id}-{position}'
+                request = chat_request(custom_id, prompt, inputs, model_configs[task[2]], self.config.endpoint)
+                requests_file.write(json.dumps(request, ensure_ascii=False) + '\n')
+                tasks_file.write(json.dumps({'custom_id': custom_id, 'task': task}, ensure_ascii=False) + '\n')
+        self.state.requests = len(calls)
+        self.set_status('compiled')
+
+    def read_results(self) -> Tuple[List[tuple], List[Optional[str]]]:
+        """
+        The tasks of the batch and their outputs, None for the requests that failed or are missing from the results
+        """
+        outputs = {line['custom_id']: result_output(line) for line in _read_jsonl(self.results_path)}
+        tasks, task_outputs = [], []
+        for line in _read_jsonl(self.tasks_path):
+            tasks.append(tuple(line['task']))
+            task_outputs.append(outputs.get(line['custom_id']))
+        failed = sum(output is None for output in task_outputs)
+        if failed:
+            logger.warning(f'Batch job {self.state.job_id}: {failed} of {len(tasks)} requests failed or have no result')
+        return tasks, task_outputs
+
+    def submit(self, api_key: str):
+        """
+        Upload the request file and create the batch at the provider
+        """
+        from openai import OpenAI
+
+        client = OpenAI(api_key=api_key)
+        with open(self.requests_path, 'rb') as f:
+            input_file = client.files.create(file=f, purpose='batch')
+        batch = client.batches.create(input_file_id=input_file.id, endpoint=self.config.endpoint,
+                                      completion_window=self.config.completion_window, metadata={'job_id': self.state.job_id})
+        self.state.batch_id = batch.id
+        self.state.provider_status = batch.status
+        self.set_status('submitted')
+
+    def refresh(self, api_key: str) -> str:
+        """
+        Poll the batch at the provider, and download its results once it is over. Expired and cancelled batches
+        keep the results of the requests processed in time, which are ingested like the others.
+        """
+        from openai import OpenAI
+
+        client = OpenAI(api_key=api_key)
+        batch = client.batches.retrieve(self.state.batch_id)
+        self.state.provider_status = batch.status
+        if batch.status not in PROVIDER_FINAL_STATUSES:
+            self.save()
+            return self.state.status
+        file_ids = [file_id for file_id in (batch.output_file_id, batch.error_file_id) if file_id]
+        if not file_ids:
+            self.set_status('failed')
+            return self.state.status
+        with open(self.results_path, 'wb') as f:
+            for file_id in file_ids:
+                f.write(client.files.content(file_id).read())
+        self.set_status('processed')
+        return self.state.status
+
+    def process_locally(self, model_config: ModelConfig):
+        """
+        Stand-in for the provider: answer the request file with the model of model_config, e.g. the simulated model,
+        and write a results file in the format of the provider. The model name and temperature of every request are kept.
+        """
+        from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+        from modules.openai_model import OpenAImodel
+
+        message_classes = {'system': SystemMessage, 'user': HumanMessage, 'assistant': AIMessage}
+        requests = list(_read_jsonl(self.requests_path))
+        models = {}
+        inputs = []
+        for request in requests:
+            body = request['body']
+            key = (body['model'], body.get('temperature', model_config.temperature))
+            if key not in models:
+                models[key] = OpenAImodel(model_config.model_copy(update={'llm_model_name': key[0], 'temperature': key[1]})).get_model()
+            inputs.append((models[key], [message_classes[message['role']](content=message['content']) for message in body['messages']]))
+
+        start = time.perf_counter()
+        outputs = []
+        # the requests of a model are sent together, up to local_concurrency at a time
+        for key, model in models.items():
+            positions = [position for position, (request_model, _) in enumerate(inputs) if request_model is model]
+            results = model.batch([inputs[position][1] for position in positions], {'max_concurrency': self.config.local_concurrency},
+                                  return_exceptions=True)
+            outputs.extend(zip(positions, results))
+        with open(self.results_path, 'w', encoding='utf-8') as f:
+            for position, result in sorted(outputs, key=lambda output: output[0]):
+                f.write(json.dumps(self._result_line(requests[position], result), ensure_ascii=False) + '\n')
+        failed = sum(isinstance(result, Exception) for _, result in outputs)
+        logger.info(f'Batch job {self.state.job_id}: processed {len(requests)} requests locally in {time.perf_counter() - start:.1f}s, '
+                    f'{failed} failed')
+        self.state.provider_status = 'local'
+        self.set_status('processed')
+
+    @staticmethod
+    def _result_line(request: dict, result) -> dict:
+        if isinstance(result, Exception):
+            return {'id': f"batch_req_{request['custom_id']}", 'custom_id': request['custom_id'], 'response': None,
+                    'error': {'code': type(result).__name__, 'message': str(result)}}
+        token_usage = (result.response_metadata or {}).get('token_usage') or {}
+        body = {'object': 'chat.completion', 'model': request['body']['model'],
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': result.content}, 'finish_reason': 'stop'}],
+                'usage': token_usage}
+        return {'id': f"batch_req_{request['custom_id']}", 'custom_id': request['custom_id'],
+                'response': {'status_code': 200, 'body': body}, 'error': None}
@@ -1,4 +1,5 @@
 from io import BytesIO
+from typing import Dict, Iterator, List, Optional
 
 import pandas as pd
 
@@ -6,29 +7,104 @@ from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+try:
+    import pyarrow  # noqa: F401
+    # Arrow strings are stored in contiguous buffers instead of one Python object per cell
+    STRING_DTYPE = pd.StringDtype('pyarrow')
+except ImportError:
+    STRING_DTYPE = pd.StringDtype('python')
+
 class DataReader:
     """
     A class to read data from a csv file
     """
-    def read_csv(self, file: BytesIO) -> pd.DataFrame:
+    def read_csv(self, file: BytesIO, usecols: Optional[List[str]] = None) -> pd.DataFrame:
         """
-        read data from a csv file
+        read data from a csv file, only the usecols columns if given
         """
-        df = pd.read_csv(file)
+        df = pd.read_csv(file, usecols=self.__usecols(usecols))
         return self.__get_df_as_str(df)
-    def read_excel(self, file: BytesIO, sheet_name=0) -> pd.DataFrame:
+
+    def iter_csv(self, file, chunksize: int) -> Iterator[pd.DataFrame]:
+        """
+        read a csv file in chunks of chunksize rows. Values are read as they are, empty cells being empty strings,
+        so that the rows can be written back unchanged.
         """
-        Read data from an Excel file object
+        return pd.read_csv(file, chunksize=chunksize, dtype=str, keep_default_na=False)
+
+    def iter_jsonl(self, file, chunksize: int) -> Iterator[pd.DataFrame]:
+        """
+        read a JSON lines file in chunks of chunksize records
+        """
+        return pd.read_json(file, lines=True, chunksize=chunksize, dtype=False)
+
+    def read_excel(self, file: BytesIO, sheet_name=0, usecols: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Read data from an Excel file object, only the usecols columns if given
         """
         try:
-            df = pd.read_excel(file, sheet_name=sheet_name, header=0)
+            df = pd.read_excel(file, sheet_name=sheet_name, header=0, usecols=self.__usecols(usecols))
             return self.__get_df_as_str(df)
         except Exception as e:
             logger.error(f"Error reading Excel file: {str(e)}")
             raise FileNotFoundError("Error reading Excel file")
 
+    def worksheet_columns(self, worksheet) -> List[str]:
+        """
+        The column names of a sheet of an openpyxl workbook, in the order of the sheet.
+        Missing and duplicated headers are named like pandas does, e.g. 'Unnamed: 3' and 'name.1'.
+        """
+        header = next(worksheet.iter_rows(max_row=1, values_only=True), ())
+        columns, seen = [], {}
+        for position, name in enumerate(header):
+            name = f'Unnamed: {position}' if name is None else name
+            if name in seen:
+                seen[name] += 1
+                name = f'{name}.{seen[name]}'
+            else:
+                seen[name] = 0
+            columns.append(name)
+        return columns
+
+    def read_worksheet(self, worksheet, usecols: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Read data from a sheet of an openpyxl workbook, the first row being the header like in read_excel.
+        Only the usecols columns are loaded if given, the names that are not in the sheet being ignored.
+        """
+        columns = self.worksheet_columns(worksheet)
+        positions = [position for position, name in enumerate(columns) if usecols is None or name in usecols]
+        data = [[row[position] if position < len(row) else None for position in positions]
+                for row in worksheet.iter_rows(min_row=2, values_only=True)]
+        # trailing rows without values (e.g. only formatted) are not part of the data
+        while data and all(value is None for value in data[-1]):
+            data.pop()
+        df = pd.DataFrame(data, columns=[columns[position] for position in positions], dtype=object)
+        return self.__get_df_as_str(df)
+
+    def worksheet_formulas(self, worksheet, usecols: Optional[List[str]] = None) -> Dict[str, List[int]]:
+        """
+        The cells holding a formula in a sheet of an openpyxl workbook loaded with its formulas (data_only=False),
+        as the row indexes of the DataFrame of read_worksheet by column. Only the usecols columns are looked at if given.
+        """
+        columns = self.worksheet_columns(worksheet)
+        positions = [position for position, name in enumerate(columns) if usecols is None or name in usecols]
+        formulas: Dict[str, List[int]] = {}
+        for index, row in enumerate(worksheet.iter_rows(min_row=2)):
+            for position in positions:
+                if position < len(row) and row[position].data_type == 'f':
+                    formulas.setdefault(columns[position], []).append(index)
+        return formulas
+
+    @staticmethod
+    def __usecols(usecols: Optional[List[str]]):
+        # names that are not in the file are ignored, e.g. the target columns of languages the sheet doesn't have
+        return None if usecols is None else (lambda name: name in usecols)
+
     @staticmethod
     def __get_df_as_str(df):
+        """
+        Cast the columns to a compact string dtype. Empty cells stay missing values, so that they are not translated.
+        """
         for col in df.columns:
-            df[col] = df[col].astype(str)
-        return df
\ No newline at end of file
+            df[col] = df[col].astype(STRING_DTYPE)
+        return df
@@ -0,0 +1,127 @@
+"""
+A module with a simulated chat model, to run translation jobs offline, e.g. to benchmark the throughput of the service
+"""
+
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.pydantic_v1 import PrivateAttr
+from pydantic import Field
+
+from modules.model_config import FakeModelConfig
+from modules.packing import estimate_tokens
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+_LANGUAGES = re.compile(r'to each of these languages: (.+?)\. ')
+_LANGUAGE = re.compile(r'to language: (\S+?)\.')
+
+
+class _FakeResponse:
+    def __init__(self, headers: dict):
+        self.headers = headers
+
+
+class FakeAPIError(Exception):
+    """
+    An error response of the fake model, shaped like the errors of the openai client
+    """
+    def __init__(self, status_code: int, headers: Optional[dict] = None):
+        super().__init__(f'Fake error {status_code}')
+        self.status_code = status_code
+        self.response = _FakeResponse(headers or {})
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Answers the translation prompts with fake translations, after a random latency, and fails at configurable rates.
+    The answers have the format expected for the prompt: plain text, a packed JSON array or a multi-language JSON object.
+    """
+    config: FakeModelConfig = Field(default_factory=FakeModelConfig)
+    _random: Any = PrivateAttr()
+    _lock: Any = PrivateAttr()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+
+    @property
+    def _llm_type(self) -> str:
+        return 'fake'
+
+    def _answer(self, messages: List[BaseMessage]) -> str:
+        system = ' '.join(str(message.content) for message in messages[:-1])
+        text = str(messages[-1].content).strip()
+        languages = _LANGUAGES.search(system)
+        if languages:
+            return json.dumps({lang_code: self._translate(text, lang_code) for lang_code in languages.group(1).split(', ')},
+                              ensure_ascii=False)
+        language = _LANGUAGE.search(system)
+        lang_code = language.group(1) if language else 'xx'
+        try:
+            items = json.loads(text)
+        except ValueError:
+            items = None
+        if isinstance(items, list):
+            return json.dumps([{'id': item.get('id'), 'translation': self._translate(item.get('text', ''), lang_code)}
+                               for item in items if isinstance(item, dict)], ensure_ascii=False)
+        return self._translate(text, lang_code)
+
+    def _translate(self, text: str, lang_code: str) -> str:
+        length = max(1, int(len(text) * self.config.output_ratio))
+        body = (text * (length // max(1, len(text)) + 1))[:length]
+        return f'[{lang_code}] {body}'
+
+    def _draw(self, answer: str):
+        """
+        Draw the latency of the call and the error to raise, if any
+        """
+        with self._lock:
+            latency = self.config.latency_median
+            if self.config.latency_sigma:
+                latency *= self._random.lognormvariate(0, self.config.latency_sigma)
+            draw = self._random.random()
+        latency += estimate_tokens(answer) * self.config.latency_per_output_token
+        error = None
+        if draw < self.config.rate_limit_rate:
+            headers = {'retry-after': str(self.config.retry_after)} if self.config.retry_after is not None else {}
+            error = FakeAPIError(429, headers)
+        elif draw < self.config.rate_limit_rate + self.config.error_rate:
+            error = FakeAPIError(500)
+        return latency, error
+
+    def _result(self, messages: List[BaseMessage], answer: str, start: float, error: Optional[Exception]) -> ChatResult:
+        if self.config.latency_log is not None:
+            with open(self.config.latency_log, 'a') as f:
+                f.write(f'{time.perf_counter() - start:.6f}\n')
+        if error is not None:
+            raise error
+        input_tokens = sum(estimate_tokens(message.content) for message in messages)
+        output_tokens = estimate_tokens(answer)
+        token_usage = {'prompt_tokens': input_tokens, 'completion_tokens': output_tokens, 'total_tokens': input_tokens + output_tokens}
+        message = AIMessage(content=answer, response_metadata={'token_usage': token_usage})
+        return ChatResult(generations=[ChatGeneration(message=message)], llm_output={'token_usage': token_usage})
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        start = time.perf_counter()
+        answer = self._answer(messages)
+        latency, error = self._draw(answer)
+        time.sleep(latency)
+        return self._result(messages, answer, start, error)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        start = time.perf_counter()
+        answer = self._answer(messages)
+        latency, error = self._draw(answer)
+        await asyncio.sleep(latency)
+        return self._result(messages, answer, start, error)
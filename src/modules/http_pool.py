@@ -0,0 +1,132 @@
+"""
+A module to share keep-alive HTTP connections between all the model calls of a process
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import httpx
+
+from modules.metrics import HTTP_CONNECTION_SETUP_SECONDS, HTTP_REQUESTS
+from modules.model_config import HttpPoolConfig
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class _ConnectionTracer:
+    """
+    Trace extension of a request: records the time spent opening a new connection, if the request needed one
+    """
+    def __init__(self):
+        self.new_connection = False
+        self._started: Dict[str, float] = {}
+
+    def __call__(self, event_name: str, info: dict):
+        phase, _, state = event_name.rpartition('.')
+        if phase not in ('connection.connect_tcp', 'connection.start_tls'):
+            return
+        step = phase.split('.')[1]
+        if state == 'started':
+            self._started[step] = time.perf_counter()
+        elif state == 'complete' and step in self._started:
+            HTTP_CONNECTION_SETUP_SECONDS.observe(time.perf_counter() - self._started.pop(step), step=step)
+            self.new_connection = True
+
+    async def atrace(self, event_name: str, info: dict):
+        self(event_name, info)
+
+
+class TracingTransport(httpx.HTTPTransport):
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        tracer = _ConnectionTracer()
+        request.extensions['trace'] = tracer
+        response = super().handle_request(request)
+        HTTP_REQUESTS.inc(connection='new' if tracer.new_connection else 'reused')
+        return response
+
+
+class AsyncTracingTransport(httpx.AsyncHTTPTransport):
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        tracer = _ConnectionTracer()
+        request.extensions['trace'] = tracer.atrace
+        response = await super().handle_async_request(request)
+        HTTP_REQUESTS.inc(connection='new' if tracer.new_connection else 'reused')
+        return response
+
+
+def _http2(config: HttpPoolConfig) -> bool:
+    if not config.http2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _client_options(config: HttpPoolConfig) -> dict:
+    return {'limits': httpx.Limits(max_connections=config.max_connections,
+                                   max_keepalive_connections=config.max_keepalive_connections,
+                                   keepalive_expiry=config.keepalive_expiry),
+            'http2': _http2(config)}
+
+
+def _timeout(config: HttpPoolConfig) -> httpx.Timeout:
+    return httpx.Timeout(connect=config.connect_timeout, read=config.read_timeout, write=config.write_timeout, pool=config.pool_timeout)
+
+
+_lock = threading.Lock()
+_client: Optional[httpx.Client] = None
+# an async client belongs to the event loop it is used in
+_async_clients: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+
+
+def _reset():
+    # a forked worker must not share the connections of its parent
+    global _client
+    _client = None
+    _async_clients.clear()
+
+
+os.register_at_fork(after_in_child=_reset)
+
+
+def http_client(config: HttpPoolConfig) -> httpx.Client:
+    """
+    The HTTP client of the process, created on first use and shared by all the models
+    """
+    global _client
+    with _lock:
+        if _client is None:
+            options = _client_options(config)
+            logger.info(f'Creating the HTTP client of the process, http2: {options["http2"]}')
+            _client = httpx.Client(transport=TracingTransport(**options), timeout=_timeout(config))
+        return _client
+
+
+def async_http_client(config: HttpPoolConfig) -> Optional[httpx.AsyncClient]:
+    """
+    The HTTP client of the running event loop, shared by all the models used in it. None outside of an event loop.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    with _lock:
+        if loop not in _async_clients:
+            _async_clients[loop] = httpx.AsyncClient(transport=AsyncTracingTransport(**_client_options(config)), timeout=_timeout(config))
+        return _async_clients[loop]
+
+
+async def aclose_async_http_client():
+    """
+    Close the HTTP client of the running event loop, before the loop ends
+    """
+    with _lock:
+        client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,75 @@
+"""
+A module to checkpoint the progress of a translation job in an append-only journal, so that it can be resumed
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Tuple
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def job_id(file_content: bytes, *selection) -> str:
+    """
+    Deterministic id of a job: the same file with the same selection gets the same id, and resumes the same journal
+    """
+    digest = hashlib.sha256(file_content)
+    digest.update(json.dumps(selection, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class JobJournal:
+    """
+    Append-only JSONL journal of the translated and failed (unit, language) items of a job.
+    Failed items are not resumed, they are retried on the next run.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.completed: Dict[Tuple[int, str], str] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self._load()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line of an interrupted job may be truncated
+                    continue
+                if 'translation' in record:
+                    self.completed[(record['unit'], record['language'])] = record['translation']
+        logger.info(f'Resuming {len(self.completed)} translated items from {self.path}')
+
+    def lookup(self, unit_id: int, language_codes: List[str]) -> Dict[str, str]:
+        return {lang_code: self.completed[(unit_id, lang_code)]
+                for lang_code in language_codes if (unit_id, lang_code) in self.completed}
+
+    def _append(self, record: dict):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+
+    def record(self, unit_id: int, language: str, translation: str):
+        self._append({'unit': unit_id, 'language': language, 'translation': translation})
+
+    def record_failure(self, unit_id: int, language: str):
+        self._append({'unit': unit_id, 'language': language, 'failed': True})
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def remove(self):
+        """
+        Close and delete the journal, once the output of the job is written
+        """
+        self.close()
+        os.remove(self.path)
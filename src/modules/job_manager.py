@@ -0,0 +1,278 @@
+"""
+A module to keep track of the translation jobs run by the API and of their progress
+"""
+
+from collections import Counter, deque
+import threading
+import time
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+from modules.metrics import JOBS, STAGE_SECONDS
+from modules.scheduling import JobEstimate
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+
+
+class JobRetentionConfig(BaseModel):
+    max_finished: int = Field(default=200, description='completed and failed jobs kept, the oldest being forgotten first')
+    max_age_seconds: float = Field(default=86400, description='completed and failed jobs are forgotten this long after they end')
+
+
+class JobStatus(BaseModel):
+    job_id: str = Field(description='id of the job')
+    status: str = Field(description='queued, running, completed or failed')
+    stage: Optional[str] = Field(default=None, description='current stage of the job')
+    rows_total: int = Field(default=0, description='unique texts to translate, so far for a streamed job')
+    rows_done: int = Field(default=0, description='unique texts translated to all the languages, or failed')
+    languages: Dict[str, int] = Field(default_factory=dict, description='translated items per language')
+    items_failed: int = Field(default=0, description='(text, language) items that failed')
+    items_skipped: int = Field(default=0, description='(cell, language) items left out by a delta translation, being up to date')
+    throughput: float = Field(default=0.0, description='translated items per second')
+    eta_seconds: Optional[float] = Field(default=None, description='estimated seconds left')
+    estimate: Optional[JobEstimate] = Field(default=None, description='estimated requests, tokens, cost and duration, known before the first request')
+    errors: List[str] = Field(default_factory=list, description='last errors of the job')
+    stage_seconds: Dict[str, float] = Field(default_factory=dict, description='duration of the stages of the job so far')
+    file_path: Optional[str] = Field(default=None, description='path of the translated file')
+    failed_path: Optional[str] = Field(default=None, description='path of the failure report')
+
+
+class JobProgress:
+    """
+    Thread-safe progress counters of a job, updated by TranslationService as the items are translated
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: Dict[int, int] = {}
+        self.rows_total = 0
+        self.rows_done = 0
+        self.items_total = 0
+        self.items_done = 0
+        self.items_failed = 0
+        self.items_skipped = 0
+        self.language_counts = Counter()
+        self.errors = deque(maxlen=20)
+        self.started_at = None
+        self.estimate: Optional[JobEstimate] = None
+        self.version = 0
+        self._changed = threading.Condition(self._lock)
+
+    def notify(self):
+        """
+        Wake up the listeners of the progress, e.g. the event stream of the job
+        """
+        with self._lock:
+            self._notify()
+
+    def _notify(self):
+        self.version += 1
+        self._changed.notify_all()
+
+    def wait_for_change(self, version: int, timeout: float) -> int:
+        """
+        Block until the progress differs from the given version or the timeout expires, and return the current version
+        """
+        with self._lock:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def plan(self, pending: Dict[int, int]):
+        """
+        Add the number of languages left to translate for every text of a translation of the job.
+        A job translated in chunks plans every chunk, with indexes unique across the chunks.
+        """
+        with self._lock:
+            left = {index: count for index, count in pending.items() if count}
+            self._pending.update(left)
+            self.rows_total += len(pending)
+            self.rows_done += len(pending) - len(left)
+            self.items_total += sum(left.values())
+            if self.started_at is None:
+                self.started_at = time.monotonic()
+            self._notify()
+
+    def add_estimate(self, estimate: JobEstimate) -> JobEstimate:
+        """
+        Add the estimate of a translation of the job, and return the estimate of the whole job so far
+        """
+        with self._lock:
+            self.estimate = estimate if self.estimate is None else self.estimate.add(estimate)
+            self._notify()
+            return self.estimate
+
+    def _item_done(self, index: int):
+        left = self._pending.get(index)
+        if left is None:
+            return
+        if left <= 1:
+            del self._pending[index]
+            self.rows_done += 1
+        else:
+            self._pending[index] = left - 1
+
+    def translated(self, index: int, lang_code: str):
+        with self._lock:
+            self.items_done += 1
+            self.language_counts[lang_code] += 1
+            self._item_done(index)
+            self._notify()
+
+    def failed(self, index: int, lang_code: str):
+        with self._lock:
+            self.items_failed += 1
+            self._item_done(index)
+            self._notify()
+
+    def skipped(self, count: int):
+        with self._lock:
+            self.items_skipped += count
+            self._notify()
+
+    def error(self, message: str):
+        with self._lock:
+            self.errors.append(message)
+            self._notify()
+
+    def throughput(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        elapsed = time.monotonic() - self.started_at
+        return self.items_done / elapsed if elapsed > 0 else 0.0
+
+    def eta_seconds(self) -> Optional[float]:
+        throughput = self.throughput()
+        if not throughput:
+            return None
+        return max(0, self.items_total - self.items_done - self.items_failed) / throughput
+
+
+class Job:
+    """
+    A translation job of the API
+    """
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.status = JOB_QUEUED
+        self.stage = None
+        self.progress = JobProgress()
+        self.file_path = None
+        self.failed_path = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.stage_seconds: Dict[str, float] = {}
+        self._stage_started = None
+
+    def _end_stage(self):
+        if self.stage is None:
+            return
+        duration = time.monotonic() - self._stage_started
+        self.stage_seconds[self.stage] = self.stage_seconds.get(self.stage, 0) + duration
+        STAGE_SECONDS.observe(duration, stage=self.stage)
+
+    def set_stage(self, stage: str):
+        self._end_stage()
+        self.status = JOB_RUNNING
+        self.stage = stage
+        self._stage_started = time.monotonic()
+        logger.info(f'Job {self.job_id}: {stage}')
+        self.progress.notify()
+
+    def finish(self, file_path: str, failed_path: Optional[str] = None):
+        self._end_stage()
+        self.file_path = file_path
+        self.failed_path = failed_path
+        self.stage = None
+        self.status = JOB_COMPLETED
+        self.finished_at = time.time()
+        JOBS.inc(status=JOB_COMPLETED)
+        logger.info(f'Job {self.job_id} completed, stages: {self.stage_seconds}')
+        self.progress.notify()
+
+    def fail(self, error: Exception):
+        self._end_stage()
+        self.progress.error(str(error))
+        self.stage = None
+        self.status = JOB_FAILED
+        self.finished_at = time.time()
+        JOBS.inc(status=JOB_FAILED)
+        logger.error(f'Job {self.job_id} failed: {error}')
+        self.progress.notify()
+
+    @property
+    def active(self) -> bool:
+        return self.status in (JOB_QUEUED, JOB_RUNNING)
+
+    def to_status(self) -> JobStatus:
+        progress = self.progress
+        return JobStatus(job_id=self.job_id,
+                         status=self.status,
+                         stage=self.stage,
+                         rows_total=progress.rows_total,
+                         rows_done=progress.rows_done,
+                         languages=dict(progress.language_counts),
+                         items_failed=progress.items_failed,
+                         items_skipped=progress.items_skipped,
+                         throughput=round(progress.throughput(), 2),
+                         eta_seconds=progress.eta_seconds() if self.active else None,
+                         estimate=progress.estimate,
+                         errors=list(progress.errors),
+                         stage_seconds={stage: round(seconds, 3) for stage, seconds in self.stage_seconds.items()},
+                         file_path=self.file_path,
+                         failed_path=self.failed_path)
+
+
+class JobManager:
+    """
+    Registry of the jobs of the API.
+    The finished jobs are forgotten beyond the limits of the retention config, when a new job is registered.
+    """
+    def __init__(self, config: Optional[JobRetentionConfig] = None):
+        self.config = config or JobRetentionConfig()
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id: str) -> Job:
+        """
+        Register a new job. Raises ValueError if a job with the same id is still running.
+        """
+        with self._lock:
+            self._evict()
+            existing = self._jobs.get(job_id)
+            if existing is not None and existing.active:
+                raise ValueError(f'Job {job_id} is already running')
+            job = Job(job_id)
+            self._jobs[job_id] = job
+            return job
+
+    def _evict(self):
+        finished = sorted((job for job in self._jobs.values() if not job.active), key=lambda job: job.finished_at)
+        expired_before = time.time() - self.config.max_age_seconds
+        overflow = len(finished) - self.config.max_finished
+        forgotten = 0
+        # oldest first, so that the jobs left are all within both limits
+        for job in finished:
+            if forgotten >= overflow and job.finished_at >= expired_before:
+                break
+            del self._jobs[job.job_id]
+            forgotten += 1
+        if forgotten:
+            logger.info(f'Forgot {forgotten} finished jobs')
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.created_at)
+
+    def active_count(self) -> int:
+        with self._lock:
+            return sum(job.active for job in self._jobs.values())
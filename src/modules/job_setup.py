@@ -0,0 +1,144 @@
+"""
+A module with the setup of the jobs shared by the API, the workers of the queue and the batch CLI: the config, the model
+router and the translation memory, and the reading and assembling of the workbooks. It doesn't depend on FastAPI.
+"""
+
+import os
+from typing import TYPE_CHECKING, BinaryIO, List, Optional, Tuple
+
+import yaml
+
+from modules.batch_jobs import BatchConfig
+from modules.job_manager import JobRetentionConfig
+from modules.model_config import FakeModelConfig, HttpPoolConfig, ModelConfig
+from modules.packing import PackingConfig
+from modules.rate_limiter import RateLimitConfig
+from modules.routing import ModelRouter, RoutingConfig, column_kind
+from modules.scheduling import SchedulingConfig
+from modules.source_hashes import DeltaConfig
+from modules.translation_memory import TranslationMemory
+from modules.upload_store import UploadConfig
+from modules.work_queue import WorkQueueConfig
+from utils.logger import setup_logger
+
+if TYPE_CHECKING:
+    from modules.translation_plan import TranslationPlan
+    from modules.upload_store import ArtifactCache
+    from modules.workbook import Workbook
+
+logger = setup_logger(__name__)
+
+OUTPUT_DIR = "translated_files"
+# sections of params.yaml validated at startup
+CONFIG_SECTIONS = {'batch': BatchConfig, 'delta': DeltaConfig, 'jobs': JobRetentionConfig, 'packing': PackingConfig, 'rate_limit': RateLimitConfig, 'routing': RoutingConfig,
+                   'scheduling': SchedulingConfig, 'uploads': UploadConfig, 'work_queue': WorkQueueConfig}
+
+
+def load_config():
+    """
+    Read params.yaml and llm_config.yaml, and build the model config from them
+    """
+    with open('params.yaml', 'r') as f:
+        params = yaml.safe_load(f)
+
+    provider = params["model"].get("provider", "openai")
+    api_key = ''
+    # the simulated model needs no api key
+    if provider != 'fake' or os.path.exists('llm_config.yaml'):
+        with open('llm_config.yaml', 'r') as f:
+            llm_config = yaml.safe_load(f)
+        api_key = llm_config['openai']['api_key']
+    # with the rate limiter on, rate limited calls are retried by the limiter instead of the openai client
+    rate_limit_enabled = params.get('rate_limit', {}).get('enabled', False)
+    model_config = ModelConfig(openai_api_key=api_key, 
+                            llm_model_name=params["model"]["model_name"],
+                            temperature=params["model"]["temperature"],
+                            max_retries=0 if rate_limit_enabled else 2,
+                            llm_provider=provider,
+                            fake_model=FakeModelConfig(**params.get('fake_model', {})) if provider == 'fake' else None,
+                            http_pool=HttpPoolConfig(**params.get('http_pool', {})))
+    # an invalid section fails at startup rather than in the first job
+    for section, config_class in CONFIG_SECTIONS.items():
+        config_class(**params.get(section, {}))
+    mode = params['parallel_processing'].get('mode', 'process')
+    if mode not in ('async', 'process', 'queue'):
+        raise ValueError(f"parallel_processing.mode must be 'async', 'process' or 'queue', not {mode!r}")
+    # duplicate profile names too
+    make_router(params, model_config)
+    return params, model_config
+
+
+def make_router(params: dict, model_config: ModelConfig) -> ModelRouter:
+    """
+    The model router of params, which sends every text to the model of the model section when routing is disabled
+    """
+    return ModelRouter(RoutingConfig(**params.get('routing', {})), model_config, SchedulingConfig(**params.get('scheduling', {})))
+
+
+def open_translation_memory(params: dict, model_config: ModelConfig) -> Optional[TranslationMemory]:
+    memory_params = params.get('translation_memory', {})
+    if not memory_params.get('enabled', False):
+        return None
+    from modules.translation_prompt import (MultiLanguageTextTranslationPrompt, PackedTextTranslationPrompt,
+                                            TextTranslationPrompt)
+    prompts = [prompt_class().create_prompt()
+               for prompt_class in (TextTranslationPrompt, PackedTextTranslationPrompt, MultiLanguageTextTranslationPrompt)]
+    return TranslationMemory(memory_params.get('path', 'translation_memory.sqlite'),
+                             model_config,
+                             prompts,
+                             max_entries=memory_params.get('max_entries', 200000),
+                             max_age_days=memory_params.get('max_age_days', 180))
+
+
+def read_plan(file_stream: BinaryIO, sheet_column_pairs: List[dict], selected_languages: List[str],
+              delta: bool = False, artifacts: Optional['ArtifactCache'] = None) -> Tuple['Workbook', 'TranslationPlan']:
+    """
+    Read the selected sheet columns of the file and collect all their cells, so that identical texts are translated once per job.
+    The cells holding a formula are not translated, their value being computed by Excel.
+    With delta, the cells whose translation is filled and whose source is unchanged since it was made are left out.
+    With artifacts, the sheets already read from the same file are reused, see Workbook.
+    """
+    from modules.source_hashes import SourceHashes
+    from modules.translation_plan import TranslationPlan
+    from modules.workbook import Workbook
+
+    # only the source columns and the target columns of the selected languages are loaded
+    sheet_columns = {}
+    for pair in sheet_column_pairs:
+        usecols = sheet_columns.setdefault(pair.get("sheet"), [])
+        usecols.extend(pair.get("columns"))
+        usecols.extend(f'{lang_code} {pattern}' for pattern in ('name', 'description') for lang_code in selected_languages)
+    workbook = Workbook(file_stream, sheet_columns, artifacts)
+    source_hashes = SourceHashes.read(workbook) if delta else None
+    plan = TranslationPlan(selected_languages, source_hashes)
+    for pair in sheet_column_pairs:
+        sheet = pair.get("sheet")
+        for column in pair.get("columns"):
+            df = workbook.sheets[sheet]
+            source = df[column]
+            formula_rows = workbook.formulas[sheet].get(column)
+            if formula_rows:
+                source = source.mask(source.index.isin(formula_rows))
+            plan.add_column(sheet, column, source,
+                            source_hashes.done(sheet, column, df, selected_languages) if source_hashes is not None else None)
+    if delta:
+        logger.info(f'Delta translation: skipped {plan.items_skipped} (cell, language) items up to date')
+    return workbook, plan
+
+
+def assemble(workbook: 'Workbook', plan: 'TranslationPlan', selected_languages: List[str], unit_results: List[Tuple[int, List[str]]]):
+    """
+    Queue the translations of the units of the plan into the target columns of every cell, to be saved with the workbook.
+    With a delta translation, the hashes of the sources of the new translations are written to the workbook too.
+    """
+    from modules.result_sink import ResultSink
+
+    cell_results = plan.fan_out(unit_results)
+    for (sheet, column), sheet_results in cell_results.items():
+        sink = ResultSink(workbook.sheets[sheet], selected_languages, column_kind(column))
+        sink.add(sheet_results)
+        logger.info(f'translated sheet {sheet} column {column}')
+        workbook.update(sheet, sink.to_df())
+    if plan.source_hashes is not None:
+        plan.source_hashes.update(plan, cell_results)
+        plan.source_hashes.write(workbook)
@@ -0,0 +1,199 @@
+"""
+A module to record the metrics of the translation hot path and to expose them in the Prometheus text format
+"""
+
+from contextlib import contextmanager
+import math
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+STAGE_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800, 3600)
+
+# set in the worker processes of the pool, which send their updates to the API process instead of keeping them
+_forward_queue = None
+
+
+def forward_to(queue):
+    """
+    Send the updates of the metrics of this process to the queue, drained by the API process with drain
+    """
+    global _forward_queue
+    _forward_queue = queue
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """
+    A metric with a value per combination of label values
+    """
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _record(self, op: str, value: float, labels: Dict[str, str]):
+        if _forward_queue is not None:
+            _forward_queue.put((self.name, op, value, labels))
+            return
+        self.apply(op, value, self._key(labels))
+
+    def apply(self, op: str, value: float, key: Tuple[str, ...]):
+        raise NotImplementedError
+
+    def samples(self) -> List[Tuple[str, Sequence[Tuple[str, str]], float]]:
+        with self._lock:
+            return [(self.name, list(zip(self.labelnames, key)), value) for key, value in sorted(self._values.items())]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, value: float = 1, **labels):
+        self._record('inc', value, labels)
+
+    def apply(self, op: str, value: float, key: Tuple[str, ...]):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def inc(self, value: float = 1, **labels):
+        self._record('inc', value, labels)
+
+    def dec(self, value: float = 1, **labels):
+        self._record('inc', -value, labels)
+
+    def set(self, value: float, **labels):
+        self._record('set', value, labels)
+
+    def apply(self, op: str, value: float, key: Tuple[str, ...]):
+        with self._lock:
+            self._values[key] = value if op == 'set' else self._values.get(key, 0) + value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        self._record('observe', value, labels)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def apply(self, op: str, value: float, key: Tuple[str, ...]):
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[position] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> List[Tuple[str, Sequence[Tuple[str, str]], float]]:
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                labels = list(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append((f'{self.name}_bucket', labels + [('le', _format_value(bound))], cumulative))
+                samples.append((f'{self.name}_sum', labels, total))
+                samples.append((f'{self.name}_count', labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    The metrics of the app, rendered in the Prometheus text exposition format
+    """
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+LLM_REQUEST_SECONDS = Histogram('llm_request_duration_seconds', 'Latency of the model calls.', ['prompt', 'profile'])
+LLM_REQUESTS = Counter('llm_requests_total', "Model calls, by outcome: 'ok' or the class of the error.", ['prompt', 'profile', 'outcome'])
+LLM_TOKENS = Counter('llm_tokens_total', 'Tokens used by the model calls.', ['prompt', 'profile', 'direction'])
+LLM_COST = Counter('llm_cost_usd_total', 'Cost of the model calls in USD, from their tokens and the costs of their routing profile.', ['profile'])
+LLM_RETRIES = Counter('llm_retries_total', 'Retries of model calls.', ['reason'])
+LLM_IN_FLIGHT = Gauge('llm_in_flight_requests', 'Model calls in flight.')
+RATE_LIMIT_CONCURRENCY = Gauge('rate_limiter_concurrency', 'Current limit of in-flight calls of the rate limiter.')
+QUEUE_DEPTH = Gauge('translation_queue_depth', 'Translation tasks of the running jobs that are not completed yet.')
+STAGE_SECONDS = Histogram('job_stage_duration_seconds', 'Duration of the stages of the jobs.', ['stage'], buckets=STAGE_BUCKETS)
+WORK_QUEUE_UNITS = Gauge('work_queue_units', "Units of the work queue, by state: 'queued', 'leased', 'done' or 'failed'.", ['state'])
+JOBS = Counter('jobs_total', 'Finished jobs, by status.', ['status'])
+HTTP_REQUESTS = Counter('http_client_requests_total', "HTTP requests to the model API, by connection: 'new' or 'reused'.", ['connection'])
+HTTP_CONNECTION_SETUP_SECONDS = Histogram('http_client_connection_setup_seconds', 'Time to open the connections to the model API, by step.',
+                                          ['step'], buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+
+
+def drain(queue):
+    """
+    Apply the updates sent by the worker processes to the metrics of this process, until None is received
+    """
+    while True:
+        event = queue.get()
+        if event is None:
+            break
+        name, op, value, labels = event
+        metric = REGISTRY.get(name)
+        if metric is not None:
+            metric.apply(op, value, metric._key(labels))
+
@@ -1,7 +1,40 @@
 
+from typing import Optional
+
 from pydantic import BaseModel, Field
 
+
+class FakeModelConfig(BaseModel):
+    latency_median: float = Field(default=0.5, description='seconds, median latency of a call')
+    latency_sigma: float = Field(default=0.5, description='spread of the log-normal latency distribution, 0 for a constant latency')
+    latency_per_output_token: float = Field(default=0.0, description='seconds added per output token')
+    rate_limit_rate: float = Field(default=0.0, description='share of the calls failing with a 429 error')
+    retry_after: Optional[float] = Field(default=1.0, description='seconds, retry-after header of the 429 errors')
+    error_rate: float = Field(default=0.0, description='share of the calls failing with a 500 error')
+    output_ratio: float = Field(default=1.0, description='length of a translation relative to its text')
+    latency_log: Optional[str] = Field(default=None, description='file to append the latency of every call to, one line per call')
+    seed: Optional[int] = Field(default=None, description='seed of the random failures and latencies')
+
+
+class HttpPoolConfig(BaseModel):
+    max_connections: int = Field(default=100, description='connections open at a time per process')
+    max_keepalive_connections: int = Field(default=50, description='idle connections kept open for reuse')
+    keepalive_expiry: float = Field(default=60.0, description='seconds an idle connection is kept open')
+    http2: bool = Field(default=True, description='use HTTP/2 when the h2 package is installed')
+    connect_timeout: float = Field(default=10.0, description='seconds to open a connection')
+    read_timeout: float = Field(default=120.0, description='seconds to wait for the response')
+    write_timeout: float = Field(default=30.0, description='seconds to send the request')
+    pool_timeout: float = Field(default=30.0, description='seconds to wait for a free connection of the pool')
+
+
 class ModelConfig(BaseModel):
     llm_model_name: str = Field(default='gpt-3.5-turbo', description='openai model name')
     temperature: float = Field(default=0.0, description='openai model temperature')
     openai_api_key: str = Field(description='openai api key')
+    max_retries: int = Field(default=2, description='retries of the openai client, 0 when the rate limiter handles them')
+    llm_provider: str = Field(default='openai', description="'openai', or 'fake' for the simulated model used offline")
+    fake_model: Optional[FakeModelConfig] = Field(default=None, description='settings of the simulated model')
+    http_pool: HttpPoolConfig = Field(default_factory=HttpPoolConfig, description='HTTP connection pool shared by the model calls of a process')
+    profile: str = Field(default='default', description='routing profile of the model, the label of its metrics')
+    input_cost_per_million: Optional[float] = Field(default=None, description='USD per million input tokens, for the cost metrics')
+    output_cost_per_million: Optional[float] = Field(default=None, description='USD per million output tokens, for the cost metrics')
@@ -2,11 +2,16 @@
 This module is responsible for creating the chain of modules for OpenAI
 """
 
+from typing import Optional
+
 from langchain_core.runnables import RunnableSequence
 from langchain_core.output_parsers import StrOutputParser
 
 from modules.model_config import ModelConfig
 from modules.openai_model import OpenAImodel
+from modules.rate_limiter import RateLimiter
+from modules.runnables import InstrumentedRunnable, RateLimitedRunnable
+from modules.scheduling import token_counter
 from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
@@ -15,16 +20,31 @@ class OpenAIchain:
     """
     class to create the chain of modules for OpenAI
     """
-    def __init__(self,prompt, model_config: ModelConfig):
+    def __init__(self,prompt, model_config: ModelConfig, rate_limiter: Optional[RateLimiter] = None):
         self.model_config = model_config
         self.prompt = prompt
+        self.rate_limiter = rate_limiter
+
+    @property
+    def prompt_kind(self) -> str:
+        """
+        The kind of translation prompt, the label of the metrics of the calls
+        """
+        input_variables = set(self.prompt.input_variables)
+        if 'items' in input_variables:
+            return 'packed'
+        if 'languages' in input_variables:
+            return 'multi_language'
+        return 'text'
 
     def create_chain(self) -> RunnableSequence:
         """
         create the chain of modules for OpenAI
         """
         try:
-            model = OpenAImodel(self.model_config).get_model()
+            model = InstrumentedRunnable(OpenAImodel(self.model_config).get_model(), self.prompt_kind, self.model_config)
+            if self.rate_limiter is not None:
+                model = RateLimitedRunnable(model, self.rate_limiter, token_counter(self.model_config.llm_model_name).count)
             output_parser = StrOutputParser()
             return self.prompt | model | output_parser
         except Exception as e:
@@ -5,6 +5,8 @@ A module to handle the OpenAI model
 
 from langchain_openai import ChatOpenAI
 
+from modules.fake_model import FakeChatModel, FakeModelConfig
+from modules.http_pool import async_http_client, http_client
 from modules.model_config import ModelConfig
 from utils.logger import setup_logger
 
@@ -12,7 +14,15 @@ logger = setup_logger(__name__)
 
 class OpenAImodel:
     def __init__(self, model_config: ModelConfig):
-        self._model = ChatOpenAI(temperature=model_config.temperature, openai_api_key=model_config.openai_api_key, model=model_config.llm_model_name)
+        if model_config.llm_provider == 'fake':
+            # offline runs and benchmarks, no request leaves the machine
+            self._model = FakeChatModel(config=model_config.fake_model or FakeModelConfig())
+            return
+        self._model = ChatOpenAI(temperature=model_config.temperature, openai_api_key=model_config.openai_api_key, model=model_config.llm_model_name,
+                                 max_retries=model_config.max_retries,
+                                 # connections are kept alive and reused by all the models of the process
+                                 http_client=http_client(model_config.http_pool),
+                                 http_async_client=async_http_client(model_config.http_pool))
 
     def get_model(self):
         return self._model
\ No newline at end of file
@@ -0,0 +1,105 @@
+"""
+A module to pack several short texts, or several languages of a text, into a single translation request and to parse the packed output
+"""
+
+import json
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class PackingConfig(BaseModel):
+    enabled: bool = Field(default=False, description='pack short texts into a single request per language')
+    max_text_tokens: int = Field(default=50, description='texts estimated above this number of tokens are translated one by one')
+    max_batch_tokens: int = Field(default=1000, description='token budget of the texts packed in a single request')
+    max_batch_items: int = Field(default=50, description='maximum number of texts packed in a single request')
+    multi_language: bool = Field(default=False, description='translate a text to all the languages in a single request')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token estimate of a text, about 4 characters per token
+    """
+    return max(1, len(str(text)) // 4)
+
+
+def pack_texts(texts: List[Tuple[int, str]], max_batch_tokens: int, max_batch_items: int,
+               count_tokens: Callable[[str], int] = estimate_tokens) -> List[List[Tuple[int, str]]]:
+    """
+    Group the (index, text) pairs so that each group stays within the token budget and the item limit.
+    The tokens of a text are counted by count_tokens, e.g. the token counter of the model.
+    """
+    groups = []
+    group, group_tokens = [], 0
+    for index, text in texts:
+        tokens = count_tokens(text)
+        if group and (group_tokens + tokens > max_batch_tokens or len(group) >= max_batch_items):
+            groups.append(group)
+            group, group_tokens = [], 0
+        group.append((index, text))
+        group_tokens += tokens
+    if group:
+        groups.append(group)
+    return groups
+
+
+def format_packed_items(group: List[Tuple[int, str]]) -> str:
+    """
+    Format the group as the JSON array sent to the model
+    """
+    return json.dumps([{'id': index, 'text': text} for index, text in group], ensure_ascii=False)
+
+
+def parse_packed_output(output: str, group: List[Tuple[int, str]]) -> Dict[int, str]:
+    """
+    Parse the JSON array returned by the model. Only the items whose id belongs to the group and whose translation
+    is a non-empty string are returned, the caller falls back to single-row calls for the others.
+    """
+    expected = {index for index, _ in group}
+    items = _load_json(output, list)
+    if items is None:
+        logger.warning(f'Packed output is not a JSON array, falling back for {len(group)} texts')
+        return {}
+    translations = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        index, translation = item.get('id'), item.get('translation')
+        if index in expected and index not in translations and isinstance(translation, str) and translation.strip():
+            translations[index] = translation
+    if len(items) != len(group) or len(translations) != len(group):
+        logger.warning(f'Packed output has {len(translations)} valid items out of {len(group)}')
+    return translations
+
+
+def parse_multi_language_output(output: str, language_codes: List[str]) -> Dict[str, str]:
+    """
+    Parse the JSON object keyed by language code returned by the model. Only the requested languages with a
+    non-empty string translation are returned, the caller falls back to per-language calls for the others.
+    """
+    translations = _load_json(output, dict)
+    if translations is None:
+        logger.warning(f'Multi-language output is not a JSON object, falling back for {len(language_codes)} languages')
+        return {}
+    valid = {lang_code: translations[lang_code] for lang_code in language_codes
+             if isinstance(translations.get(lang_code), str) and translations[lang_code].strip()}
+    if len(valid) != len(language_codes):
+        logger.warning(f'Multi-language output has {len(valid)} valid languages out of {len(language_codes)}')
+    return valid
+
+
+def _load_json(output: str, expected_type: type) -> Optional[object]:
+    text = output.strip()
+    # models sometimes wrap the JSON in a markdown code block
+    if text.startswith('```'):
+        text = text.strip('`')
+        text = text[text.find('\n') + 1:] if '\n' in text else text
+    try:
+        loaded = json.loads(text)
+    except (TypeError, ValueError):
+        return None
+    return loaded if isinstance(loaded, expected_type) else None
@@ -0,0 +1,252 @@
+"""
+A module to keep all the workers under the requests-per-minute and tokens-per-minute budgets of the OpenAI API
+"""
+
+import asyncio
+from contextlib import contextmanager
+import multiprocessing
+import os
+import random
+import re
+import socket
+import sqlite3
+import threading
+import time
+from typing import Iterator, Optional
+
+from pydantic import BaseModel, Field
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# indexes of the shared state
+_REQUESTS, _TOKENS, _REFILLED_AT, _CONCURRENCY, _IN_FLIGHT, _BLOCKED_UNTIL, _DECREASED_AT = range(7)
+
+
+class RateLimitConfig(BaseModel):
+    enabled: bool = Field(default=False, description='enforce the budgets below across all the workers')
+    requests_per_minute: int = Field(default=500, description='requests per minute budget')
+    tokens_per_minute: int = Field(default=30000, description='tokens per minute budget')
+    min_concurrency: int = Field(default=1, description='lowest number of in-flight requests the limiter can go down to')
+    max_concurrency: int = Field(default=64, description='highest number of in-flight requests the limiter can go up to')
+    latency_target: float = Field(default=20.0, description='seconds, slower calls lower the concurrency')
+    max_retries: int = Field(default=6, description='retries of a rate-limited call')
+    base_delay: float = Field(default=1.0, description='seconds, first backoff delay')
+    max_delay: float = Field(default=60.0, description='seconds, longest backoff delay')
+
+
+def backoff_delay(attempt: int, base_delay: float = 1.0, max_delay: float = 60.0, retry_after: Optional[float] = None) -> float:
+    """
+    Exponential backoff with full jitter. The retry-after of the server, when known, is a lower bound.
+    """
+    delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after + random.uniform(0, base_delay))
+    return delay
+
+
+def parse_duration(value: str) -> Optional[float]:
+    """
+    Parse the durations of the rate limit headers, e.g. '20ms', '1.5s', '6m0s' or a plain number of seconds
+    """
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r'([\d.]+)(ms|h|m|s)', value)
+    if not parts:
+        return None
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    return getattr(error, 'status_code', None) == 429
+
+
+def retry_after_from_error(error: Exception) -> Optional[float]:
+    """
+    Seconds to wait according to the headers of the error response: retry-after, or the reset of an exhausted budget
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    if headers.get('retry-after-ms') is not None:
+        return parse_duration(headers['retry-after-ms']) / 1000
+    if headers.get('retry-after') is not None:
+        return parse_duration(headers['retry-after'])
+    resets = [parse_duration(headers.get(f'x-ratelimit-reset-{kind}'))
+              for kind in ('requests', 'tokens') if headers.get(f'x-ratelimit-remaining-{kind}') == '0']
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+class RateLimiter:
+    """
+    Token buckets for the request and token budgets, with an AIMD limit on the number of in-flight requests.
+    The state lives in shared memory, so a limiter created before the worker pool and passed to the pool
+    initializer is shared by every worker process. See SharedRateLimiter for processes that don't share memory.
+    """
+    def __init__(self, config: RateLimitConfig):
+        self.config = config
+        self._lock = multiprocessing.Lock()
+        self._state = multiprocessing.RawArray('d', [config.requests_per_minute, config.tokens_per_minute, time.monotonic(),
+                                                     config.max_concurrency, 0, 0, 0])
+
+    @contextmanager
+    def _shared_state(self) -> Iterator[list]:
+        """
+        The state shared by the processes, locked for the duration of the block
+        """
+        with self._lock:
+            yield self._state
+
+    def _now(self) -> float:
+        return time.monotonic()
+
+    def _refill(self, state: list, now: float):
+        elapsed = now - state[_REFILLED_AT]
+        state[_REQUESTS] = min(self.config.requests_per_minute, state[_REQUESTS] + elapsed * self.config.requests_per_minute / 60)
+        state[_TOKENS] = min(self.config.tokens_per_minute, state[_TOKENS] + elapsed * self.config.tokens_per_minute / 60)
+        state[_REFILLED_AT] = now
+
+    def _try_acquire(self, tokens: int) -> float:
+        """
+        Take a request and the tokens from the budgets if possible, otherwise return the seconds to wait
+        """
+        tokens = min(tokens, self.config.tokens_per_minute)
+        with self._shared_state() as state:
+            now = self._now()
+            self._refill(state, now)
+            if state[_BLOCKED_UNTIL] > now:
+                return state[_BLOCKED_UNTIL] - now
+            if state[_IN_FLIGHT] >= int(state[_CONCURRENCY]):
+                return 0.05
+            if state[_REQUESTS] < 1:
+                return (1 - state[_REQUESTS]) * 60 / self.config.requests_per_minute
+            if state[_TOKENS] < tokens:
+                return (tokens - state[_TOKENS]) * 60 / self.config.tokens_per_minute
+            state[_REQUESTS] -= 1
+            state[_TOKENS] -= tokens
+            state[_IN_FLIGHT] += 1
+            return 0
+
+    def acquire(self, tokens: int):
+        while (wait := self._try_acquire(tokens)) > 0:
+            time.sleep(min(wait, 1.0) * random.uniform(1, 1.1))
+
+    async def aacquire(self, tokens: int):
+        while (wait := self._try_acquire(tokens)) > 0:
+            await asyncio.sleep(min(wait, 1.0) * random.uniform(1, 1.1))
+
+    def release(self, latency: float, estimated_tokens: int, used_tokens: Optional[int] = None):
+        """
+        Release a successful call: correct the token budget with the actual usage and raise the concurrency additively,
+        unless the call was slower than the latency target
+        """
+        with self._shared_state() as state:
+            state[_IN_FLIGHT] -= 1
+            if used_tokens is not None:
+                state[_TOKENS] -= used_tokens - estimated_tokens
+            concurrency = state[_CONCURRENCY]
+            if latency > self.config.latency_target:
+                self._decrease(state, 0.9)
+            else:
+                state[_CONCURRENCY] = min(self.config.max_concurrency, concurrency + 1 / max(concurrency, 1))
+
+    def release_failure(self, error: Exception):
+        """
+        Release a failed call. A rate limit error halves the concurrency and blocks everyone for the retry-after of the server.
+        """
+        with self._shared_state() as state:
+            state[_IN_FLIGHT] -= 1
+            if not is_rate_limit_error(error):
+                return
+            self._decrease(state, 0.5)
+            retry_after = retry_after_from_error(error)
+            if retry_after:
+                state[_BLOCKED_UNTIL] = max(state[_BLOCKED_UNTIL], self._now() + retry_after)
+            concurrency = int(state[_CONCURRENCY])
+        logger.warning(f'Rate limited, concurrency lowered to {concurrency}')
+
+    def _decrease(self, state: list, factor: float):
+        # a burst of 429s from the same window should only decrease the concurrency once
+        now = self._now()
+        if now - state[_DECREASED_AT] < 1:
+            return
+        state[_DECREASED_AT] = now
+        state[_CONCURRENCY] = max(self.config.min_concurrency, state[_CONCURRENCY] * factor)
+
+    @property
+    def concurrency(self) -> int:
+        with self._shared_state() as state:
+            return int(state[_CONCURRENCY])
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        return backoff_delay(attempt, self.config.base_delay, self.config.max_delay, retry_after_from_error(error))
+
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    A rate limiter whose state lives in a SQLite file instead of shared memory, so that it is shared by processes that
+    don't share memory, e.g. the workers of the work queue, on one machine or several. The in-flight requests are
+    counted per process: those of a process that died are forgotten after stale_seconds without news from it.
+    """
+    def __init__(self, config: RateLimitConfig, path: str, stale_seconds: float = 300.0):
+        self.config = config
+        self.stale_seconds = stale_seconds
+        self._process = f'{socket.gethostname()}-{os.getpid()}'
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        # autocommit mode, the transactions are explicit
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        now = self._now()
+        with self._transaction() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS rate_limit (id INTEGER PRIMARY KEY CHECK (id = 0), requests REAL, tokens REAL, '
+                         'refilled_at REAL, concurrency REAL, blocked_until REAL, decreased_at REAL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS rate_limit_processes (process TEXT PRIMARY KEY, in_flight INTEGER, updated_at REAL)')
+            conn.execute('INSERT OR IGNORE INTO rate_limit VALUES (0, ?, ?, ?, ?, 0, 0)',
+                         (config.requests_per_minute, config.tokens_per_minute, now, config.max_concurrency))
+            conn.execute('DELETE FROM rate_limit_processes WHERE updated_at < ?', (now - stale_seconds,))
+            conn.execute('INSERT OR REPLACE INTO rate_limit_processes VALUES (?, 0, ?)', (self._process, now))
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            # take the write lock of the file up front, so that the processes update the budgets one at a time
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def _now(self) -> float:
+        # the clocks of the processes must agree, which a monotonic clock doesn't across machines
+        return time.time()
+
+    @contextmanager
+    def _shared_state(self) -> Iterator[list]:
+        with self._transaction() as conn:
+            now = self._now()
+            requests, tokens, refilled_at, concurrency, blocked_until, decreased_at = conn.execute(
+                'SELECT requests, tokens, refilled_at, concurrency, blocked_until, decreased_at FROM rate_limit').fetchone()
+            others = conn.execute('SELECT COALESCE(SUM(in_flight), 0) FROM rate_limit_processes WHERE updated_at >= ? AND process != ?',
+                                  (now - self.stale_seconds, self._process)).fetchone()[0]
+            state = [requests, tokens, refilled_at, concurrency, others + self._in_flight, blocked_until, decreased_at]
+            yield state
+            conn.execute('UPDATE rate_limit SET requests = ?, tokens = ?, refilled_at = ?, concurrency = ?, blocked_until = ?, decreased_at = ?',
+                         (state[_REQUESTS], state[_TOKENS], state[_REFILLED_AT], state[_CONCURRENCY], state[_BLOCKED_UNTIL], state[_DECREASED_AT]))
+            self._in_flight = max(0, int(state[_IN_FLIGHT]) - others)
+            conn.execute('INSERT OR REPLACE INTO rate_limit_processes VALUES (?, ?, ?)', (self._process, self._in_flight, now))
+
+    def close(self):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM rate_limit_processes WHERE process = ?', (self._process,))
+        with self._lock:
+            self._conn.close()
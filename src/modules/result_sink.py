@@ -0,0 +1,67 @@
+"""
+A module to assemble the translations of a sheet column into its target columns
+"""
+
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class ResultSink:
+    """
+    Output of the translations of a sheet column: a slot per row of the sheet, preallocated and aligned to its rows.
+    Results are filled in place in any order, and all the slots are turned into the '{language_code} {pattern}'
+    target columns in one step. Target columns that are not in the sheet are skipped.
+    """
+    def __init__(self, df: pd.DataFrame, language_codes: List[str], pattern: str):
+        self.index = df.index
+        self.columns = [f'{lang_code} {pattern}' for lang_code in language_codes]
+        sheet_columns = set(df.columns)
+        self._present = [position for position, column in enumerate(self.columns) if column in sheet_columns]
+        missing = [column for column in self.columns if column not in sheet_columns]
+        if missing:
+            logger.warning(f'Target columns {missing} not found, their translations are skipped')
+        self._empty = [None] * len(language_codes)
+        # the translations of every row, ordered like the language codes
+        self._rows: List[List[Optional[str]]] = [self._empty] * len(self.index)
+
+    def add(self, results: List[Tuple[int, Optional[List[Optional[str]]]]]):
+        """
+        Fill the (index, translations) results, translations being ordered like the language codes, or None if all failed
+        """
+        indexes = [index for index, _ in results]
+        if isinstance(self.index, pd.RangeIndex) and self.index.start == 0 and self.index.step == 1:
+            # the rows of a sheet are numbered from 0, the index is the position
+            positions = [index if 0 <= index < len(self.index) else -1 for index in indexes]
+        else:
+            positions = self.index.get_indexer(indexes).tolist()
+        skipped = 0
+        rows = self._rows
+        for position, (_, translations) in zip(positions, results):
+            if position < 0:
+                skipped += 1
+            elif translations:
+                rows[position] = translations
+        if skipped:
+            logger.warning(f'{skipped} results are not rows of the sheet and are skipped')
+
+    def to_df(self) -> pd.DataFrame:
+        """
+        The translations as a DataFrame indexed like the sheet, with a column per target column found in the sheet
+        """
+        df = pd.DataFrame(self._rows, index=self.index, columns=self.columns, dtype=object)
+        return df.iloc[:, self._present]
+
+    def assign(self, df: pd.DataFrame):
+        """
+        Assign the translations to the target columns of df, leaving the cells without a translation unchanged
+        """
+        translations = self.to_df()
+        for column in translations.columns:
+            values = translations[column].to_numpy()
+            df[column] = np.where(pd.notna(values), values, df[column].to_numpy(dtype=object))
@@ -0,0 +1,98 @@
+"""
+A module to route the texts of a job to model profiles by column kind and token length, e.g. short skill names to a
+faster and cheaper model than the descriptions
+"""
+
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+from modules.model_config import ModelConfig
+from modules.scheduling import SchedulingConfig
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# the profile of the model section of params.yaml, for the texts no profile matches
+DEFAULT_PROFILE = 'default'
+
+
+def column_kind(column: str) -> str:
+    """
+    The kind of the texts of a column: 'name' or 'description', like the target columns they are written to
+    """
+    return 'name' if 'name' in column else 'description'
+
+
+class RoutingProfile(BaseModel):
+    name: str = Field(description='name of the profile, the label of its metrics')
+    model_name: str = Field(description='openai model of the profile')
+    temperature: Optional[float] = Field(default=None, description='temperature of the model, defaults to the model section')
+    column_kind: Optional[str] = Field(default=None, description="'name' or 'description' texts only, None for both")
+    max_tokens: Optional[int] = Field(default=None, description='texts up to this number of tokens only, None for any length')
+    max_concurrency: Optional[int] = Field(default=None, description='requests of the profile in flight at a time, None for no limit')
+    input_cost_per_million: Optional[float] = Field(default=None, description='USD per million input tokens, defaults to the scheduling section')
+    output_cost_per_million: Optional[float] = Field(default=None, description='USD per million output tokens, defaults to the scheduling section')
+
+    def matches(self, kind: Optional[str], tokens: int) -> bool:
+        if self.column_kind is not None and kind != self.column_kind:
+            return False
+        return self.max_tokens is None or tokens <= self.max_tokens
+
+
+class RoutingConfig(BaseModel):
+    enabled: bool = Field(default=False, description='route the texts to the profiles, otherwise all go to the model section')
+    profiles: List[RoutingProfile] = Field(default_factory=list, description='the first matching profile of a text is used')
+
+
+class ModelRouter:
+    """
+    Picks the profile of every text: the first profile matching its column kind and token length, or the default profile
+    with the model of the model section. Every profile has its own model config, costs and concurrency limit.
+    """
+    def __init__(self, config: RoutingConfig, model_config: ModelConfig, scheduling: Optional[SchedulingConfig] = None):
+        self.config = config
+        scheduling = scheduling or SchedulingConfig()
+        self.profiles = config.profiles if config.enabled else []
+        self._model_configs: Dict[str, ModelConfig] = {
+            DEFAULT_PROFILE: model_config.model_copy(update={'profile': DEFAULT_PROFILE,
+                                                             'input_cost_per_million': scheduling.input_cost_per_million,
+                                                             'output_cost_per_million': scheduling.output_cost_per_million})
+        }
+        self._limits: Dict[str, Optional[int]] = {DEFAULT_PROFILE: None}
+        for profile in self.profiles:
+            if profile.name in self._model_configs:
+                raise ValueError(f'Duplicate routing profile {profile.name!r}')
+            self._model_configs[profile.name] = model_config.model_copy(update={
+                'profile': profile.name,
+                'llm_model_name': profile.model_name,
+                'temperature': profile.temperature if profile.temperature is not None else model_config.temperature,
+                'input_cost_per_million': (profile.input_cost_per_million if profile.input_cost_per_million is not None
+                                           else scheduling.input_cost_per_million),
+                'output_cost_per_million': (profile.output_cost_per_million if profile.output_cost_per_million is not None
+                                            else scheduling.output_cost_per_million),
+            })
+            self._limits[profile.name] = profile.max_concurrency
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._model_configs)
+
+    def route(self, kind: Optional[str], tokens: int) -> str:
+        for profile in self.profiles:
+            if profile.matches(kind, tokens):
+                return profile.name
+        return DEFAULT_PROFILE
+
+    def model_config(self, profile: str) -> ModelConfig:
+        return self._model_configs[profile]
+
+    def model_configs(self) -> Dict[str, ModelConfig]:
+        return dict(self._model_configs)
+
+    def concurrency(self, profile: str, concurrency: int) -> int:
+        """
+        Requests of the profile in flight at a time, when the job has concurrency requests in flight
+        """
+        limit = self._limits[profile]
+        return concurrency if limit is None else min(limit, concurrency)
@@ -0,0 +1,132 @@
+"""
+A module with the wrappers of the model of a chain: every call is instrumented and goes through the rate limiter
+"""
+
+import asyncio
+import time
+from typing import Any, Callable, Optional, Tuple
+
+from langchain_core.runnables import Runnable
+
+from modules.metrics import LLM_COST, LLM_IN_FLIGHT, LLM_REQUEST_SECONDS, LLM_REQUESTS, LLM_RETRIES, LLM_TOKENS
+from modules.model_config import ModelConfig
+from modules.packing import estimate_tokens
+from modules.rate_limiter import RateLimiter, is_rate_limit_error
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def _token_usage(output: Any) -> Tuple[Optional[int], Optional[int]]:
+    usage = getattr(output, 'usage_metadata', None)
+    if usage:
+        return usage.get('input_tokens'), usage.get('output_tokens')
+    token_usage = (getattr(output, 'response_metadata', None) or {}).get('token_usage') or {}
+    return token_usage.get('prompt_tokens'), token_usage.get('completion_tokens')
+
+
+class InstrumentedRunnable(Runnable):
+    """
+    Wraps the model of a chain to record the latency, the outcome, the tokens and the cost of every call, per prompt
+    kind and routing profile
+    """
+    def __init__(self, runnable: Runnable, prompt_kind: str, model_config: Optional[ModelConfig] = None):
+        self.runnable = runnable
+        self.prompt_kind = prompt_kind
+        self.profile = model_config.profile if model_config is not None else 'default'
+        self._costs = ((model_config.input_cost_per_million or 0.0, model_config.output_cost_per_million or 0.0)
+                       if model_config is not None else (0.0, 0.0))
+
+    def _record(self, start: float, output: Any = None, error: Optional[Exception] = None):
+        LLM_IN_FLIGHT.dec()
+        LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, prompt=self.prompt_kind, profile=self.profile)
+        LLM_REQUESTS.inc(prompt=self.prompt_kind, profile=self.profile, outcome='ok' if error is None else type(error).__name__)
+        if error is None:
+            input_tokens, output_tokens = _token_usage(output)
+            if input_tokens:
+                LLM_TOKENS.inc(input_tokens, prompt=self.prompt_kind, profile=self.profile, direction='input')
+            if output_tokens:
+                LLM_TOKENS.inc(output_tokens, prompt=self.prompt_kind, profile=self.profile, direction='output')
+            cost = ((input_tokens or 0) * self._costs[0] + (output_tokens or 0) * self._costs[1]) / 1e6
+            if cost:
+                LLM_COST.inc(cost, profile=self.profile)
+
+    def invoke(self, input: Any, config=None, **kwargs) -> Any:
+        LLM_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            output = self.runnable.invoke(input, config, **kwargs)
+        except Exception as e:
+            self._record(start, error=e)
+            raise
+        self._record(start, output)
+        return output
+
+    async def ainvoke(self, input: Any, config=None, **kwargs) -> Any:
+        LLM_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            output = await self.runnable.ainvoke(input, config, **kwargs)
+        except Exception as e:
+            self._record(start, error=e)
+            raise
+        self._record(start, output)
+        return output
+
+
+def _used_tokens(output: Any) -> Optional[int]:
+    usage = getattr(output, 'usage_metadata', None)
+    if usage:
+        return usage.get('total_tokens')
+    token_usage = (getattr(output, 'response_metadata', None) or {}).get('token_usage') or {}
+    return token_usage.get('total_tokens')
+
+
+class RateLimitedRunnable(Runnable):
+    """
+    Wraps the model of a chain, so that every call goes through the rate limiter and rate-limited calls are retried.
+    The tokens of a call are counted by count_tokens, e.g. the token counter of the model, until the response tells them.
+    """
+    def __init__(self, runnable: Runnable, rate_limiter: RateLimiter, count_tokens: Callable[[str], int] = estimate_tokens):
+        self.runnable = runnable
+        self.rate_limiter = rate_limiter
+        self.count_tokens = count_tokens
+
+    def _estimate_tokens(self, input: Any) -> int:
+        text = input.to_string() if hasattr(input, 'to_string') else str(input)
+        # the output is about as long as the input for a translation
+        return 2 * self.count_tokens(text)
+
+    def invoke(self, input: Any, config=None, **kwargs) -> Any:
+        tokens = self._estimate_tokens(input)
+        for attempt in range(self.rate_limiter.config.max_retries + 1):
+            self.rate_limiter.acquire(tokens)
+            start = time.monotonic()
+            try:
+                output = self.runnable.invoke(input, config, **kwargs)
+            except Exception as e:
+                self.rate_limiter.release_failure(e)
+                if not is_rate_limit_error(e) or attempt == self.rate_limiter.config.max_retries:
+                    raise
+                LLM_RETRIES.inc(reason='rate_limit')
+                time.sleep(self.rate_limiter.backoff(attempt, e))
+                continue
+            self.rate_limiter.release(time.monotonic() - start, tokens, _used_tokens(output))
+            return output
+
+    async def ainvoke(self, input: Any, config=None, **kwargs) -> Any:
+        tokens = self._estimate_tokens(input)
+        for attempt in range(self.rate_limiter.config.max_retries + 1):
+            await self.rate_limiter.aacquire(tokens)
+            start = time.monotonic()
+            try:
+                output = await self.runnable.ainvoke(input, config, **kwargs)
+            except Exception as e:
+                self.rate_limiter.release_failure(e)
+                if not is_rate_limit_error(e) or attempt == self.rate_limiter.config.max_retries:
+                    raise
+                LLM_RETRIES.inc(reason='rate_limit')
+                await asyncio.sleep(self.rate_limiter.backoff(attempt, e))
+                continue
+            self.rate_limiter.release(time.monotonic() - start, tokens, _used_tokens(output))
+            return output
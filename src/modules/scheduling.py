@@ -0,0 +1,169 @@
+"""
+A module to estimate the tokens of the translation tasks of a job, to order them longest first and to estimate the cost
+and duration of the job before it starts
+"""
+
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+from modules.packing import estimate_tokens
+from modules.rate_limiter import RateLimitConfig
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# tokens of the JSON keys and quotes around a packed text
+PACKED_ITEM_OVERHEAD = 10
+
+
+class SchedulingConfig(BaseModel):
+    longest_first: bool = Field(default=True, description='dispatch the tasks with the longest outputs first')
+    token_budget: Optional[int] = Field(default=None, description='jobs estimated above this number of tokens are refused')
+    input_cost_per_million: float = Field(default=2.5, description='USD per million input tokens')
+    output_cost_per_million: float = Field(default=10.0, description='USD per million output tokens')
+    output_ratio: float = Field(default=1.2, description='tokens of a translation per token of its text')
+    seconds_per_output_token: float = Field(default=0.02, description='generation time of an output token')
+    seconds_per_request: float = Field(default=0.5, description='time of a request besides the generation')
+
+
+class JobEstimate(BaseModel):
+    requests: int = Field(default=0, description='model calls, without retries')
+    input_tokens: int = Field(default=0, description='estimated input tokens')
+    output_tokens: int = Field(default=0, description='estimated output tokens')
+    cost: float = Field(default=0.0, description='estimated cost in USD')
+    duration_seconds: float = Field(default=0.0, description='estimated duration of the translation')
+    profiles: Dict[str, 'JobEstimate'] = Field(default_factory=dict, description='estimate of the texts of each routing profile')
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def add(self, other: 'JobEstimate') -> 'JobEstimate':
+        profiles = dict(self.profiles)
+        for name, estimate in other.profiles.items():
+            profiles[name] = profiles[name].add(estimate) if name in profiles else estimate
+        return JobEstimate(requests=self.requests + other.requests,
+                           input_tokens=self.input_tokens + other.input_tokens,
+                           output_tokens=self.output_tokens + other.output_tokens,
+                           cost=self.cost + other.cost,
+                           duration_seconds=self.duration_seconds + other.duration_seconds,
+                           profiles=profiles)
+
+
+JobEstimate.model_rebuild()
+
+
+class TokenBudgetExceeded(ValueError):
+    """
+    Raised when the estimated tokens of a job are above its token budget
+    """
+
+
+class TokenCounter:
+    """
+    Counts the tokens of a text with the tokenizer of the model if tiktoken is usable, otherwise estimates them from its length
+    """
+    def __init__(self, model_name: str):
+        self._encoding = None
+        try:
+            import tiktoken
+            self._encoding = tiktoken.encoding_for_model(model_name)
+        except Exception as e:
+            # tiktoken not installed, unknown model, or the encoding can't be downloaded
+            logger.warning(f'Token counts of {model_name} are estimated from the text length: {e}')
+
+    def count(self, text: str) -> int:
+        if self._encoding is None:
+            return estimate_tokens(text)
+        return max(1, len(self._encoding.encode(str(text), disallowed_special=())))
+
+
+@lru_cache(maxsize=None)
+def token_counter(model_name: str) -> TokenCounter:
+    """
+    The token counter of a model, loaded once per process
+    """
+    return TokenCounter(model_name)
+
+
+class TaskEstimate:
+    """
+    Estimated requests and tokens of a translation task. The length of its longest output drives its duration.
+    """
+    __slots__ = ('requests', 'input_tokens', 'output_tokens', 'longest_output')
+
+    def __init__(self, requests: int, input_tokens: int, output_tokens: int, longest_output: int):
+        self.requests = requests
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.longest_output = longest_output
+
+
+class TranslationScheduler:
+    """
+    Orders the translation tasks of a job and estimates its cost and duration.
+    prompt_tokens are the tokens of each prompt ('text', 'packed' and 'multi_language') without the text to translate.
+    """
+    def __init__(self, config: SchedulingConfig, counter: TokenCounter, prompt_tokens: Dict[str, int]):
+        self.config = config
+        self.counter = counter
+        self.prompt_tokens = prompt_tokens
+
+    def _output(self, tokens: int) -> int:
+        return int(tokens * self.config.output_ratio) + 1
+
+    def estimate_single(self, text: str, num_languages: int, multi_language: bool) -> TaskEstimate:
+        """
+        A text translated to its languages in a single request, or in a request per language
+        """
+        tokens = self.counter.count(text)
+        if multi_language:
+            output = self._output(tokens) * num_languages
+            return TaskEstimate(1, self.prompt_tokens['multi_language'] + tokens, output, output)
+        output = self._output(tokens)
+        return TaskEstimate(num_languages, num_languages * (self.prompt_tokens['text'] + tokens), num_languages * output, output)
+
+    def estimate_packed(self, texts: List[str]) -> TaskEstimate:
+        """
+        Texts packed in a single request for a language
+        """
+        tokens = [self.counter.count(text) + PACKED_ITEM_OVERHEAD for text in texts]
+        output = sum(self._output(count) for count in tokens)
+        return TaskEstimate(1, self.prompt_tokens['packed'] + sum(tokens), output, output)
+
+    def schedule(self, tasks: List[Tuple[tuple, TaskEstimate]]) -> List[tuple]:
+        """
+        Order the tasks, longest first if configured, so that long tasks don't finish last and hold the end of the job
+        """
+        if self.config.longest_first:
+            tasks = sorted(tasks, key=lambda task: task[1].longest_output, reverse=True)
+        return [task for task, _ in tasks]
+
+    def estimate(self, estimates: List[TaskEstimate], concurrency: int, rate_limit: Optional[RateLimitConfig] = None,
+                 costs: Optional[Tuple[float, float]] = None) -> JobEstimate:
+        """
+        Estimate the cost and duration of the tasks. The duration is bounded by the concurrency and by the rate limits.
+        costs are the USD per million input and output tokens, those of the config by default.
+        """
+        input_cost, output_cost = costs or (self.config.input_cost_per_million, self.config.output_cost_per_million)
+        requests = sum(estimate.requests for estimate in estimates)
+        input_tokens = sum(estimate.input_tokens for estimate in estimates)
+        output_tokens = sum(estimate.output_tokens for estimate in estimates)
+        cost = (input_tokens * input_cost + output_tokens * output_cost) / 1e6
+        busy = requests * self.config.seconds_per_request + output_tokens * self.config.seconds_per_output_token
+        duration = busy / max(1, concurrency)
+        if estimates:
+            # the longest task can't be shared between workers
+            duration = max(duration, self.config.seconds_per_request + max(e.longest_output for e in estimates) * self.config.seconds_per_output_token)
+        if rate_limit is not None and rate_limit.enabled:
+            duration = max(duration, 60 * requests / rate_limit.requests_per_minute,
+                           60 * (input_tokens + output_tokens) / rate_limit.tokens_per_minute)
+        return JobEstimate(requests=requests, input_tokens=input_tokens, output_tokens=output_tokens,
+                           cost=round(cost, 4), duration_seconds=round(duration, 1))
+
+    def check_budget(self, estimate: JobEstimate):
+        budget = self.config.token_budget
+        if budget is not None and estimate.total_tokens > budget:
+            raise TokenBudgetExceeded(f'The job is estimated at {estimate.total_tokens} tokens, above its budget of {budget} tokens')
@@ -0,0 +1,110 @@
+"""
+A module for the delta translation of workbooks: the hash of the source text of every translation is kept in a hidden
+sheet of the translated workbook, so that a new run only translates the cells whose target is empty or whose source changed
+"""
+
+from collections import defaultdict
+import hashlib
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+from pydantic import BaseModel, Field
+
+from modules.routing import column_kind
+from utils.logger import setup_logger
+from utils.utils import normalize_text
+
+# pandas is imported by the methods that need it: DeltaConfig is imported by the API before the engine, see ENGINE_MODULES
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from modules.translation_plan import TranslationPlan
+    from modules.workbook import Workbook
+
+logger = setup_logger(__name__)
+
+# the hidden sheet with the hashes, not offered for translation by the app
+SOURCE_HASH_SHEET = '_source_hashes'
+KEY_COLUMNS = ['sheet', 'column', 'row']
+
+
+class DeltaConfig(BaseModel):
+    enabled: bool = Field(default=False, description='skip the cells whose translation is filled and whose source is unchanged')
+
+
+def source_hash(text: str) -> str:
+    """
+    Hash of a source text, insensitive to the differences the translation memory ignores too
+    """
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()[:16]
+
+
+class SourceHashes:
+    """
+    The hash of the source text each translation of a workbook was made from, per (sheet, source column, row) and
+    language. A translation is up to date when its target cell is filled and the hash of its source is unchanged.
+    Cells translated without a hash, e.g. before the delta translation was enabled, are translated again once.
+    """
+    def __init__(self):
+        self._hashes: Dict[Tuple[str, str, int], Dict[str, str]] = defaultdict(dict)
+
+    @classmethod
+    def read(cls, workbook: 'Workbook') -> 'SourceHashes':
+        import pandas as pd
+
+        hashes = cls()
+        df = workbook.read_table(SOURCE_HASH_SHEET)
+        if df is None:
+            return hashes
+        languages = [column for column in df.columns if column not in KEY_COLUMNS]
+        for row in df.itertuples(index=False):
+            values = dict(zip(df.columns, row))
+            key = (values['sheet'], values['column'], int(values['row']))
+            hashes._hashes[key] = {lang_code: values[lang_code] for lang_code in languages if pd.notna(values[lang_code])}
+        logger.info(f'Read the source hashes of {len(hashes._hashes)} cells')
+        return hashes
+
+    def done(self, sheet: str, column: str, df: 'pd.DataFrame', language_codes: List[str]) -> Dict[int, Set[str]]:
+        """
+        The languages whose translation is up to date, for every row of the column of the sheet df that has any
+        """
+        import pandas as pd
+
+        kind = column_kind(column)
+        targets = {lang_code: df[f'{lang_code} {kind}'] for lang_code in language_codes if f'{lang_code} {kind}' in df.columns}
+        done = {}
+        values = df[column]
+        for index, text in values[values.notna()].items():
+            hashes = self._hashes.get((sheet, column, index))
+            if not hashes:
+                continue
+            text_hash = source_hash(text)
+            languages = {lang_code for lang_code, target in targets.items()
+                         if hashes.get(lang_code) == text_hash and pd.notna(target[index]) and str(target[index]).strip()}
+            if languages:
+                done[index] = languages
+        return done
+
+    def update(self, plan: 'TranslationPlan', cell_results: Dict[Tuple[str, str], List[Tuple[int, Optional[List[Optional[str]]]]]]):
+        """
+        Record the hash of the source of the cells translated by the job, cell_results being the fan out of the plan
+        """
+        unit_hashes = {}
+        for sheet_column, results in cell_results.items():
+            for (index, unit_id), (_, translations) in zip(plan.cells[sheet_column], results):
+                if not translations:
+                    continue
+                if unit_id not in unit_hashes:
+                    unit_hashes[unit_id] = source_hash(plan.units[unit_id])
+                hashes = self._hashes[(*sheet_column, index)]
+                for lang_code, translation in zip(plan.language_codes, translations):
+                    if translation is not None:
+                        hashes[lang_code] = unit_hashes[unit_id]
+
+    def write(self, workbook: 'Workbook'):
+        """
+        Write the hashes to the hidden sheet of the workbook, to be saved with it
+        """
+        languages = sorted({lang_code for hashes in self._hashes.values() for lang_code in hashes})
+        rows = [[sheet, column, row] + [hashes.get(lang_code) for lang_code in languages]
+                for (sheet, column, row), hashes in sorted(self._hashes.items()) if hashes]
+        workbook.write_table(SOURCE_HASH_SHEET, KEY_COLUMNS + languages, rows)
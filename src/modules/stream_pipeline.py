@@ -0,0 +1,193 @@
+"""
+A module to translate very large CSV and JSON lines files chunk by chunk, with a memory use bounded by the chunk size
+"""
+
+import json
+import os
+import queue
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from modules.data_reader import DataReader
+from modules.result_sink import ResultSink
+from modules.translation_plan import TranslationPlan
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+STREAM_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+# translates (index, text) pairs, with the column kind of every index, returning the results and the failed (index, language) items
+Translator = Callable[[List[Tuple[int, str]], Dict[int, str]], Tuple[List[Tuple[int, List[Optional[str]]]], List[Tuple[int, str]]]]
+
+
+def stream_format(file_name: str) -> Optional[str]:
+    """
+    The streaming format of a file from its extension, None if the file can't be streamed
+    """
+    return STREAM_FORMATS.get(os.path.splitext(file_name or '')[1].lower())
+
+
+def prefetch(chunks: Iterator[pd.DataFrame], size: int) -> Iterator[pd.DataFrame]:
+    """
+    Read up to size chunks ahead in a thread, so that the next chunks are read while the current one is translated.
+    The errors of the reading are raised when the chunk they stopped at is reached.
+    """
+    buffer = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    end = object()
+
+    def put(item) -> bool:
+        # gives up when the consumer stopped, e.g. because the translation of a chunk failed
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read():
+        try:
+            for chunk in chunks:
+                if not put(chunk):
+                    return
+            put(end)
+        except Exception as e:
+            put(e)
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+
+    reader = threading.Thread(target=read, name='stream_prefetch', daemon=True)
+    reader.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is end:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        reader.join()
+
+
+class StreamingTranslationPipeline:
+    """
+    Reads the input in chunks, translates the selected columns of every chunk and appends the translated rows
+    to the output, in the input order. Identical texts are translated once per chunk.
+    The next prefetch_chunks chunks are read while a chunk is translated, and the translation of a chunk is written
+    before the next one is translated, so at most prefetch_chunks + 1 chunks are in memory at a time.
+    """
+    def __init__(self, translate: Translator, columns: List[str], language_codes: List[str], chunksize: int = 1000,
+                 failed_path: Optional[str] = None, prefetch_chunks: int = 1):
+        """
+        The cells that failed are reported to failed_path, one JSON line per cell.
+        With prefetch_chunks 0, a chunk is only read once the previous one is written.
+        """
+        self.translate = translate
+        self.columns = columns
+        self.language_codes = language_codes
+        self.chunksize = chunksize
+        self.prefetch_chunks = prefetch_chunks
+        self.rows_written = 0
+        self.cells_failed = 0
+        self.failed_path = failed_path
+        self._failed_file = None
+        self._units = 0
+
+    def read_chunks(self, input_path: str, file_format: str) -> Iterator[pd.DataFrame]:
+        reader = DataReader()
+        if file_format == 'csv':
+            chunks = reader.iter_csv(input_path, self.chunksize)
+        else:
+            chunks = reader.iter_jsonl(input_path, self.chunksize)
+        with chunks:
+            for chunk in chunks:
+                missing = [column for column in self.columns if column not in chunk.columns]
+                if missing:
+                    raise ValueError(f'Columns {missing} not found in {input_path}')
+                yield chunk
+
+    def translate_chunks(self, chunks: Iterator[pd.DataFrame], empty_value: Optional[str] = None) -> Iterator[pd.DataFrame]:
+        """
+        Translate every chunk, adding the translations to the '{language_code} name' or '{language_code} description'
+        columns, which are created with empty_value if missing. Cells that failed are left unchanged and reported.
+        """
+        for chunk in chunks:
+            plan = TranslationPlan()
+            for column in self.columns:
+                values = chunk[column]
+                plan.add_column('', column, values[values.notna()].astype(str))
+
+            # unit ids are made unique across the chunks, for the progress of the job
+            offset = self._units
+            self._units += len(plan.units)
+            results, failed_items = [], []
+            if plan.units:
+                kinds = {offset + unit_id: kind for unit_id, kind in plan.unit_kinds().items()}
+                results, failed_items = self.translate([(offset + unit_id, text) for unit_id, text in plan.text_index_pairs()], kinds)
+                results = [(index - offset, translations) for index, translations in results]
+
+            for (_, column), cell_results in plan.fan_out(results).items():
+                self._assign(chunk, column, cell_results, empty_value)
+            if failed_items:
+                self._report_failures(plan.failed_cells([(index - offset, lang_code) for index, lang_code in failed_items]))
+            yield chunk
+
+    def _report_failures(self, failed_cells: List[dict]):
+        self.cells_failed += len(failed_cells)
+        if self.failed_path is None:
+            return
+        if self._failed_file is None:
+            self._failed_file = open(self.failed_path, 'w', encoding='utf-8')
+        for cell in failed_cells:
+            del cell['sheet']
+            self._failed_file.write(json.dumps(cell, ensure_ascii=False) + '\n')
+        self._failed_file.flush()
+
+    def _assign(self, chunk: pd.DataFrame, column: str, cell_results: List[Tuple[int, List[Optional[str]]]], empty_value: Optional[str]):
+        pattern = 'name' if 'name' in column else 'description'
+        for lang_code in self.language_codes:
+            if f'{lang_code} {pattern}' not in chunk.columns:
+                chunk[f'{lang_code} {pattern}'] = empty_value
+        sink = ResultSink(chunk, self.language_codes, pattern)
+        sink.add(cell_results)
+        sink.assign(chunk)
+
+    def write_chunks(self, chunks: Iterator[pd.DataFrame], output_path: str, file_format: str):
+        """
+        Append every chunk to the output as soon as it is translated
+        """
+        with open(output_path, 'w', encoding='utf-8', newline='') as f:
+            for chunk in chunks:
+                if file_format == 'csv':
+                    chunk.to_csv(f, header=self.rows_written == 0, index=False)
+                else:
+                    lines = chunk.to_json(orient='records', lines=True, force_ascii=False)
+                    f.write(lines if lines.endswith('\n') else lines + '\n')
+                f.flush()
+                self.rows_written += len(chunk)
+                logger.info(f'Wrote {self.rows_written} rows to {output_path}')
+
+    def run(self, input_path: str, output_path: str, file_format: str) -> int:
+        """
+        Translate input_path to output_path and return the number of rows written
+        """
+        try:
+            # csv cells are read as strings, empty cells being empty strings, while JSON has nulls
+            chunks = self.read_chunks(input_path, file_format)
+            if self.prefetch_chunks > 0:
+                chunks = prefetch(chunks, self.prefetch_chunks)
+            chunks = self.translate_chunks(chunks, '' if file_format == 'csv' else None)
+            self.write_chunks(chunks, output_path, file_format)
+        finally:
+            if self._failed_file is not None:
+                self._failed_file.close()
+                self._failed_file = None
+        return self.rows_written
@@ -0,0 +1,115 @@
+"""
+A module to keep an on-disk translation memory in front of the LLM chain
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from modules.model_config import ModelConfig
+from utils.logger import setup_logger
+from utils.utils import normalize_text
+
+if TYPE_CHECKING:
+    from langchain_core.prompts import ChatPromptTemplate
+
+logger = setup_logger(__name__)
+
+
+def prompt_fingerprint(prompts: List['ChatPromptTemplate']) -> str:
+    """
+    Hash the message templates of the prompts, so that a change in any of them invalidates the memory
+    """
+    templates = []
+    for prompt in prompts:
+        for message in prompt.messages:
+            template = getattr(getattr(message, 'prompt', None), 'template', None)
+            templates.append(template if template is not None else repr(message))
+    return hashlib.sha256('\n'.join(templates).encode('utf-8')).hexdigest()
+
+
+class TranslationMemory:
+    """
+    SQLite backed translation memory.
+    Entries are keyed by model name, temperature, prompt template hash, target language and normalized source text.
+    The prompts are all those a translation can come from, e.g. the single text, packed and multi-language prompts,
+    since a text translated by one of them is looked up before knowing which one would translate it.
+    The model is the one of the constructor, unless the model of the routing profile of a text is given.
+    """
+    def __init__(self, path: str, model_config: ModelConfig, prompts: List['ChatPromptTemplate'], max_entries: int = 200000, max_age_days: float = 180):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self.model_config = model_config
+        self._prompt_fingerprint = prompt_fingerprint(prompts)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS translations ('
+                'key TEXT PRIMARY KEY, language TEXT, translation TEXT, created_at REAL, last_used_at REAL)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used_at)')
+        self.evict()
+
+    def _key(self, text: str, language: str, model_config: Optional[ModelConfig] = None) -> str:
+        model_config = model_config or self.model_config
+        raw = f'{model_config.llm_model_name}|{model_config.temperature}|{self._prompt_fingerprint}|{language}|{normalize_text(text)}'
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def lookup(self, text: str, language_codes: List[str], model_config: Optional[ModelConfig] = None) -> Dict[str, str]:
+        """
+        Return the stored translations of the text by model_config keyed by language code. Missing languages are counted as misses.
+        """
+        keys = {self._key(text, lang_code, model_config): lang_code for lang_code in language_codes}
+        placeholders = ','.join('?' for _ in keys)
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT key, translation FROM translations WHERE key IN ({placeholders})', list(keys)
+            ).fetchall()
+            if rows:
+                with self._conn:
+                    self._conn.executemany('UPDATE translations SET last_used_at = ? WHERE key = ?',
+                                           [(time.time(), key) for key, _ in rows])
+            self.hits += len(rows)
+            self.misses += len(keys) - len(rows)
+        return {keys[key]: translation for key, translation in rows}
+
+    def store(self, text: str, translations: List[Tuple[str, str]], model_config: Optional[ModelConfig] = None):
+        """
+        Store the (language code, translation) pairs of the text translated by model_config. Empty translations are not stored.
+        """
+        now = time.time()
+        rows = [(self._key(text, lang_code, model_config), lang_code, translation, now, now)
+                for lang_code, translation in translations if translation]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?)', rows)
+
+    def evict(self):
+        """
+        Remove entries older than max_age_days, then the least recently used entries above max_entries
+        """
+        with self._lock, self._conn:
+            expired = self._conn.execute('DELETE FROM translations WHERE created_at < ?',
+                                         (time.time() - self.max_age_days * 86400,)).rowcount
+            overflow = self._conn.execute(
+                'DELETE FROM translations WHERE key IN ('
+                'SELECT key FROM translations ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)', (self.max_entries,)
+            ).rowcount
+        if expired or overflow:
+            logger.info(f'Evicted {expired} expired and {overflow} overflowing entries from translation memory')
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            size = self._conn.execute('SELECT COUNT(*) FROM translations').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'size': size}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,126 @@
+"""
+A module to plan the translation of a job, collapsing identical texts across rows, columns and sheets
+"""
+
+from collections import defaultdict
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+
+from modules.routing import column_kind
+from utils.logger import setup_logger
+from utils.utils import normalize_text
+
+if TYPE_CHECKING:
+    from modules.source_hashes import SourceHashes
+
+logger = setup_logger(__name__)
+
+
+class TranslationPlan:
+    """
+    Collects the cells of all the selected sheet/column pairs of a job and collapses identical texts into units.
+    All the cells of a job are translated to the same languages, so a unit stands for every (text, language) pair of its text.
+    With a delta translation, the languages whose translation of a cell is up to date are left out of the plan:
+    a unit then stands for the languages needed by any of its cells, and the cells only receive the others.
+    """
+    def __init__(self, language_codes: Optional[List[str]] = None, source_hashes: Optional['SourceHashes'] = None):
+        self.language_codes = language_codes or []
+        # the hashes of the sources of the translations in the workbook, for a delta translation
+        self.source_hashes = source_hashes
+        self._unit_ids: Dict[str, int] = {}
+        self.units: List[str] = []
+        self.kinds: List[str] = []
+        self.cells: Dict[Tuple[str, str], List[Tuple[int, int]]] = defaultdict(list)
+        # languages up to date per cell, and languages needed per unit, for a delta translation
+        self.done: Dict[Tuple[str, str], Dict[int, Set[str]]] = defaultdict(dict)
+        self._unit_languages: Dict[int, Set[str]] = defaultdict(set)
+        self.items_skipped = 0
+
+    def add_column(self, sheet: str, column: str, values: pd.Series, done: Optional[Dict[int, Set[str]]] = None):
+        """
+        Add the cells of a sheet column to the plan. Empty cells have nothing to translate and are left out.
+        done maps rows to their languages whose translation is up to date, a row up to date in every language is left out.
+        """
+        cells = self.cells[(sheet, column)]
+        kind = column_kind(column)
+        values = values[values.notna()]
+        for index, text in zip(values.index.tolist(), values.tolist()):
+            key = normalize_text(text)
+            if not key:
+                continue
+            done_languages = done.get(index) if done else None
+            if done_languages:
+                self.items_skipped += len(done_languages)
+                if len(done_languages) == len(self.language_codes):
+                    continue
+                self.done[(sheet, column)][index] = done_languages
+            unit_id = self._unit_ids.get(key)
+            if unit_id is None:
+                unit_id = len(self.units)
+                self._unit_ids[key] = unit_id
+                self.units.append(text)
+                self.kinds.append(kind)
+            elif kind == 'description':
+                # a text found in a description column is routed as a description
+                self.kinds[unit_id] = kind
+            self._unit_languages[unit_id].update(lang_code for lang_code in self.language_codes
+                                                 if not done_languages or lang_code not in done_languages)
+            cells.append((index, unit_id))
+
+    @property
+    def num_cells(self) -> int:
+        return sum(len(cells) for cells in self.cells.values())
+
+    def text_index_pairs(self) -> List[Tuple[int, str]]:
+        """
+        The unique units to translate, as (unit id, text) pairs
+        """
+        logger.info(f'Planned {len(self.units)} unique texts for {self.num_cells} cells')
+        return list(enumerate(self.units))
+
+    def unit_kinds(self) -> Dict[int, str]:
+        """
+        The column kind of every unit, 'name' or 'description', for the routing of its translation
+        """
+        return dict(enumerate(self.kinds))
+
+    def unit_languages(self) -> Optional[Dict[int, List[str]]]:
+        """
+        The languages to translate every unit to, in the order of the language codes, None when all the units need all of them
+        """
+        if not self.items_skipped:
+            return None
+        return {unit_id: [lang_code for lang_code in self.language_codes if lang_code in languages]
+                for unit_id, languages in self._unit_languages.items()}
+
+    def _without_done(self, done: Optional[Set[str]], translations: Optional[List[Optional[str]]]) -> Optional[List[Optional[str]]]:
+        if not done or not translations:
+            return translations
+        return [None if lang_code in done else translation for lang_code, translation in zip(self.language_codes, translations)]
+
+    def fan_out(self, results: List[Tuple[int, List[str]]]) -> Dict[Tuple[str, str], List[Tuple[int, List[str]]]]:
+        """
+        Map the results of the units back to every cell, per (sheet, column). The languages up to date of a cell are None.
+        """
+        unit_results = dict(results)
+        return {
+            sheet_column: [(index, self._without_done(self.done[sheet_column].get(index), unit_results.get(unit_id)))
+                           for index, unit_id in cells]
+            for sheet_column, cells in self.cells.items()
+        }
+
+    def failed_cells(self, failed_items: List[Tuple[int, str]]) -> List[dict]:
+        """
+        Map the failed (unit id, language) items back to every cell, for the failure report of the job
+        """
+        failed = defaultdict(list)
+        for unit_id, lang_code in failed_items:
+            failed[unit_id].append(lang_code)
+        return [
+            {'sheet': sheet, 'column': column, 'index': index, 'language': lang_code, 'text': self.units[unit_id]}
+            for (sheet, column), cells in self.cells.items()
+            for index, unit_id in cells
+            for lang_code in failed.get(unit_id, [])
+            if lang_code not in self.done[(sheet, column)].get(index, ())
+        ]
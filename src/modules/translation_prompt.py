@@ -84,3 +84,39 @@ class TextTranslationPrompt(TranslationPrompt):
         {text}
         """
         super().__init__(system_message_str, human_message_str)
+
+
+class PackedTextTranslationPrompt(TranslationPrompt):
+    """
+    Creates a prompt template for the translation of several texts packed in a JSON array.
+    """
+    def __init__(self):
+        system_message_str = """
+        Role: You are an excellent multilingual translator. Translate every text of the given JSON array to language: {language}. Texts might be skill names,
+        skill descriptions, or anything else. Translate each text accurately and completely, not just interpret it. Use clear, professional, fluent, natural and formal language.
+        The input is a JSON array of objects with an "id" and a "text". Each text is independent from the others.
+        Output a JSON array with exactly one object per input object, in the same order, in the format {{"id": <the same id>, "translation": "<the translated text>"}}.
+        Only output the JSON array and nothing else.
+        """
+        human_message_str = """
+        {items}
+        """
+        super().__init__(system_message_str, human_message_str)
+
+
+class MultiLanguageTextTranslationPrompt(TranslationPrompt):
+    """
+    Creates a prompt template for the translation of a text to several languages at once.
+    """
+    def __init__(self):
+        system_message_str = """
+        Role: You are an excellent multilingual translator. Translate the given text to each of these languages: {languages}. Text might be a skill name,
+        a skill description, or anything else. Translate the whole text accurately, not just interpret it. Use clear, professional, fluent, natural and formal language.
+        Output a JSON object with exactly one key per language, using the language codes as given, and the translated text as value,
+        for example {{"fr": "<the French translation>", "de": "<the German translation>"}}.
+        Only output the JSON object and nothing else.
+        """
+        human_message_str = """
+        {text}
+        """
+        super().__init__(system_message_str, human_message_str)
@@ -0,0 +1,245 @@
+"""
+A module to keep the uploaded files on disk, addressed by the hash of their content: uploads are streamed to the store
+chunk by chunk instead of being read in memory, the same file is stored once however often it is submitted, and the
+sheets parsed from a file are kept next to it so that a file submitted again, e.g. estimated then translated, is not parsed again
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import mmap
+import os
+import pickle
+import re
+import shutil
+import tempfile
+import threading
+from collections import Counter
+from typing import Any, BinaryIO, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+DIGEST_PATTERN = re.compile(r'[0-9a-f]{64}')
+# bumped when the format of the parsed artifacts changes, so that the artifacts of older versions are parsed again
+ARTIFACT_VERSION = 2
+
+
+class UploadConfig(BaseModel):
+    dir: str = Field(default='uploads', description='directory of the uploaded files and of their parsed sheets')
+    chunk_size: int = Field(default=1 << 20, description='bytes read at a time when an upload is written to disk')
+    max_bytes: int = Field(default=2 << 30, description='the least recently used uploads are removed beyond this size')
+    cache_parsed: bool = Field(default=True, description='keep the sheets parsed from an upload, for the next job on the same file')
+
+
+class MappedFile(io.RawIOBase):
+    """
+    A read-only file object over a memory map of a file, read by the page cache instead of copied in the process
+    """
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._map.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self._map.seek(offset, whence)
+        return self._map.tell()
+
+    def tell(self) -> int:
+        return self._map.tell()
+
+    def close(self):
+        if not self.closed:
+            self._map.close()
+        super().close()
+
+
+class ArtifactCache:
+    """
+    Values derived from an upload, pickled in a directory of its own. An upload never changes, so neither do they.
+    """
+    def __init__(self, dir: str):
+        self.dir = dir
+
+    def _path(self, key: str) -> str:
+        key_hash = hashlib.sha256(json.dumps([ARTIFACT_VERSION, key]).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.dir, f'{key_hash}.pkl')
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f'Ignoring the unreadable artifact {path}: {e}')
+            return None
+
+    def put(self, key: str, value: Any):
+        os.makedirs(self.dir, exist_ok=True)
+        # written then renamed, so that a concurrent job never reads a partial artifact
+        fd, tmp_path = tempfile.mkstemp(dir=self.dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+
+
+def _dir_size(path: str) -> int:
+    if not os.path.isdir(path):
+        return 0
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+class UploadStore:
+    """
+    The uploads in {dir}/{sha256 of the content}, and their artifacts in {dir}/{sha256}.parsed.
+    An upload is used by the jobs through its hash, so a client can submit a file it uploaded before by its hash only.
+    Beyond max_bytes, the least recently used uploads are removed with their artifacts, except those pinned by the
+    jobs using them: a job pins its upload when it is submitted, by save or acquire, and releases it when it ends.
+    """
+    def __init__(self, config: UploadConfig):
+        self.config = config
+        self._lock = threading.Lock()
+        self._pins = Counter()
+        os.makedirs(config.dir, exist_ok=True)
+
+    async def save(self, file) -> str:
+        """
+        Write an uploaded file, e.g. a FastAPI UploadFile, to the store chunk by chunk and return its hash.
+        A file already in the store is not written again. The disk is written from threads, not from the event loop.
+        The upload is pinned until release is called with its hash.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = await asyncio.to_thread(tempfile.mkstemp, dir=self.config.dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                def write(chunk: bytes):
+                    digest.update(chunk)
+                    f.write(chunk)
+
+                while chunk := await file.read(self.config.chunk_size):
+                    await asyncio.to_thread(write, chunk)
+                    size += len(chunk)
+            file_hash = digest.hexdigest()
+            await asyncio.to_thread(self._store, tmp_path, file_hash, size)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return file_hash
+
+    def _store(self, tmp_path: str, file_hash: str, size: int):
+        """
+        Move the written upload to its place in the store and pin it, then remove the least recently used uploads beyond max_bytes
+        """
+        path = os.path.join(self.config.dir, file_hash)
+        with self._lock:
+            if os.path.exists(path):
+                os.remove(tmp_path)
+                os.utime(path)
+                logger.info(f'Upload {file_hash} already stored')
+            else:
+                os.replace(tmp_path, path)
+                logger.info(f'Stored upload {file_hash}, {size / (1 << 20):.1f} MiB')
+            self._pins[file_hash] += 1
+        self._evict()
+
+    def acquire(self, file_hash: str) -> bool:
+        """
+        Pin the upload with the hash until release is called with it, so that it isn't removed while a job needs it.
+        False if the store doesn't have it.
+        """
+        with self._lock:
+            if self.path(file_hash) is None:
+                return False
+            self._pins[file_hash] += 1
+            return True
+
+    def release(self, file_hash: str):
+        """
+        Unpin the upload pinned by save or acquire
+        """
+        with self._lock:
+            self._pins[file_hash] -= 1
+            if self._pins[file_hash] <= 0:
+                del self._pins[file_hash]
+
+    def path(self, file_hash: str) -> Optional[str]:
+        """
+        Path of the upload with the hash, None if the store doesn't have it. Marks the upload as used.
+        """
+        if not DIGEST_PATTERN.fullmatch(file_hash):
+            return None
+        path = os.path.join(self.config.dir, file_hash)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def open(self, file_hash: str) -> BinaryIO:
+        """
+        Open the upload with the hash for reading, memory mapped where possible. Raises FileNotFoundError if unknown.
+        """
+        path = self.path(file_hash)
+        if path is None:
+            raise FileNotFoundError(f'No upload {file_hash}')
+        try:
+            return MappedFile(path)
+        except (ValueError, OSError):
+            # empty files can't be mapped, nor the files of some network file systems
+            return open(path, 'rb')
+
+    def artifacts(self, file_hash: str) -> Optional[ArtifactCache]:
+        """
+        The artifacts of the upload, None if they are not kept
+        """
+        if not self.config.cache_parsed:
+            return None
+        return ArtifactCache(os.path.join(self.config.dir, f'{file_hash}.parsed'))
+
+    def _evict(self):
+        with self._lock:
+            uploads: List[Tuple[float, int, str]] = []
+            for name in os.listdir(self.config.dir):
+                if not DIGEST_PATTERN.fullmatch(name):
+                    continue
+                path = os.path.join(self.config.dir, name)
+                try:
+                    stat = os.stat(path)
+                    size = stat.st_size + _dir_size(f'{path}.parsed')
+                except FileNotFoundError:
+                    continue
+                uploads.append((stat.st_mtime, size, name))
+            total = sum(size for _, size, _ in uploads)
+            for _, size, name in sorted(uploads):
+                if total <= self.config.max_bytes:
+                    break
+                if name in self._pins:
+                    continue
+                path = os.path.join(self.config.dir, name)
+                try:
+                    # the jobs reading the upload keep their open file
+                    os.remove(path)
+                    shutil.rmtree(f'{path}.parsed', ignore_errors=True)
+                except OSError as e:
+                    logger.warning(f'Could not remove the upload {name}: {e}')
+                    continue
+                total -= size
+                logger.info(f'Removed the least recently used upload {name}')
@@ -0,0 +1,170 @@
+"""
+A module with a durable queue of translation work units in a SQLite file, shared by the API and any number of worker
+processes (src/worker.py), so that the translation of large jobs can be spread over more cores and machines
+"""
+
+from contextlib import contextmanager
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class WorkQueueConfig(BaseModel):
+    path: str = Field(default='work_queue.sqlite', description='SQLite file shared by the API and the workers')
+    lease_seconds: float = Field(default=300.0, description='a unit not reported by its worker in time is handed to another worker')
+    max_attempts: int = Field(default=3, description='units leased more often than this are reported as failed')
+    poll_interval: float = Field(default=0.5, description='seconds between two polls of the queue when there is nothing to do')
+    worker_concurrency: int = Field(default=8, description='units translated at a time by a worker')
+    wal: bool = Field(default=False, description='write-ahead log, faster but only for a queue file used by the processes of a single host')
+    stall_seconds: float = Field(default=600.0, description='a job is failed after this long without results, leased units nor live workers')
+
+
+class WorkUnit(BaseModel):
+    unit_id: int
+    job_id: str
+    kind: str = Field(description="'single', 'multi_language' or 'packed'")
+    item: Any = Field(description='arguments of the unit, see services.run_work_unit')
+    profile: str = Field(default='default', description='routing profile of the unit')
+    attempts: int = 0
+    worker: Optional[str] = Field(default=None, description='worker holding the lease of the unit')
+    result: Any = Field(default=None, description='result of a done unit')
+    error: Optional[str] = Field(default=None, description='error of a failed unit')
+
+
+class WorkQueue:
+    """
+    Units are leased by the workers in the order they were put, and collected by the API once done or failed.
+    A unit whose lease expires, e.g. because its worker died, is leased again, at most max_attempts times.
+    Several processes can use the same file: the leases are taken in write transactions, so a unit goes to a single worker.
+    """
+    def __init__(self, config: WorkQueueConfig):
+        self.config = config
+        self._lock = threading.Lock()
+        # autocommit mode, the transactions are explicit
+        self._conn = sqlite3.connect(config.path, timeout=60, isolation_level=None, check_same_thread=False)
+        # the write-ahead log needs memory shared by all the processes, which a network file system doesn't provide:
+        # the default rollback journal only needs the file locks, the leases being taken in BEGIN IMMEDIATE transactions
+        self._conn.execute(f"PRAGMA journal_mode={'WAL' if config.wal else 'DELETE'}")
+        with self._transaction():
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS units ('
+                'unit_id INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT, kind TEXT, item TEXT, profile TEXT, state TEXT, worker TEXT, '
+                'lease_until REAL, attempts INTEGER DEFAULT 0, result TEXT, error TEXT, updated_at REAL)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS units_state ON units (state, unit_id)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS units_job ON units (job_id, state)')
+            # last poll of every worker, to tell whether any is running
+            self._conn.execute('CREATE TABLE IF NOT EXISTS workers (worker TEXT PRIMARY KEY, seen_at REAL)')
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            # take the write lock of the file up front, so that two workers can't lease the same unit
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def put(self, job_id: str, units: List[Tuple[str, Any, str]]):
+        """
+        Queue the (kind, item, profile) units of a job, leased in this order
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany("INSERT INTO units (job_id, kind, item, profile, state, updated_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+                             [(job_id, kind, json.dumps(item, ensure_ascii=False), profile, now) for kind, item, profile in units])
+
+    def lease(self, worker: str, limit: int = 1) -> List[WorkUnit]:
+        """
+        Lease the next queued units, and the units whose lease expired. Units leased max_attempts times already are failed.
+        The worker is recorded as alive, see live_workers.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO workers VALUES (?, ?)', (worker, now))
+            expired = conn.execute(
+                "UPDATE units SET state = 'failed', error = 'lease expired ' || attempts || ' times', updated_at = ? "
+                "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?", (now, now, self.config.max_attempts)
+            ).rowcount
+            rows = conn.execute(
+                "SELECT unit_id, job_id, kind, item, profile, attempts FROM units "
+                "WHERE state = 'queued' OR (state = 'leased' AND lease_until < ?) ORDER BY unit_id LIMIT ?", (now, limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE units SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, updated_at = ? WHERE unit_id = ?",
+                [(worker, now + self.config.lease_seconds, now, row[0]) for row in rows]
+            )
+        if expired:
+            logger.warning(f'{expired} units failed after {self.config.max_attempts} expired leases')
+        return [WorkUnit(unit_id=unit_id, job_id=job_id, kind=kind, item=json.loads(item), profile=profile, attempts=attempts + 1,
+                         worker=worker)
+                for unit_id, job_id, kind, item, profile, attempts in rows]
+
+    def complete(self, unit: WorkUnit, result: Any):
+        """
+        Store the result of the unit. A worker whose lease expired meanwhile still completes it: its result is as good.
+        """
+        with self._transaction() as conn:
+            conn.execute("UPDATE units SET state = 'done', result = ?, updated_at = ? WHERE unit_id = ? AND state = 'leased'",
+                         (json.dumps(result, ensure_ascii=False), time.time(), unit.unit_id))
+
+    def fail(self, unit: WorkUnit, error: str):
+        """
+        Queue the unit again, or fail it after max_attempts. Ignored if the unit was leased again by another worker.
+        """
+        with self._transaction() as conn:
+            conn.execute("UPDATE units SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, error = ?, updated_at = ? "
+                         "WHERE unit_id = ? AND state = 'leased' AND worker = ?",
+                         (self.config.max_attempts, error, time.time(), unit.unit_id, unit.worker))
+
+    def collect(self, job_id: str, limit: int = 1000) -> List[WorkUnit]:
+        """
+        Remove and return the done and failed units of the job
+        """
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT unit_id, kind, item, profile, attempts, result, error FROM units "
+                "WHERE job_id = ? AND state IN ('done', 'failed') ORDER BY unit_id LIMIT ?", (job_id, limit)
+            ).fetchall()
+            conn.executemany('DELETE FROM units WHERE unit_id = ?', [(row[0],) for row in rows])
+        return [WorkUnit(unit_id=unit_id, job_id=job_id, kind=kind, item=json.loads(item), profile=profile, attempts=attempts,
+                         result=json.loads(result) if result is not None else None, error=error)
+                for unit_id, kind, item, profile, attempts, result, error in rows]
+
+    def cancel(self, job_id: str) -> int:
+        """
+        Remove all the units of the job, e.g. left by an interrupted run of the API
+        """
+        with self._transaction() as conn:
+            return conn.execute('DELETE FROM units WHERE job_id = ?', (job_id,)).rowcount
+
+    def stats(self, job_id: Optional[str] = None) -> Dict[str, int]:
+        """
+        Number of units per state, of the job if given
+        """
+        with self._lock:
+            if job_id is None:
+                return dict(self._conn.execute('SELECT state, COUNT(*) FROM units GROUP BY state').fetchall())
+            return dict(self._conn.execute('SELECT state, COUNT(*) FROM units WHERE job_id = ? GROUP BY state', (job_id,)).fetchall())
+
+    def live_workers(self, within: float) -> int:
+        """
+        Number of workers that polled the queue in the last within seconds
+        """
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM workers WHERE seen_at >= ?', (time.time() - within,)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
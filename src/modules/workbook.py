@@ -0,0 +1,152 @@
+"""
+A module to read the selected sheets of a workbook once per job, and to write the translations back into it
+"""
+
+from collections import defaultdict
+import json
+import threading
+import time
+from typing import TYPE_CHECKING, BinaryIO, Dict, List, Optional, Tuple
+
+import openpyxl
+import pandas as pd
+
+from modules.data_reader import DataReader
+from utils.logger import setup_logger
+
+if TYPE_CHECKING:
+    from modules.upload_store import ArtifactCache
+
+logger = setup_logger(__name__)
+
+
+class Workbook:
+    """
+    An uploaded workbook, parsed a single time for the whole job.
+    The values of the selected sheets are read as Excel last computed them, i.e. the result of a formula rather than
+    its text, and the cells holding a formula are listed in formulas so that they are not translated. The output is
+    produced by patching only the translated cells into the workbook parsed with its formulas, so the formulas, the
+    formatting and the sheets that were not translated are kept as they are.
+    With artifacts, the sheets read from the same file by a previous job are reused, and the workbook itself is only
+    parsed when the output is written: see preload to parse it while the job translates.
+    """
+    def __init__(self, file: BinaryIO, sheet_columns: Dict[str, Optional[List[str]]], artifacts: Optional['ArtifactCache'] = None):
+        """
+        sheet_columns maps the selected sheets to the columns the job needs, or to None to load all of them.
+        file must stay open until the workbook is saved.
+        """
+        self._file = file
+        self._artifacts = artifacts
+        self._workbook = None
+        # the file is read by a single parse at a time
+        self._load_lock = threading.Lock()
+        self._column_indexes: Dict[str, Dict[str, int]] = {}
+        self.sheets: Dict[str, pd.DataFrame] = {}
+        # rows of the cells holding a formula, by column of the selected sheets
+        self.formulas: Dict[str, Dict[str, List[int]]] = {}
+        for name, usecols in sheet_columns.items():
+            column_indexes, df, formulas = self._read_sheet(name, usecols)
+            if df is None:
+                raise KeyError(f'Worksheet {name} does not exist.')
+            self._column_indexes[name] = column_indexes
+            self.sheets[name] = df
+            self.formulas[name] = formulas
+        self._updates: Dict[str, List[pd.DataFrame]] = defaultdict(list)
+
+    def _load(self) -> openpyxl.Workbook:
+        with self._load_lock:
+            if self._workbook is None:
+                start = time.perf_counter()
+                self._workbook = openpyxl.load_workbook(self._file)
+                logger.info(f'Parsed the workbook in {time.perf_counter() - start:.1f}s')
+            return self._workbook
+
+    def preload(self):
+        """
+        Parse the workbook in the background, so that it is ready when the output is written
+        """
+        def load():
+            try:
+                self._load()
+            except Exception as e:
+                # raised again when the workbook is needed
+                logger.warning(f'Could not parse the workbook in the background: {e}')
+
+        if self._workbook is None:
+            threading.Thread(target=load, name='workbook_preload', daemon=True).start()
+
+    def _read_sheet(self, name: str, usecols: Optional[List[str]]) -> Tuple[Optional[Dict[str, int]], Optional[pd.DataFrame], Optional[Dict[str, List[int]]]]:
+        """
+        The column indexes, the usecols columns and their formula cells of a sheet, from the artifacts of the file when
+        they have it. (None, None, None) if the workbook doesn't have the sheet.
+        The sheet is read by two streaming passes over the file: one for the values, one for the formulas.
+        """
+        key = json.dumps(['sheet', name, sorted(set(usecols)) if usecols is not None else None])
+        if self._artifacts is not None:
+            parsed = self._artifacts.get(key)
+            if parsed is not None:
+                return parsed
+        parsed = (None, None, None)
+        with self._load_lock:
+            values = openpyxl.load_workbook(self._file, read_only=True, data_only=True)
+            try:
+                if name in values.sheetnames:
+                    reader = DataReader()
+                    worksheet = values[name]
+                    column_indexes = {column: position + 1 for position, column in enumerate(reader.worksheet_columns(worksheet))}
+                    df = reader.read_worksheet(worksheet, usecols)
+                    formulas = openpyxl.load_workbook(self._file, read_only=True)
+                    try:
+                        parsed = (column_indexes, df, reader.worksheet_formulas(formulas[name], usecols))
+                    finally:
+                        formulas.close()
+            finally:
+                values.close()
+        if self._artifacts is not None:
+            self._artifacts.put(key, parsed)
+        return parsed
+
+    def update(self, sheet_name: str, updated_df: pd.DataFrame):
+        """
+        Queue the translated values of a sheet. updated_df is indexed like the sheet DataFrame, its columns are target
+        columns of the sheet, and its missing values are left unchanged.
+        """
+        self._updates[sheet_name].append(updated_df)
+
+    def read_table(self, sheet_name: str) -> Optional[pd.DataFrame]:
+        """
+        Read a sheet that is not translated, e.g. a hidden sheet of the app, None if the workbook doesn't have it
+        """
+        return self._read_sheet(sheet_name, None)[1]
+
+    def write_table(self, sheet_name: str, columns: List[str], rows: List[list]):
+        """
+        Replace the content of a hidden sheet of the workbook with the rows, under a header of columns
+        """
+        workbook = self._load()
+        if sheet_name in workbook.sheetnames:
+            del workbook[sheet_name]
+        worksheet = workbook.create_sheet(sheet_name)
+        worksheet.sheet_state = 'hidden'
+        worksheet.append(columns)
+        for row in rows:
+            worksheet.append(row)
+
+    def save(self, output_path: str):
+        """
+        Write the workbook with the queued values patched in, to output_path
+        """
+        workbook = self._load()
+        for sheet_name, updated_dfs in self._updates.items():
+            logger.info(f"Processing sheet: {sheet_name}")
+            worksheet = workbook[sheet_name]
+            column_indexes = self._column_indexes[sheet_name]
+            for updated_df in updated_dfs:
+                for column in updated_df.columns:
+                    column_index = column_indexes[column]
+                    for index, value in updated_df[column].items():
+                        if pd.isna(value):
+                            continue
+                        # the header is the first row of the sheet, and openpyxl rows start at 1
+                        worksheet.cell(row=index + 2, column=column_index, value=value)
+        workbook.save(output_path)
@@ -1,68 +1,654 @@
+import asyncio
+from collections import defaultdict, deque
+import queue
 import time
 from tqdm import tqdm
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 
+from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnableSequence
 
 from modules.model_config import ModelConfig
 from modules.openai_chain import OpenAIchain
-from modules.translation_prompt import TextTranslationPrompt
+from modules.packing import (PackingConfig, format_packed_items, pack_texts, parse_multi_language_output,
+                             parse_packed_output)
+from modules.job_journal import JobJournal
+from modules.job_manager import JobProgress
+from modules.http_pool import aclose_async_http_client
+from modules.metrics import LLM_RETRIES, QUEUE_DEPTH, forward_to
+from modules.rate_limiter import RateLimiter, backoff_delay
+from modules.routing import DEFAULT_PROFILE, ModelRouter, RoutingConfig
+from modules.scheduling import JobEstimate, SchedulingConfig, TaskEstimate, TranslationScheduler, token_counter
+from modules.translation_memory import TranslationMemory
+from modules.translation_prompt import MultiLanguageTextTranslationPrompt, PackedTextTranslationPrompt, TextTranslationPrompt
+from modules.work_queue import WorkQueue
 
 from utils.logger import setup_logger
 
 
 logger = setup_logger(__name__)
 
+# chains of the current worker process per routing profile, built once by init_worker: text, packed and multi-language
+_worker_chains: Dict[str, Tuple[RunnableSequence, RunnableSequence, RunnableSequence]] = {}
+_worker_model_configs: Dict[str, ModelConfig] = {}
+
+
+def init_worker(model_config: ModelConfig, rate_limiter: Optional[RateLimiter] = None, metrics_queue=None,
+                profiles: Optional[Dict[str, ModelConfig]] = None):
+    """
+    Pool initializer: build the chains once per worker process and keep them for every row the worker translates.
+    profiles are the model configs of the routing profiles, the worker builds chains for each of them.
+    The rate limiter is shared by all the workers, and their metrics are sent to the API process through metrics_queue.
+    """
+    if metrics_queue is not None:
+        forward_to(metrics_queue)
+    _worker_model_configs.update(profiles or {model_config.profile: model_config})
+    for profile, profile_config in _worker_model_configs.items():
+        _worker_chains[profile] = (
+            OpenAIchain(TextTranslationPrompt().create_prompt(), profile_config, rate_limiter).create_chain(),
+            OpenAIchain(PackedTextTranslationPrompt().create_prompt(), profile_config, rate_limiter).create_chain(),
+            OpenAIchain(MultiLanguageTextTranslationPrompt().create_prompt(), profile_config, rate_limiter).create_chain(),
+        )
+
+
+def _worker_chain(model_config: ModelConfig, position: int, prompt) -> RunnableSequence:
+    """
+    The chain of the worker at position (0: text, 1: packed, 2: multi-language) for the profile of model_config.
+    Only a pool without the initializer creates the chain for every row.
+    """
+    chains = _worker_chains.get(model_config.profile)
+    return chains[position] if chains is not None else OpenAIchain(prompt, model_config).create_chain()
+
             
-def batch_text_translate(chain: RunnableSequence, text: str, language_codes: List[str], retries=3, delay=5) -> List[str]:
+def batch_text_translate(chain: RunnableSequence, text: str, language_codes: List[str], retries=3, delay=5) -> List[Optional[str]]:
+    """
+    Translate the text to the languages. Only the failed languages are retried, with jittered exponential backoff
+    starting around delay seconds. Languages still failing after the retries are None.
+    """
+    translations = {}
+    pending = list(language_codes)
     for attempt in range(retries):
-        try:
-            return chain.batch([{'text': text, 'language': lang_code} for lang_code in language_codes])
-        except Exception as e:
-            logger.warning(f'Attempt {attempt+1} failed with error: {e}')
-            if attempt < retries - 1:
-                time.sleep(delay)
-            else:
-                logger.warning(f'Failed after {retries} attempts. Returning None.')
-                return None
+        results = chain.batch([{'text': text, 'language': lang_code} for lang_code in pending], return_exceptions=True)
+        pending = _collect_attempt(attempt, pending, results, translations)
+        if not pending:
+            break
+        if attempt < retries - 1:
+            LLM_RETRIES.inc(len(pending), reason='error')
+            time.sleep(backoff_delay(attempt, base_delay=delay))
+    if pending:
+        logger.warning(f'Failed after {retries} attempts for languages {pending}.')
+    return [translations.get(lang_code) for lang_code in language_codes]
+
+
+async def abatch_text_translate(chain: RunnableSequence, text: str, language_codes: List[str], semaphore: asyncio.Semaphore,
+                                retries=3, delay=5) -> List[Optional[str]]:
+    """
+    Async version of batch_text_translate. Every language is a separate request, bounded by the shared semaphore.
+    """
+    async def translate_language(lang_code: str) -> str:
+        async with semaphore:
+            return await chain.ainvoke({'text': text, 'language': lang_code})
+
+    translations = {}
+    pending = list(language_codes)
+    for attempt in range(retries):
+        results = await asyncio.gather(*[translate_language(lang_code) for lang_code in pending], return_exceptions=True)
+        pending = _collect_attempt(attempt, pending, results, translations)
+        if not pending:
+            break
+        if attempt < retries - 1:
+            LLM_RETRIES.inc(len(pending), reason='error')
+            await asyncio.sleep(backoff_delay(attempt, base_delay=delay))
+    if pending:
+        logger.warning(f'Failed after {retries} attempts for languages {pending}.')
+    return [translations.get(lang_code) for lang_code in language_codes]
+
+
+def _collect_attempt(attempt: int, language_codes: List[str], results: list, translations: Dict[str, str]) -> List[str]:
+    """
+    Add the successful results of an attempt to translations and return the languages that failed
+    """
+    failed = []
+    for lang_code, result in zip(language_codes, results):
+        if isinstance(result, Exception):
+            logger.warning(f'Attempt {attempt+1} for language {lang_code} failed with error: {result}')
+            failed.append(lang_code)
+        else:
+            translations[lang_code] = result
+    return failed
 
 
 def translate_description(prompt, model_config: ModelConfig, index_text: Tuple[str,str], language_codes: List[str]) -> Tuple[int, List[str]]:
     """
     Translate the text using the OpenAI model
     """
-    # with pool.apply_async I can't pass the chain directly as it is not picklable, so create it in the function which is happening over and over again.
-    # We need to consider other ways to handle this, as creating the chain every time is not efficient.
-    # using manager to share the chain between processes is not possible as the chain is not picklable.
+    # with pool.apply_async I can't pass the chain directly as it is not picklable, so workers started with init_worker
+    # build it once and keep it
     try:
-        chain = OpenAIchain(prompt, model_config).create_chain()
+        chain = _worker_chain(model_config, 0, prompt)
         result = batch_text_translate(chain, index_text[1], language_codes)
         return (index_text[0], result)
     except Exception as e:
         logger.warning(f"Error translating text: {str(e)}")
-        return (index_text[0], ['' for _ in language_codes])
+        return (index_text[0], [None for _ in language_codes])
+
+
+def translate_packed(prompt, packed_prompt, model_config: ModelConfig, group: List[Tuple[int, str]], language: str) -> Tuple[str, Dict[int, str]]:
+    """
+    Translate a group of short texts to a language in a single request.
+    Texts missing from the packed output or with an invalid translation are translated one by one.
+    """
+    chain = _worker_chain(model_config, 0, prompt)
+    packed_chain = _worker_chain(model_config, 1, packed_prompt)
+    translations = {}
+    try:
+        output = packed_chain.invoke({'items': format_packed_items(group), 'language': language})
+        translations = parse_packed_output(output, group)
+    except Exception as e:
+        logger.warning(f"Error translating packed texts: {str(e)}")
+    for index, text in group:
+        if index not in translations:
+            result = batch_text_translate(chain, text, [language])[0]
+            if result is not None:
+                translations[index] = result
+    return (language, translations)
+
+
+async def atranslate_packed(chain: RunnableSequence, packed_chain: RunnableSequence, group: List[Tuple[int, str]], language: str,
+                            semaphore: asyncio.Semaphore) -> Tuple[str, Dict[int, str]]:
+    """
+    Async version of translate_packed
+    """
+    translations = {}
+    try:
+        async with semaphore:
+            output = await packed_chain.ainvoke({'items': format_packed_items(group), 'language': language})
+        translations = parse_packed_output(output, group)
+    except Exception as e:
+        logger.warning(f"Error translating packed texts: {str(e)}")
+    fallback = [(index, text) for index, text in group if index not in translations]
+    results = await asyncio.gather(*[abatch_text_translate(chain, text, [language], semaphore) for _, text in fallback])
+    for (index, _), result in zip(fallback, results):
+        if result[0] is not None:
+            translations[index] = result[0]
+    return (language, translations)
+
+
+def translate_all_languages(prompt, multi_language_prompt, model_config: ModelConfig, index_text: Tuple[int, str],
+                            language_codes: List[str]) -> Tuple[int, List[str]]:
+    """
+    Translate the text to all the languages in a single request.
+    Languages missing from the output or with an invalid translation are translated one by one.
+    """
+    chain = _worker_chain(model_config, 0, prompt)
+    multi_language_chain = _worker_chain(model_config, 2, multi_language_prompt)
+    translations = {}
+    try:
+        output = multi_language_chain.invoke({'text': index_text[1], 'languages': ', '.join(language_codes)})
+        translations = parse_multi_language_output(output, language_codes)
+    except Exception as e:
+        logger.warning(f"Error translating text to all languages: {str(e)}")
+    missing = [lang_code for lang_code in language_codes if lang_code not in translations]
+    if missing:
+        translations.update(zip(missing, batch_text_translate(chain, index_text[1], missing)))
+    return (index_text[0], [translations.get(lang_code) for lang_code in language_codes])
+
+
+async def atranslate_all_languages(chain: RunnableSequence, multi_language_chain: RunnableSequence, text: str, language_codes: List[str],
+                                   semaphore: asyncio.Semaphore) -> List[str]:
+    """
+    Async version of translate_all_languages
+    """
+    translations = {}
+    try:
+        async with semaphore:
+            output = await multi_language_chain.ainvoke({'text': text, 'languages': ', '.join(language_codes)})
+        translations = parse_multi_language_output(output, language_codes)
+    except Exception as e:
+        logger.warning(f"Error translating text to all languages: {str(e)}")
+    missing = [lang_code for lang_code in language_codes if lang_code not in translations]
+    if missing:
+        translations.update(zip(missing, await abatch_text_translate(chain, text, missing, semaphore)))
+    return [translations.get(lang_code) for lang_code in language_codes]
+
+
+class _NestedSemaphore:
+    """
+    Holds the semaphore of a profile, then the semaphore of the job, so that a profile stays under its own limit
+    """
+    def __init__(self, profile: asyncio.Semaphore, job: asyncio.Semaphore):
+        self.profile = profile
+        self.job = job
+
+    async def __aenter__(self):
+        await self.profile.acquire()
+        try:
+            await self.job.acquire()
+        except BaseException:
+            self.profile.release()
+            raise
+
+    async def __aexit__(self, *exc_info):
+        self.job.release()
+        self.profile.release()
+
+
+def run_work_unit(kind: str, item: list, profile: str = DEFAULT_PROFILE) -> list:
+    """
+    Translate a unit of the work queue, in a worker process initialized with init_worker. The result is JSON serializable.
+    """
+    model_config = _worker_model_configs.get(profile)
+    if model_config is None:
+        raise RuntimeError(f'The worker has no chains for the profile {profile!r}, call init_worker with the routing profiles')
+    if kind == 'packed':
+        lang_code, group = item
+        language, translations = translate_packed(None, None, model_config, [tuple(pair) for pair in group], lang_code)
+        return [language, list(translations.items())]
+    index, text, missing = item
+    if kind == 'multi_language':
+        return list(translate_all_languages(None, None, model_config, (index, text), missing))
+    return list(translate_description(None, model_config, (index, text), missing))
 
 
 class TranslationService:
     """
     class to handle the translation of skills
     """
-    def __init__(self, processes: int, model_config: ModelConfig, text_index_pair: List[Tuple[str, str]], language_codes: List[str]):
+    def __init__(self, processes: int, model_config: ModelConfig, text_index_pair: List[Tuple[str, str]], language_codes: List[str],
+                 translation_memory: Optional[TranslationMemory] = None, packing: Optional[PackingConfig] = None,
+                 rate_limiter: Optional[RateLimiter] = None, journal: Optional[JobJournal] = None,
+                 progress: Optional[JobProgress] = None, scheduling: Optional[SchedulingConfig] = None,
+                 router: Optional[ModelRouter] = None, kinds: Optional[Dict[int, str]] = None,
+                 unit_languages: Optional[Dict[int, List[str]]] = None):
         self.model_config = model_config
-        self.texts = text_index_pair
         self.language_codes = language_codes
         self.processes = processes
         self.prompt = TextTranslationPrompt().create_prompt()
+        self.packed_prompt = PackedTextTranslationPrompt().create_prompt()
+        self.multi_language_prompt = MultiLanguageTextTranslationPrompt().create_prompt()
+        self.translation_memory = translation_memory
+        self.packing = packing or PackingConfig()
+        self.rate_limiter = rate_limiter
+        self.journal = journal
+        self.progress = progress or JobProgress()
+        counter = token_counter(model_config.llm_model_name)
+        prompt_tokens = {'text': counter.count(self.prompt.format(text='', language='')),
+                         'packed': counter.count(self.packed_prompt.format(items='', language='')),
+                         'multi_language': counter.count(self.multi_language_prompt.format(text='', languages=''))}
+        self.scheduler = TranslationScheduler(scheduling or SchedulingConfig(), counter, prompt_tokens)
+        # the profile of a text depends on the kind, 'name' or 'description', of its columns
+        self.router = router or ModelRouter(RoutingConfig(), model_config, scheduling)
+        # tasks a job keeps queued in the shared pool, so that concurrent jobs are interleaved instead of run one after the other
+        self.max_in_flight = 4 * processes
+        self.set_texts(text_index_pair, kinds, unit_languages)
+
+    def set_texts(self, text_index_pair: List[Tuple[int, str]], kinds: Optional[Dict[int, str]] = None,
+                  unit_languages: Optional[Dict[int, List[str]]] = None):
+        """
+        Set the texts of the next translation, e.g. the next chunk of a streamed job, keeping the prompts and the token
+        counter of the service. failed_items are then those of the new texts.
+        """
+        self.texts = text_index_pair
+        self.failed_items: List[Tuple[int, str]] = []
+        self.kinds = kinds or {}
+        # the languages of every text with a delta translation, the others are up to date and not translated
+        self.unit_languages = unit_languages or {}
+        # the profile of every text, set by _plan_work: its translations are kept in memory under the model of the profile
+        self.profiles: Dict[int, str] = {}
+
+    def _route(self, index: int, tokens: int) -> str:
+        if not self.router.profiles:
+            return DEFAULT_PROFILE
+        return self.router.route(self.kinds.get(index), tokens)
+
+    def _plan_work(self):
+        """
+        Look up the translation memory and the journal of the job, and split the remaining work in texts translated
+        one by one and groups of short texts packed per profile and language
+        """
+        cached = {}
+        translated = defaultdict(dict)
+        singles = []
+        packable = defaultdict(list)
+        pending = {}
+        # counted by the tokenizer of the model, like the scheduler and the estimate
+        text_tokens: Dict[str, int] = {}
+        for index, text in self.texts:
+            language_codes = self.unit_languages.get(index, self.language_codes)
+            tokens = text_tokens[text] = self.scheduler.counter.count(text)
+            profile = self.profiles[index] = self._route(index, tokens)
+            cached[index] = (self.translation_memory.lookup(text, language_codes, self.router.model_config(profile))
+                             if self.translation_memory is not None else {})
+            missing = [lang_code for lang_code in language_codes if lang_code not in cached[index]]
+            if self.journal is not None:
+                translated[index].update(self.journal.lookup(index, missing))
+                missing = [lang_code for lang_code in missing if lang_code not in translated[index]]
+            pending[index] = len(missing)
+            if not missing:
+                continue
+            if self.packing.enabled and tokens <= self.packing.max_text_tokens:
+                for lang_code in missing:
+                    packable[(profile, lang_code)].append((index, text))
+            else:
+                singles.append((profile, (index, text, missing)))
+        groups = [(profile, (lang_code, group)) for (profile, lang_code), items in packable.items()
+                  for group in pack_texts(items, self.packing.max_batch_tokens, self.packing.max_batch_items, text_tokens.__getitem__)]
+        logger.info(f"{len(singles)} texts translated one by one, {len(groups)} packed requests.")
+        self.progress.plan(pending)
+        return cached, translated, singles, groups
+
+    def _schedule(self, singles: list, groups: list) -> List[Tuple[tuple, TaskEstimate]]:
+        """
+        The tasks of the job with their estimated tokens
+        """
+        tasks = [(('single', item, profile), self.scheduler.estimate_single(item[1], len(item[2]), self._use_multi_language(item[2])))
+                 for profile, item in singles]
+        tasks += [(('packed', item, profile), self.scheduler.estimate_packed([text for _, text in item[1]])) for profile, item in groups]
+        return tasks
+
+    def _estimate(self, tasks: List[Tuple[tuple, TaskEstimate]], concurrency: int) -> JobEstimate:
+        """
+        Estimate the whole job, and with routing the texts of each profile with its costs and concurrency limit.
+        The cost of the job is then the sum of the costs of the profiles.
+        """
+        rate_limit = self.rate_limiter.config if self.rate_limiter is not None else None
+        estimate = self.scheduler.estimate([estimate for _, estimate in tasks], concurrency, rate_limit)
+        if not self.router.profiles:
+            return estimate
+        profiles = {}
+        for profile in self.router.names:
+            estimates = [estimate for task, estimate in tasks if task[2] == profile]
+            if not estimates:
+                continue
+            model_config = self.router.model_config(profile)
+            profiles[profile] = self.scheduler.estimate(estimates, self.router.concurrency(profile, concurrency), rate_limit,
+                                                        (model_config.input_cost_per_million, model_config.output_cost_per_million))
+        return estimate.model_copy(update={'cost': round(sum(p.cost for p in profiles.values()), 4), 'profiles': profiles})
+
+    def estimate(self, concurrency: int) -> JobEstimate:
+        """
+        Estimate the requests, tokens, cost and duration of the translation, without translating
+        """
+        _, _, singles, groups = self._plan_work()
+        return self._estimate(self._schedule(singles, groups), concurrency)
+
+    def _prepare(self, concurrency: int):
+        """
+        Plan the work, estimate it and enforce the token budget before the first request, and order the tasks
+        """
+        cached, translated, singles, groups = self._plan_work()
+        tasks = self._schedule(singles, groups)
+        estimate = self._estimate(tasks, concurrency)
+        logger.info(f"Estimated {estimate.requests} requests, {estimate.total_tokens} tokens, "
+                    f"${estimate.cost:.2f} and {estimate.duration_seconds:.0f}s.")
+        # a job translated in chunks is checked against the budget with the estimate of all its chunks so far
+        self.scheduler.check_budget(self.progress.add_estimate(estimate))
+        return cached, translated, self.scheduler.schedule(tasks)
+
+    def _add_translations(self, translated: Dict[int, Dict[str, str]], index: int, translations):
+        """
+        Add the (language code, translation) pairs of a text to translated and to the journal. Failed translations are None.
+        """
+        for lang_code, translation in translations:
+            if translation is None:
+                continue
+            translated[index][lang_code] = translation
+            self.progress.translated(index, lang_code)
+            if self.journal is not None:
+                self.journal.record(index, lang_code, translation)
+
+    def _use_multi_language(self, missing: List[str]) -> bool:
+        return self.packing.multi_language and len(missing) > 1
+
+    def _collect_results(self, cached: Dict[int, Dict[str, str]], translated: Dict[int, Dict[str, str]]) -> List[Tuple[int, List[str]]]:
+        """
+        Merge the translations from memory with the new ones, in the order of self.language_codes, and store the new ones.
+        Items that failed are None, and are listed in self.failed_items. The languages a text doesn't need are None too.
+        """
+        results = []
+        for index, text in self.texts:
+            new = translated.get(index, {})
+            if new and self.translation_memory is not None:
+                self.translation_memory.store(text, list(new.items()), self.router.model_config(self.profiles[index]))
+            language_codes = self.unit_languages.get(index, self.language_codes)
+            row = [cached[index].get(lang_code, new.get(lang_code)) if lang_code in language_codes else None
+                   for lang_code in self.language_codes]
+            for lang_code, translation in zip(self.language_codes, row):
+                if translation is None and lang_code in language_codes:
+                    self.failed_items.append((index, lang_code))
+                    self.progress.failed(index, lang_code)
+                    if self.journal is not None:
+                        self.journal.record_failure(index, lang_code)
+            results.append((index, row))
+        if self.translation_memory is not None:
+            logger.info(f"Translation memory: {self.translation_memory.stats()}")
+        if self.failed_items:
+            logger.warning(f"{len(self.failed_items)} items failed to translate.")
+        return results
+
+    def _add_result(self, translated: Dict[int, Dict[str, str]], task, result):
+        """
+        Add the result of a task of the pool or of a unit of the work queue to translated
+        """
+        kind, item = task[:2]
+        if kind == 'packed':
+            lang_code, translations = result
+            for index, translation in dict(translations).items():
+                self._add_translations(translated, index, [(lang_code, translation)])
+        else:
+            index, _, missing = item
+            self._add_translations(translated, index, zip(missing, result[1]))
+
+    def batch_calls(self) -> List[Tuple[tuple, ChatPromptTemplate, dict]]:
+        """
+        Plan the work as the requests of an offline batch, as (task, prompt, prompt inputs) triples. Every task is a
+        single request: there is no fallback for the items missing from a packed or multi-language output, they fail.
+        """
+        _, _, singles, groups = self._plan_work()
+        calls = []
+        for profile, (index, text, missing) in singles:
+            if self._use_multi_language(missing):
+                calls.append((('multi_language', (index, text, missing), profile), self.multi_language_prompt,
+                              {'text': text, 'languages': ', '.join(missing)}))
+            else:
+                calls.extend((('single', (index, text, [lang_code]), profile), self.prompt, {'text': text, 'language': lang_code})
+                             for lang_code in missing)
+        for profile, (lang_code, group) in groups:
+            calls.append((('packed', (lang_code, group), profile), self.packed_prompt,
+                          {'items': format_packed_items(group), 'language': lang_code}))
+        return calls
+
+    def ingest_batch(self, tasks: List[tuple], outputs: List[Optional[str]]) -> List[Tuple[int, List[str]]]:
+        """
+        Merge the outputs of the requests of a batch, None for a failed request, with the translations from memory.
+        tasks are those of batch_calls when the batch was compiled.
+        """
+        cached, translated, _, _ = self._plan_work()
+        for task, output in zip(tasks, outputs):
+            if output is None:
+                continue
+            kind, item = task[:2]
+            if kind == 'packed':
+                lang_code, group = item
+                result = (lang_code, parse_packed_output(output, [tuple(pair) for pair in group]))
+            elif kind == 'multi_language':
+                translations = parse_multi_language_output(output, item[2])
+                result = (item[0], [translations.get(lang_code) for lang_code in item[2]])
+            else:
+                result = (item[0], [output.strip() or None])
+            self._add_result(translated, task, result)
+        return self._collect_results(cached, translated)
+
+    def _submit(self, pool, task, done: queue.SimpleQueue):
+        """
+        Queue the task in the pool. Its result, or its error, is put in done with the task when it completes.
+        """
+        kind, item, profile = task
+        model_config = self.router.model_config(profile)
+        if kind == 'packed':
+            lang_code, group = item
+            func, args = translate_packed, (self.prompt, self.packed_prompt, model_config, group, lang_code)
+        else:
+            index, text, missing = item
+            if self._use_multi_language(missing):
+                func, args = translate_all_languages, (self.prompt, self.multi_language_prompt, model_config, (index, text), missing)
+            else:
+                func, args = translate_description, (self.prompt, model_config, (index, text), missing)
+        pool.apply_async(func, args, callback=lambda result: done.put((task, result)),
+                         error_callback=lambda error: done.put((task, error)))
 
     def translate_apply_sync(self, pool) -> List[Tuple[int, List[str]]]:
         """
-        Translate the skills synchronously using multiprocessing
+        Translate the skills synchronously using multiprocessing.
+        Translations found in the translation memory are not sent to the model.
+        At most max_in_flight tasks of the job are queued in the pool at a time, they are dispatched in the order of
+        the scheduler and collected as they complete.
         """
         logger.info(f"Translating {len(self.texts)} skills with {self.processes} processes.")
+        cached, translated, tasks = self._prepare(self.processes)
+        tasks_iter = iter(tasks)
+        done = queue.SimpleQueue()
+        in_flight = defaultdict(int)
+        # tasks of the profiles at their concurrency limit, dispatched before the next tasks of the schedule
+        deferred = defaultdict(deque)
+
+        def next_task():
+            for profile, waiting in deferred.items():
+                if waiting and in_flight[profile] < self.router.concurrency(profile, self.max_in_flight):
+                    return waiting.popleft()
+            for task in tasks_iter:
+                if in_flight[task[2]] < self.router.concurrency(task[2], self.max_in_flight):
+                    return task
+                deferred[task[2]].append(task)
+            return None
+
+        def submit_next():
+            while sum(in_flight.values()) < self.max_in_flight:
+                task = next_task()
+                if task is None:
+                    break
+                self._submit(pool, task, done)
+                in_flight[task[2]] += 1
+
+        submit_next()
+        QUEUE_DEPTH.inc(len(tasks))
+        with tqdm(total=len(tasks)) as progress_bar:
+            while sum(in_flight.values()):
+                task, result = done.get()
+                in_flight[task[2]] -= 1
+                if isinstance(result, Exception):
+                    logger.error(f"Error retrieving results: {result}")
+                    self.progress.error(str(result))
+                else:
+                    self._add_result(translated, task, result)
+                submit_next()
+                QUEUE_DEPTH.dec()
+                progress_bar.update()
+        return self._collect_results(cached, translated)
+
+    def translate_queue(self, work_queue: WorkQueue, job_id: str, concurrency: int, idle_warning: float = 60) -> List[Tuple[int, List[str]]]:
+        """
+        Translate the skills with the worker processes of the work queue (src/worker.py), which can run on other machines.
+        The units are put on the queue in the order of the scheduler, and their results collected as the workers complete them.
+        concurrency is the expected number of units translated at a time by all the workers, for the estimate.
+        Raises RuntimeError when no result comes for stall_seconds of the queue config, while no unit of the job is leased
+        and no worker polls the queue.
+        """
+        logger.info(f"Translating {len(self.texts)} skills with the workers of the queue {work_queue.config.path}.")
+        cached, translated, tasks = self._prepare(concurrency)
+        dropped = work_queue.cancel(job_id)
+        if dropped:
+            logger.info(f"Dropped {dropped} units left in the queue by a previous run of the job.")
+        units = [('multi_language' if kind != 'packed' and self._use_multi_language(item[2]) else kind, item, profile)
+                 for kind, item, profile in tasks]
+        work_queue.put(job_id, units)
+        QUEUE_DEPTH.inc(len(units))
+        remaining = len(units)
+        last_result = time.monotonic()
+        next_warning = idle_warning
         try:
-            jobs = [pool.apply_async(translate_description, (self.prompt, self.model_config, index_text, self.language_codes))
-                        for index_text in self.texts]
-            results = [res.get() for res in tqdm(jobs)]
-        except Exception as e:
-            logger.error(f"Error retrieving results: {e}")
-        return results
+            with tqdm(total=len(units)) as progress_bar:
+                while remaining:
+                    collected = work_queue.collect(job_id)
+                    if not collected:
+                        idle = time.monotonic() - last_result
+                        if idle > work_queue.config.stall_seconds and not work_queue.stats(job_id).get('leased') \
+                                and not work_queue.live_workers(work_queue.config.stall_seconds):
+                            raise RuntimeError(f"No worker polled the queue {work_queue.config.path} for "
+                                               f"{work_queue.config.stall_seconds:.0f}s, {remaining} units left. "
+                                               f"Start one with: python src/worker.py")
+                        if idle > next_warning:
+                            logger.warning(f"No result from the workers for {idle:.0f}s, {remaining} units left. "
+                                           f"Are workers running? Start one with: python src/worker.py")
+                            next_warning += idle_warning
+                        time.sleep(work_queue.config.poll_interval)
+                        continue
+                    last_result = time.monotonic()
+                    next_warning = idle_warning
+                    for unit in collected:
+                        if unit.error is not None:
+                            logger.error(f"Unit {unit.unit_id} failed after {unit.attempts} attempts: {unit.error}")
+                            self.progress.error(unit.error)
+                        else:
+                            self._add_result(translated, ('packed' if unit.kind == 'packed' else 'single', unit.item, unit.profile), unit.result)
+                    remaining -= len(collected)
+                    QUEUE_DEPTH.dec(len(collected))
+                    progress_bar.update(len(collected))
+        finally:
+            if remaining:
+                # the job failed, its units are not translated for nothing
+                QUEUE_DEPTH.dec(remaining)
+                work_queue.cancel(job_id)
+        return self._collect_results(cached, translated)
+
+    async def translate_async(self, max_concurrency: int) -> List[Tuple[int, List[str]]]:
+        """
+        Translate the skills with asyncio, using a single chain for the whole job and at most max_concurrency requests in flight
+        """
+        logger.info(f"Translating {len(self.texts)} skills with at most {max_concurrency} concurrent requests.")
+        semaphore = asyncio.Semaphore(max_concurrency)
+        cached, translated, scheduled = self._prepare(max_concurrency)
+        # the chains and the concurrency limit of every profile of the job
+        chains = {}
+        semaphores = {}
+        for profile in {task[2] for task in scheduled}:
+            model_config = self.router.model_config(profile)
+            chains[profile] = (OpenAIchain(self.prompt, model_config, self.rate_limiter).create_chain(),
+                               OpenAIchain(self.packed_prompt, model_config, self.rate_limiter).create_chain(),
+                               OpenAIchain(self.multi_language_prompt, model_config, self.rate_limiter).create_chain())
+            limit = self.router.concurrency(profile, max_concurrency)
+            semaphores[profile] = semaphore if limit >= max_concurrency else _NestedSemaphore(asyncio.Semaphore(limit), semaphore)
+
+        async def translate_text(profile: str, index: int, text: str, missing: List[str]):
+            chain, _, multi_language_chain = chains[profile]
+            try:
+                if self._use_multi_language(missing):
+                    result = await atranslate_all_languages(chain, multi_language_chain, text, missing, semaphores[profile])
+                else:
+                    result = await abatch_text_translate(chain, text, missing, semaphores[profile])
+            except Exception as e:
+                logger.warning(f"Error translating text: {str(e)}")
+                self.progress.error(str(e))
+                result = [None for _ in missing]
+            self._add_translations(translated, index, zip(missing, result))
+
+        async def translate_group(profile: str, lang_code: str, group: List[Tuple[int, str]]):
+            chain, packed_chain, _ = chains[profile]
+            _, translations = await atranslate_packed(chain, packed_chain, group, lang_code, semaphores[profile])
+            for index, translation in translations.items():
+                self._add_translations(translated, index, [(lang_code, translation)])
+
+        # tasks are started in the order of the scheduler, and wait for the semaphore in that order
+        tasks = [asyncio.ensure_future(translate_group(profile, *item) if kind == 'packed' else translate_text(profile, *item))
+                 for kind, item, profile in scheduled]
+        QUEUE_DEPTH.inc(len(tasks))
+        try:
+            with tqdm(total=len(tasks)) as progress_bar:
+                for task in asyncio.as_completed(tasks):
+                    await task
+                    QUEUE_DEPTH.dec()
+                    progress_bar.update()
+        finally:
+            # the connections of the job belong to its event loop
+            await aclose_async_http_client()
+        return self._collect_results(cached, translated)
@@ -0,0 +1,84 @@
+"""
+Worker of the work queue: translates the units put on the queue by the API when parallel_processing.mode is 'queue'.
+Start as many workers as needed, on this machine or on others sharing the queue file, from the directory of params.yaml:
+
+    python src/worker.py
+    python src/worker.py --concurrency 16 --queue /mnt/shared/work_queue.sqlite
+"""
+
+import argparse
+import os
+import signal
+import socket
+import threading
+import uuid
+
+from modules.job_setup import load_config, make_router
+from modules.rate_limiter import RateLimitConfig, SharedRateLimiter
+from modules.work_queue import WorkQueue, WorkQueueConfig
+from services import init_worker, run_work_unit
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def work(work_queue: WorkQueue, worker: str, stop: threading.Event):
+    """
+    Lease and translate units until stop is set. The unit in progress is completed before stopping.
+    """
+    while not stop.is_set():
+        units = work_queue.lease(worker)
+        if not units:
+            stop.wait(work_queue.config.poll_interval)
+            continue
+        for unit in units:
+            try:
+                result = run_work_unit(unit.kind, unit.item, unit.profile)
+            except Exception as e:
+                logger.warning(f'Unit {unit.unit_id} of job {unit.job_id} failed: {e}')
+                work_queue.fail(unit, str(e))
+                continue
+            work_queue.complete(unit, result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, help='units translated at a time, defaults to work_queue.worker_concurrency of params.yaml')
+    parser.add_argument('--queue', help='SQLite file of the queue, defaults to work_queue.path of params.yaml')
+    args = parser.parse_args()
+
+    params, model_config = load_config()
+    config = WorkQueueConfig(**params.get('work_queue', {}))
+    if args.queue:
+        config.path = args.queue
+    concurrency = args.concurrency or config.worker_concurrency
+    # the budgets of the rate limiter are shared by all the workers of the queue, through the queue file
+    rate_limit_config = RateLimitConfig(**params.get('rate_limit', {}))
+    rate_limiter = SharedRateLimiter(rate_limit_config, config.path, config.lease_seconds) if rate_limit_config.enabled else None
+    init_worker(model_config, rate_limiter, profiles=make_router(params, model_config).model_configs())
+
+    work_queue = WorkQueue(config)
+    worker = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        logger.info('Stopping after the units in progress...')
+        stop.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    logger.info(f'Worker {worker} translating {concurrency} units at a time from {config.path}')
+    threads = [threading.Thread(target=work, args=(work_queue, worker, stop), name=f'work_{i}') for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    work_queue.close()
+    if rate_limiter is not None:
+        rate_limiter.close()
+    logger.info(f'Worker {worker} stopped')
+
+
+if __name__ == '__main__':
+    main()
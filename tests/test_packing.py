@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
+
+from modules.fake_model import FakeChatModel
+from modules.model_config import FakeModelConfig
+from modules.packing import pack_texts, parse_multi_language_output, parse_packed_output
+from modules.translation_prompt import TextTranslationPrompt
+from services import atranslate_all_languages, atranslate_packed
+
+GROUP = [(3, 'Team work'), (7, 'Leadership'), (9, 'Planning')]
+
+
+def text_chain():
+    model = FakeChatModel(config=FakeModelConfig(latency_median=0, latency_sigma=0))
+    return TextTranslationPrompt().create_prompt() | model | StrOutputParser()
+
+
+def test_pack_texts_keeps_the_groups_within_the_budgets():
+    texts = [(index, 'word ' * 10) for index in range(7)]
+
+    groups = pack_texts(texts, max_batch_tokens=25, max_batch_items=2, count_tokens=lambda text: len(text.split()))
+
+    assert [[index for index, _ in group] for group in groups] == [[0, 1], [2, 3], [4, 5], [6]]
+
+
+def test_parse_packed_output_keeps_the_valid_items_only():
+    output = '```json\n' + json.dumps([
+        {'id': 3, 'translation': 'Travail'},
+        {'id': 7, 'translation': '  '},
+        {'id': 42, 'translation': 'Inconnu'},
+        {'id': 3, 'translation': 'Doublon'},
+    ]) + '\n```'
+
+    assert parse_packed_output(output, GROUP) == {3: 'Travail'}
+    assert parse_packed_output('not json', GROUP) == {}
+
+
+def test_parse_multi_language_output_keeps_the_requested_languages_only():
+    output = json.dumps({'fr': 'Travail', 'de': '', 'es': 'Trabajo', 'it': 3})
+
+    assert parse_multi_language_output(output, ['fr', 'de', 'it']) == {'fr': 'Travail'}
+    assert parse_multi_language_output('[]', ['fr']) == {}
+
+
+def test_packed_translation_falls_back_to_single_texts():
+    packed_chain = RunnableLambda(lambda inputs: json.dumps([{'id': 3, 'translation': 'Travail'}]))
+
+    language, translations = asyncio.run(atranslate_packed(text_chain(), packed_chain, GROUP, 'fr', asyncio.Semaphore(4)))
+
+    assert language == 'fr'
+    assert translations == {3: 'Travail', 7: '[fr] Leadership', 9: '[fr] Planning'}
+
+
+def test_multi_language_translation_falls_back_to_single_languages():
+    multi_language_chain = RunnableLambda(lambda inputs: '{"fr": "Travail", "de": ')
+
+    translations = asyncio.run(atranslate_all_languages(text_chain(), multi_language_chain, 'Team work', ['fr', 'de'],
+                                                        asyncio.Semaphore(4)))
+
+    assert translations == ['[fr] Team work', '[de] Team work']
@@ -0,0 +1,60 @@
+from io import BytesIO
+
+import openpyxl
+
+from modules.job_setup import assemble, read_plan
+from modules.source_hashes import SOURCE_HASH_SHEET
+
+SHEET = 'Skills'
+SOURCE = 'name (to translate)'
+LANGUAGES = ['fr', 'de']
+PAIRS = [{'sheet': SHEET, 'columns': [SOURCE]}]
+
+
+def make_workbook() -> BytesIO:
+    workbook = openpyxl.Workbook()
+    worksheet = workbook.active
+    worksheet.title = SHEET
+    worksheet.append([SOURCE, 'fr name', 'de name'])
+    for text in ['Team work', 'Leadership', 'Planning']:
+        worksheet.append([text, None, None])
+    file = BytesIO()
+    workbook.save(file)
+    file.seek(0)
+    return file
+
+
+def translate(file, output_path) -> list:
+    """
+    Run a delta translation of the file to output_path, and return the units it planned
+    """
+    workbook, plan = read_plan(file, PAIRS, LANGUAGES, delta=True)
+    unit_results = [(unit_id, [f'[{lang_code}] {text}' for lang_code in LANGUAGES]) for unit_id, text in plan.text_index_pairs()]
+    assemble(workbook, plan, LANGUAGES, unit_results)
+    workbook.save(str(output_path))
+    return plan.units
+
+
+def test_only_the_changed_sources_and_the_missing_targets_are_translated_again(tmp_path):
+    output_path = tmp_path / 'output.xlsx'
+    assert translate(make_workbook(), output_path) == ['Team work', 'Leadership', 'Planning']
+    assert SOURCE_HASH_SHEET in openpyxl.load_workbook(output_path).sheetnames
+
+    # nothing changed since the translation
+    with open(output_path, 'rb') as f:
+        _, plan = read_plan(f, PAIRS, LANGUAGES, delta=True)
+    assert plan.units == []
+    assert plan.items_skipped == 6
+
+    workbook = openpyxl.load_workbook(output_path)
+    worksheet = workbook[SHEET]
+    worksheet['A2'] = 'Teamwork'
+    worksheet['C3'] = None
+    # a whitespace-only edit doesn't change the source
+    worksheet['A4'] = ' Planning '
+    workbook.save(output_path)
+
+    with open(output_path, 'rb') as f:
+        _, plan = read_plan(f, PAIRS, LANGUAGES, delta=True)
+    assert plan.units == ['Teamwork', 'Leadership']
+    assert plan.unit_languages() == {0: ['fr', 'de'], 1: ['de']}
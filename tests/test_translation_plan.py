@@ -0,0 +1,44 @@
+import pandas as pd
+
+from modules.translation_plan import TranslationPlan
+
+
+def test_identical_texts_are_planned_once():
+    plan = TranslationPlan(['fr', 'de'])
+    plan.add_column('Skills', 'name (to translate)', pd.Series(['Team work', 'Leadership', 'Team  work ', None, '  ']))
+    plan.add_column('Other', 'description (to translate)', pd.Series(['Leadership', 'Planning']))
+
+    # whitespace-only differences are the same text, empty cells are left out
+    assert plan.units == ['Team work', 'Leadership', 'Planning']
+    assert plan.num_cells == 5
+    # a text found in a description column is routed as a description
+    assert plan.unit_kinds() == {0: 'name', 1: 'description', 2: 'description'}
+    assert plan.text_index_pairs() == [(0, 'Team work'), (1, 'Leadership'), (2, 'Planning')]
+
+
+def test_fan_out_maps_the_unit_results_to_every_cell():
+    plan = TranslationPlan(['fr', 'de'])
+    plan.add_column('Skills', 'name (to translate)', pd.Series(['Team work', 'Leadership', 'Team work']))
+    plan.add_column('Other', 'name (to translate)', pd.Series(['Leadership']))
+
+    cell_results = plan.fan_out([(0, ['Travail', 'Teamarbeit']), (1, ['Direction', None])])
+
+    assert cell_results[('Skills', 'name (to translate)')] == [
+        (0, ['Travail', 'Teamarbeit']), (1, ['Direction', None]), (2, ['Travail', 'Teamarbeit'])]
+    assert cell_results[('Other', 'name (to translate)')] == [(0, ['Direction', None])]
+    assert plan.failed_cells([(1, 'de')]) == [
+        {'sheet': 'Skills', 'column': 'name (to translate)', 'index': 1, 'language': 'de', 'text': 'Leadership'},
+        {'sheet': 'Other', 'column': 'name (to translate)', 'index': 0, 'language': 'de', 'text': 'Leadership'}]
+
+
+def test_up_to_date_languages_are_left_out():
+    plan = TranslationPlan(['fr', 'de'])
+    plan.add_column('Skills', 'name (to translate)', pd.Series(['Team work', 'Leadership', 'Team work']),
+                    done={0: {'fr'}, 1: {'fr', 'de'}})
+
+    # the row up to date in every language is not planned
+    assert plan.units == ['Team work']
+    assert plan.items_skipped == 3
+    assert plan.unit_languages() == {0: ['fr', 'de']}
+    assert plan.fan_out([(0, ['Travail', 'Teamarbeit'])])[('Skills', 'name (to translate)')] == [
+        (0, [None, 'Teamarbeit']), (2, ['Travail', 'Teamarbeit'])]
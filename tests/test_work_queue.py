@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+from modules.work_queue import WorkQueue, WorkQueueConfig
+
+
+@pytest.fixture
+def make_queue(tmp_path):
+    queues = []
+
+    def make(**config) -> WorkQueue:
+        queue = WorkQueue(WorkQueueConfig(path=str(tmp_path / 'work_queue.sqlite'), **config))
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue.close()
+
+
+def test_units_are_leased_in_order_and_collected_once_done(make_queue):
+    queue = make_queue()
+    queue.put('job', [('single', [index, 'text', 'fr'], 'default') for index in range(3)])
+
+    units = queue.lease('worker', limit=2)
+    assert [unit.item[0] for unit in units] == [0, 1]
+    assert all(unit.worker == 'worker' and unit.attempts == 1 for unit in units)
+    assert queue.stats('job') == {'leased': 2, 'queued': 1}
+    assert queue.stats('other') == {}
+
+    queue.complete(units[0], {'translation': 'texte'})
+    collected = queue.collect('job')
+    assert [(unit.item[0], unit.result) for unit in collected] == [(0, {'translation': 'texte'})]
+    # collected units are removed
+    assert queue.collect('job') == []
+    assert queue.stats('job') == {'leased': 1, 'queued': 1}
+
+
+def test_failed_units_are_queued_again_until_max_attempts(make_queue):
+    queue = make_queue(max_attempts=2)
+    queue.put('job', [('single', [0, 'text', 'fr'], 'default')])
+
+    [unit] = queue.lease('worker')
+    queue.fail(unit, 'timeout')
+    assert queue.stats('job') == {'queued': 1}
+
+    [unit] = queue.lease('worker')
+    assert unit.attempts == 2
+    queue.fail(unit, 'timeout')
+    [failed] = queue.collect('job')
+    assert failed.error == 'timeout'
+    assert failed.result is None
+
+
+def test_expired_leases_go_to_another_worker(make_queue):
+    queue = make_queue(lease_seconds=0.05, max_attempts=2)
+    queue.put('job', [('single', [0, 'text', 'fr'], 'default')])
+
+    [unit] = queue.lease('dead worker')
+    assert queue.lease('worker') == []
+    time.sleep(0.1)
+    [leased_again] = queue.lease('worker')
+    assert leased_again.unit_id == unit.unit_id
+    assert leased_again.worker == 'worker'
+
+    # the worker whose lease expired can't requeue the unit of another worker
+    queue.fail(unit, 'late')
+    assert queue.stats('job') == {'leased': 1}
+
+    time.sleep(0.1)
+    # expired max_attempts times
+    assert queue.lease('worker') == []
+    [failed] = queue.collect('job')
+    assert failed.error == 'lease expired 2 times'
+
+
+def test_workers_are_live_while_they_poll(make_queue):
+    queue = make_queue()
+    assert queue.live_workers(within=60) == 0
+
+    queue.lease('worker 1')
+    # the queue file is shared with the other processes
+    make_queue().lease('worker 2')
+    assert queue.live_workers(within=60) == 2
+    time.sleep(0.1)
+    assert queue.live_workers(within=0.05) == 0
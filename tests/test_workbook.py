@@ -0,0 +1,67 @@
+from io import BytesIO
+
+import openpyxl
+import pandas as pd
+from openpyxl.styles import Font
+
+from modules.job_setup import read_plan
+from modules.workbook import Workbook
+
+SHEET = 'Skills'
+SOURCE = 'name (to translate)'
+
+
+def make_workbook() -> BytesIO:
+    workbook = openpyxl.Workbook()
+    worksheet = workbook.active
+    worksheet.title = SHEET
+    worksheet.append([SOURCE, 'fr name'])
+    worksheet.append(['hello', None])
+    worksheet.append(['=A2&" world"', None])
+    worksheet.append(['goodbye', 'au revoir'])
+    worksheet['A2'].font = Font(bold=True)
+    worksheet['B2'].number_format = '@'
+    file = BytesIO()
+    workbook.save(file)
+    file.seek(0)
+    return file
+
+
+def test_formula_cells_are_not_translated():
+    workbook, plan = read_plan(make_workbook(), [{'sheet': SHEET, 'columns': [SOURCE]}], ['fr'])
+
+    assert workbook.formulas[SHEET] == {SOURCE: [1]}
+    # the formula text is not read as a value
+    assert pd.isna(workbook.sheets[SHEET][SOURCE][1])
+    assert plan.units == ['hello', 'goodbye']
+
+
+def test_save_patches_the_translated_cells_only(tmp_path):
+    workbook = Workbook(make_workbook(), {SHEET: [SOURCE, 'fr name']})
+    workbook.update(SHEET, pd.DataFrame({'fr name': ['bonjour', None, None]}, dtype=object))
+    output_path = tmp_path / 'output.xlsx'
+    workbook.save(str(output_path))
+
+    worksheet = openpyxl.load_workbook(output_path)[SHEET]
+    assert worksheet['B2'].value == 'bonjour'
+    assert worksheet['B2'].number_format == '@'
+    assert worksheet['A2'].font.bold
+    assert worksheet['A3'].value == '=A2&" world"'
+    assert worksheet['B3'].value is None
+    assert worksheet['B4'].value == 'au revoir'
+
+
+def test_save_applies_every_queued_update(tmp_path):
+    workbook = Workbook(make_workbook(), {SHEET: [SOURCE, 'fr name']})
+    workbook.update(SHEET, pd.DataFrame({'fr name': ['bonjour', None, None]}, dtype=object))
+    workbook.update(SHEET, pd.DataFrame({'fr name': [None, None, 'adieu']}, dtype=object))
+    workbook.write_table('_hidden', ['key', 'value'], [['a', 1]])
+    output_path = tmp_path / 'output.xlsx'
+    workbook.save(str(output_path))
+
+    saved = openpyxl.load_workbook(output_path)
+    assert saved[SHEET]['B2'].value == 'bonjour'
+    # the later update wins over the value of the file
+    assert saved[SHEET]['B4'].value == 'adieu'
+    assert saved['_hidden'].sheet_state == 'hidden'
+    assert [list(row) for row in saved['_hidden'].iter_rows(values_only=True)] == [['key', 'value'], ['a', 1]]